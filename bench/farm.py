@@ -0,0 +1,168 @@
+"""
+Synthetic resolver farm: thousands of UDP DNS responders on loopback
+addresses, with configurable delay, loss and dead rates. Runs in a child
+process so it doesn't share the GIL with the code being measured.
+
+    python3 bench/farm.py --count 2000 --delay 5 40 --loss 0.02 --dead 0.1
+
+Binding port 53 needs root (or CAP_NET_BIND_SERVICE).
+"""
+import argparse
+import asyncio
+import ipaddress
+import multiprocessing
+import random
+import resource
+import signal
+import struct
+
+
+def _answer(query):
+    """A NOERROR reply to an A query with one address (TTL 300), or None for garbage."""
+    if len(query) < 17:
+        return None
+    end = 12
+    while end < len(query) and query[end]:
+        end += 1 + query[end]
+    end += 5  # Root label, qtype, qclass
+    if end > len(query):
+        return None
+    txid, flags = struct.unpack('!HH', query[:4])
+    record = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 300, 4) + bytes([93, 184, 216, 34])
+    return struct.pack('!HHHHHH', txid, 0x8180 | (flags & 0x0100), 1, 1, 0, 0) + query[12:end] + record
+
+
+class _Responder(asyncio.DatagramProtocol):
+    def __init__(self, delay, loss, jitter, rng):
+        self.delay = delay
+        self.loss = loss
+        self.jitter = jitter
+        self.rng = rng
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.delay is None or self.rng.random() < self.loss:
+            return  # Dead server, or this packet is lost
+        response = _answer(data)
+        if response is not None:
+            delay = max(0.0, self.delay + self.rng.uniform(-self.jitter, self.jitter)) / 1000.0
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, response, addr)
+
+
+class ResolverFarm:
+    """
+    count responders on consecutive addresses of network (127.77.0.0/16 by
+    default; all of 127/8 is loopback on Linux). Each address gets a fixed
+    behavior from seed: dead (bound, never answers) with probability dead,
+    otherwise a base delay drawn from delay_ms (min, max) plus +-jitter_ms per
+    answer, and packets lost with probability loss.
+    """
+
+    def __init__(self, count=1000, delay_ms=(5, 50), jitter_ms=2, loss=0.0, dead=0.0, port=53, seed=1,
+                 network="127.77.0.0/16"):
+        hosts = ipaddress.ip_network(network).hosts()
+        self.addresses = [str(next(hosts)) for _ in range(count)]
+        self.port = port
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.seed = seed
+        rng = random.Random(seed)
+        # ip -> base delay in ms, None = dead
+        self.behavior = {ip: None if rng.random() < dead else rng.uniform(*delay_ms) for ip in self.addresses}
+        self._process = None
+        self._stop = None
+
+    @property
+    def alive(self):
+        return [ip for ip, delay in self.behavior.items() if delay is not None]
+
+    def describe(self):
+        delays = [d for d in self.behavior.values() if d is not None]
+        return {"count": len(self.addresses), "alive": len(delays), "loss": self.loss, "port": self.port,
+                "delay_ms_mean": round(sum(delays) / len(delays), 1) if delays else None, "seed": self.seed}
+
+    async def _serve(self, stop):
+        loop = asyncio.get_running_loop()
+        rng = random.Random(self.seed + 1)
+        transports = []
+        try:
+            for ip, delay in self.behavior.items():
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda delay=delay: _Responder(delay, self.loss, self.jitter_ms, rng), local_addr=(ip, self.port))
+                transports.append(transport)
+            stop.send(None)
+            await loop.run_in_executor(None, stop.recv)
+        finally:
+            for transport in transports:
+                transport.close()
+
+    def _main(self, conn):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = len(self.addresses) + 64
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        try:
+            asyncio.run(self._serve(conn))
+        except Exception as e:
+            conn.send(e)
+
+    def start(self, timeout=60):
+        """Starts the responders in a child process and waits until all of them are bound."""
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=self._main, args=(child,), daemon=True)
+        self._process.start()
+        if not parent.poll(timeout):
+            self.stop()
+            raise RuntimeError("Resolver farm did not start in time")
+        error = parent.recv()
+        if error is not None:
+            self.stop()
+            raise RuntimeError(f"Resolver farm failed: {error}")
+        self._stop = parent
+        return self
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.send(None)
+            self._stop = None
+        if self._process is not None:
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a synthetic DNS resolver farm on loopback")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--delay", type=float, nargs=2, default=(5, 50), metavar=("MIN", "MAX"), help="ms")
+    parser.add_argument("--jitter", type=float, default=2, help="ms")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--dead", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=53)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--network", default="127.77.0.0/16")
+    args = parser.parse_args()
+
+    farm = ResolverFarm(args.count, tuple(args.delay), args.jitter, args.loss, args.dead, args.port, args.seed,
+                        args.network)
+    with farm:
+        print(farm.describe(), flush=True)
+        try:
+            signal.sigwait({signal.SIGINT, signal.SIGTERM})
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
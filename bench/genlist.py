@@ -0,0 +1,65 @@
+"""
+Generates DNS list files in the formats the importer accepts ("IP",
+"IP comment", "name IP"), with comments, blank lines, duplicates and
+invalid lines mixed in. The same seed always gives the same file.
+
+    python3 bench/genlist.py 100000 /tmp/list-100k.txt
+"""
+import argparse
+import random
+
+
+def _ipv4(rng):
+    return "%d.%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def _ipv6(rng):
+    return "2001:db8:%x:%x::%x" % (rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16) or 1)
+
+
+def generate_list(path, lines, seed=1, ipv6_share=0.1, named_share=0.3, duplicate_share=0.05, invalid_share=0.02,
+                  comment_share=0.01):
+    """Writes lines lines to path. Returns the counts of each kind of line written."""
+    rng = random.Random(seed)
+    counts = {"lines": lines, "valid": 0, "duplicate": 0, "invalid": 0, "comment": 0}
+    written = []
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            roll = rng.random()
+            if roll < comment_share:
+                f.write("# generated list, part %d\n" % i if i % 2 else "\n")
+                counts["comment"] += 1
+                continue
+            roll -= comment_share
+            if roll < invalid_share:
+                f.write(rng.choice(["300.1.2.3", "not-an-ip", "1.2.3", "dns.example 999.0.0.1"]) + "\n")
+                counts["invalid"] += 1
+                continue
+            roll -= invalid_share
+            if written and roll < duplicate_share:
+                f.write(rng.choice(written) + "\n")
+                counts["duplicate"] += 1
+                continue
+            ip = _ipv6(rng) if rng.random() < ipv6_share else _ipv4(rng)
+            if rng.random() < named_share:
+                line = "dns-%d.example %s" % (i, ip)
+            else:
+                line = ip if rng.random() < 0.5 else "%s resolver %d" % (ip, i)
+            f.write(line + "\n")
+            if len(written) < 10000:
+                written.append(line)
+            counts["valid"] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a DNS list file for benchmarks")
+    parser.add_argument("lines", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(generate_list(args.path, args.lines, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Benchmark harness for the probe, test, import, save, clean and render paths.
+Every stage reports wall time, CPU time, throughput, peak Python memory
+(tracemalloc) and the process max RSS; the results are written as JSON
+that can be compared across commits.
+
+    sudo python3 bench/run.py --servers 2000 --list-lines 10000 100000 --output before.json
+    sudo python3 bench/run.py --servers 2000 --list-lines 10000 100000 --output after.json
+    python3 bench/run.py --compare before.json after.json
+
+The resolver farm binds port 53 on loopback addresses, so the test stages
+need root. Stages whose tools are missing (dig, ping, a display for the
+render stage) are reported as skipped.
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend import DNSBackend  # noqa: E402
+from engine import BenchmarkEngine  # noqa: E402
+from history import ProbeHistory  # noqa: E402
+from store import DNSStore  # noqa: E402
+from farm import ResolverFarm  # noqa: E402
+from genlist import generate_list  # noqa: E402
+
+DOMAIN = "bench.example"
+
+
+class Bench:
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.stages = {}
+
+    def measure(self, name, items, fn):
+        """Runs fn() as stage name; items is the unit count for the throughput. Returns fn's result."""
+        tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = fn()
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.stages[name] = {"wall_s": round(wall, 4), "cpu_s": round(cpu, 4), "items": items,
+                             "per_s": round(items / wall, 1) if wall > 0 else None,
+                             "peak_py_kb": peak // 1024, "max_rss_kb": _max_rss_kb()}
+        print("%-28s %9.3fs %12s/s" % (name, wall, self.stages[name]["per_s"]), flush=True)
+        return result
+
+    def skip(self, name, reason):
+        self.stages[name] = {"skipped": reason}
+        print("%-28s skipped: %s" % (name, reason), flush=True)
+
+    def backend(self, name):
+        """
+        A backend on its own store and history under the work directory. The
+        legacy JSON list in ~ is not migrated, so results don't depend on it.
+        """
+        path = os.path.join(self.workdir, name)
+        os.makedirs(path, exist_ok=True)
+        return DNSBackend(store=DNSStore(os.path.join(path, "list.db")),
+                          history=ProbeHistory(os.path.join(path, "history.db")), save_interval=3600,
+                          legacy_json=None)
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _serve_directory(path):
+    """Serves path over HTTP on a free loopback port, like a real update URL. Returns (server, base_url)."""
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(Handler, directory=path)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_address[1]
+
+
+# --- Import, save, load, clean and render paths ---
+def bench_list(bench, lines, seed):
+    tag = "%dk" % (lines // 1000) if lines < 1000000 else "%dm" % (lines // 1000000)
+    list_dir = os.path.join(bench.workdir, "lists")
+    os.makedirs(list_dir, exist_ok=True)
+    counts = bench.measure("generate[%s]" % tag, lines,
+                           lambda: generate_list(os.path.join(list_dir, "list-%s.txt" % tag), lines, seed))
+    server, base = _serve_directory(list_dir)
+    backend = bench.backend("list-" + tag)
+    try:
+        added = bench.measure("import[%s]" % tag, lines,
+                              lambda: backend.import_from_urls([base + "/list-%s.txt" % tag], force=True))
+        bench.stages["import[%s]" % tag].update(added=added, valid_lines=counts["valid"])
+        bench.measure("save[%s]" % tag, added, backend.model.flush)
+
+        def load():
+            store = DNSStore(backend.store.path)  # A cold store, like at program start
+            try:
+                return store.load()
+            finally:
+                store.close()
+
+        bench.measure("load[%s]" % tag, added, load)
+
+        # Give every entry test results, a third of them over the limits, for the clean path
+        rng = random.Random(seed)
+        for key in backend.model.keys():
+            speed = rng.choice([20, 80, 9999])
+            backend.model.update(key, lambda e, s=speed: e.update(last_speed=s, last_ping=s))
+        backend.model.flush()
+        bench_render(bench, tag, backend)
+
+        def clean():
+            removed = backend.find_violations(backend.model, 400, 300, 0.5)
+            backend.delete_servers(removed)
+            backend.model.flush()
+            return len(removed)
+
+        removed = bench.measure("clean[%s]" % tag, len(backend.model), clean)
+        bench.stages["clean[%s]" % tag]["removed"] = removed
+    finally:
+        server.shutdown()
+        backend.close()
+
+
+def bench_render(bench, tag, backend):
+    """DNSApp.refresh_dns_list on a hidden window, then one draw of the visible rows."""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        bench.skip("render[%s]" % tag, "no display (%s)" % e.__class__.__name__)
+        return
+    try:
+        import types
+        import gui
+        from listview import VirtualTreeview
+
+        root.withdraw()
+        app = types.SimpleNamespace(backend=backend, current_lang="EN")
+        app.tree = VirtualTreeview(root, columns=('name', 'ipv4', 'ping', 'speed'))
+        app.tree.pack()
+
+        def render():
+            gui.DNSApp.refresh_dns_list(app)
+            root.update()
+
+        bench.measure("render[%s]" % tag, len(backend.model), render)
+    finally:
+        root.destroy()
+
+
+# --- Probe and test paths ---
+def bench_probes(bench, farm, calls):
+    backend = bench.backend("probes")
+    ips = farm.alive[:calls]
+    try:
+        for name, fn, args, tool in (("probe.measure_dig_speed", backend.measure_dig_speed, (DOMAIN,), "dig"),
+                                     ("probe.measure_ping", backend.measure_ping, (), "ping"),
+                                     ("probe.measure_native_speed", backend.measure_native_speed, (DOMAIN,), None)):
+            if tool and not shutil.which(tool):
+                bench.skip(name, "%s not installed" % tool)
+                continue
+            results = bench.measure(name, len(ips), lambda fn=fn, args=args: [fn(ip, *args) for ip in ips])
+            bench.stages[name]["answered"] = sum(1 for r in results if r != 9999)
+    finally:
+        backend.close()
+
+
+def bench_tests(bench, farm, concurrency, samples, modes):
+    backend = bench.backend("tests")
+    try:
+        backend.model.replace({"farm-%05d" % i: {"ipv4": [ip], "ipv6": []} for i, ip in enumerate(farm.addresses)})
+        backend.model.flush()
+        targets = backend.test_targets(backend.model)
+        for mode in modes:
+            if mode != "dig" and not _can_ping():
+                bench.skip("test.%s" % mode, "no ICMP socket permission")
+                continue
+            # In-process probers only: the subprocess ones are measured by the probe stages
+            engine = BenchmarkEngine(backend, concurrency=concurrency, probe_timeout=1.0, deadline=600,
+                                     dns_method="native", ping_method="native", samples=samples,
+                                     top_k=max(1, len(targets) // 20), reach_timeout=0.5)
+            results = bench.measure("test.%s" % mode, len(targets),
+                                    lambda: engine.run(targets, mode=mode, domain=DOMAIN))
+            answered = sum(1 for r in results if r.get("speed") not in (None, 9999) or
+                           r.get("ping") not in (None, 9999))
+            bench.stages["test.%s" % mode].update(answered=answered, expected_alive=len(farm.alive))
+
+            def record():
+                for res in results:
+                    backend.record_history(res)
+                    backend.record(res["key"], res)
+                backend.model.flush()
+                backend.flush_history()
+
+            bench.measure("record.%s" % mode, len(results), record)
+    finally:
+        backend.close()
+
+
+def _can_ping():
+    import socket
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+        return True
+    except OSError:
+        return os.geteuid() == 0
+
+
+# --- Output ---
+def _meta(args):
+    def git(*cmd):
+        try:
+            return subprocess.run(["git"] + list(cmd), cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        except Exception:
+            return None
+
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "time": round(time.time()), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "args": vars(args)}
+
+
+def compare(old_path, new_path, threshold):
+    """Prints the wall time and per-item cost change of every stage in both files. Returns 1 on a regression."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("%s -> %s" % ((old["meta"]["commit"] or "?")[:10], (new["meta"]["commit"] or "?")[:10]))
+    print("%-28s %10s %10s %8s %10s" % ("stage", "old s", "new s", "change", "peak kb"))
+    regressed = False
+    for name, stage in new["stages"].items():
+        before = old["stages"].get(name)
+        if not before or "wall_s" not in before or "wall_s" not in stage:
+            continue
+        # Per item, so runs with different sizes still compare
+        old_cost = before["wall_s"] / (before["items"] or 1)
+        new_cost = stage["wall_s"] / (stage["items"] or 1)
+        change = (new_cost - old_cost) / old_cost if old_cost else 0.0
+        flag = ""
+        if change > threshold:
+            flag, regressed = "  SLOWER", True
+        elif change < -threshold:
+            flag = "  faster"
+        print("%-28s %10.3f %10.3f %+7.0f%% %10d%s" % (name, before["wall_s"], stage["wall_s"], change * 100,
+                                                       stage["peak_py_kb"], flag))
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ubuntu DNS Manager benchmarks")
+    parser.add_argument("--servers", type=int, default=2000, help="responders in the resolver farm")
+    parser.add_argument("--delay", type=float, nargs=2, default=(2, 30), metavar=("MIN", "MAX"),
+                        help="farm answer delay in ms")
+    parser.add_argument("--loss", type=float, default=0.02, help="farm packet loss")
+    parser.add_argument("--dead", type=float, default=0.1, help="share of farm servers that never answer")
+    parser.add_argument("--list-lines", type=int, nargs="*", default=[10000, 100000],
+                        help="sizes of the generated list files (up to 1000000)")
+    parser.add_argument("--modes", nargs="*", default=["dig", "ping", "adaptive"],
+                        choices=["all", "ping", "dig", "adaptive"], help="engine test modes to run")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--samples", type=int, default=3)
+    parser.add_argument("--probe-calls", type=int, default=50, help="single measure_* calls per probe stage")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-farm", action="store_true", help="only the list stages (no root needed)")
+    parser.add_argument("--output", help="JSON result file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=0.2, help="--compare: slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    workdir = tempfile.mkdtemp(prefix="dns-bench-")
+    bench = Bench(workdir)
+    result = {"meta": _meta(args), "stages": bench.stages}
+    try:
+        for lines in args.list_lines:
+            bench_list(bench, lines, args.seed)
+        if not args.skip_farm:
+            farm = ResolverFarm(args.servers, tuple(args.delay), loss=args.loss, dead=args.dead, seed=args.seed)
+            result["farm"] = farm.describe()
+            bench.measure("farm.start", args.servers, farm.start)
+            try:
+                bench_probes(bench, farm, args.probe_calls)
+                bench_tests(bench, farm, args.concurrency, args.samples, args.modes)
+            finally:
+                farm.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result["max_rss_kb"] = _max_rss_kb()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -36,7 +36,17 @@ Type=Application
 Categories=Network;Settings;
 EOF
 
-# 5. Permissions
+# 5. Command Line Launcher (headless mode)
+CLI_FILE="/usr/local/bin/ubuntu-dns-manager"
+echo "Creating command line launcher..."
+
+sudo bash -c "cat > $CLI_FILE" <<EOF
+#!/bin/bash
+exec python3 $INSTALL_DIR/src/cli.py "\$@"
+EOF
+sudo chmod +x $CLI_FILE
+
+# 6. Permissions
 sudo chmod +x $DESKTOP_FILE
 sudo chmod -R 755 "$INSTALL_DIR"
 
@@ -3,15 +3,40 @@ import os
 import subprocess
 import re
 import ipaddress
-import urllib.request
+import time
 
-# Global configuration file path (same as used in config.py)
+import metrics
+import stats
+from stats import DEAD
+from store import DNSStore
+from history import ProbeHistory
+from model import DNSModel
+from importer import ListImporter
+
+# Old whole-file JSON list, migrated into the SQLite store on first start
 CONFIG_FILE = os.path.expanduser("~/.ubuntu_dns_manager_data.json")
+ACTIVE_TTL = 30  # Seconds the active connection lookup is reused
+DNS_PROPERTIES = ('ipv4.dns', 'ipv6.dns', 'ipv4.ignore-auto-dns', 'ipv6.ignore-auto-dns', 'ipv4.method', 'ipv6.method')
 
 
 class DNSBackend:
-    def __init__(self):
-        self.data = self.load_dns_list()
+    def __init__(self, store=None, history=None, save_interval=2.0, legacy_json=None):
+        self.store = store or DNSStore()
+        self.history = history or ProbeHistory()
+        if legacy_json:
+            # The app passes CONFIG_FILE; other backends (benchmarks, tests) stay independent of ~
+            self.store.migrate_json(legacy_json)
+        # The one shared, thread-safe copy of the list; it persists itself (see DNSModel)
+        self.model = DNSModel(self.store, interval=save_interval)
+        self.data = self.model
+        self.last_import_report = []
+        self.nmcli = "nmcli"  # Command used for NetworkManager, can point at a fake for testing
+        self._active_cache = None
+
+    def close(self):
+        """Writes pending changes. Call before exiting."""
+        self.model.close()
+        self.flush_history()
 
     def _is_valid_ip(self, ip_str):
         """Validates if a string is a valid IPv4 or IPv6 address."""
@@ -22,157 +47,249 @@ class DNSBackend:
             return False
 
     def load_dns_list(self):
-        """Loads DNS list from the JSON file."""
-        if not os.path.exists(CONFIG_FILE):
-            return {}
+        """Returns a private copy of the DNS list. Use self.model to share and change the live list."""
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                data = json.load(f)
-                # Ensure data is a dict and its values are dictionaries
-                if isinstance(data, dict):
-                    return {k: v for k, v in data.items() if isinstance(v, dict)}
-            return {}
+            return self.model.snapshot()
         except Exception:
             return {}
 
     def save_dns_list(self, data):
-        """Saves the current DNS list data."""
-        self.data = data
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        """Replaces the list with data. Only changed entries are written, on the model's next flush."""
+        if data is not self.model:
+            self.model.replace(data)
+
+    def delete_servers(self, keys):
+        """Removes entries from the list; the store is updated in one transaction on the next flush."""
+        return self.model.remove(keys)
+
+    def record(self, key, result):
+        """Stores a benchmark engine result in the live list. Returns False if the entry was deleted meanwhile."""
+        return self.model.update(key, lambda entry: self.record_result(entry, result))
+
+    def test_targets(self, data, keys=None, all_addresses=True):
+        """Returns (key, ip) pairs to benchmark: every address of each entry, or only the first one."""
+        targets = []
+        for key in (data if keys is None else keys):
+            entry = data.get(key)
+            if not entry: continue
+            ips = list(dict.fromkeys(entry.get('ipv4', []) + entry.get('ipv6', [])))
+            targets.extend((key, ip) for ip in (ips if all_addresses else ips[:1]))
+        return targets
+
+    def record_result(self, entry, result):
+        """Stores a benchmark engine result (entry score and per-address results) in a DNS entry."""
+        for kind in stats.KINDS:
+            if result.get(kind) is not None:
+                entry['last_' + kind] = result[kind]
+                entry[kind + '_stats'] = result[kind + "_stats"]
+        if result.get("transports"):
+            entry['transports'] = self._transport_summary(result["transports"])
+        if result.get("verdict"):
+            entry['verdict'] = result["verdict"]
+        if result.get("mode"):
+            # When each test mode last covered the entry, so later runs can skip fresh entries
+            entry.setdefault('tested', {})[result["mode"]] = int(time.time())
+
+        addresses = entry.setdefault('addresses', {})
+        for ip, res in result.get("addresses", {}).items():
+            stored = addresses.setdefault(ip, {})
+            for kind in stats.KINDS:
+                if res.get(kind) is not None:
+                    stored['last_' + kind] = res[kind]
+                    stored[kind + '_stats'] = res[kind + "_stats"]
+            if res.get("transports"):
+                stored['transports'] = self._transport_summary(res["transports"])
+            if res.get("verdict") and res["verdict"]["ok"] is not None:
+                stored['verdict'] = res["verdict"]
+        # Drop results of addresses that are no longer in the entry
+        current = set(entry.get('ipv4', []) + entry.get('ipv6', []))
+        for ip in [ip for ip in addresses if ip not in current]:
+            del addresses[ip]
+
+    def _transport_summary(self, transports):
+        """Per-transport results without the raw samples, as stored in an entry."""
+        return {name: {k: v for k, v in t.items() if k != "query_samples"} for name, t in transports.items()}
+
+    def ordered_dns(self, entry):
+        """The (ipv4, ipv6) lists of an entry, fastest measured address first."""
+        return (stats.address_order(entry, entry.get("ipv4", [])),
+                stats.address_order(entry, entry.get("ipv6", [])))
+
+    def record_history(self, result):
+        """Appends the raw samples of a benchmark engine result (evicted ones too) to the probe history."""
+        try:
+            for res in result.get("addresses", {}).values() or [result]:
+                self.history.add_result(res)
+        except Exception as e:
+            print(f"Error writing probe history: {e}")
 
-    def import_from_urls(self, urls):
-        """Fetches DNS lists from URLs and updates the internal data."""
-        new_entries_count = 0
-        new_data = self.load_dns_list()
+    def flush_history(self):
+        try:
+            self.history.flush()
+        except Exception as e:
+            print(f"Error writing probe history: {e}")
 
-        for url in urls:
-            try:
-                with urllib.request.urlopen(url, timeout=10) as response:
-                    content = response.read().decode('utf-8')
-
-                    # Process content line by line
-                    for line in content.splitlines():
-                        # Skip comments and empty lines
-                        line = line.strip()
-                        if not line or line.startswith(('#', '//')):
-                            continue
-
-                        # A line might be just an IP or a name/IP pair
-                        parts = re.split(r'\s+', line, maxsplit=1)
-
-                        # Default name is the IP itself
-                        ip_str = parts[0]
-                        name = ip_str
-
-                        # Try to handle common formats (IP alone or IP/Name pair)
-                        if len(parts) > 1 and self._is_valid_ip(parts[1]):
-                            # Format is: name IP
-                            name = parts[0]
-                            ip_str = parts[1]
-                        elif not self._is_valid_ip(ip_str) and len(parts) > 1 and self._is_valid_ip(parts[1]):
-                            # Format is: Name IP (where Name is not an IP)
-                            name = parts[0]
-                            ip_str = parts[1]
-                        elif self._is_valid_ip(ip_str):
-                            # IP is the first part, use IP as name
-                            pass
-                        else:
-                            continue  # Not a valid IP line
-
-                        ip_str = ip_str.strip()
-
-                        # Separate IPv4 and IPv6
-                        if self._is_valid_ip(ip_str):
-                            ip_type = ipaddress.ip_address(ip_str)
-
-                            # Check if entry already exists (based on name)
-                            if name not in new_data:
-                                new_data[name] = {
-                                    "ipv4": [],
-                                    "ipv6": [],
-                                    "last_ping": '-',
-                                    "last_speed": '-'
-                                }
-
-                            # Add IP if not already present in the respective list
-                            if ip_type.version == 4:
-                                if ip_str not in new_data[name]["ipv4"]:
-                                    new_data[name]["ipv4"].append(ip_str)
-                                    new_entries_count += 1
-                            elif ip_type.version == 6:
-                                if ip_str not in new_data[name]["ipv6"]:
-                                    new_data[name]["ipv6"].append(ip_str)
-                                    new_entries_count += 1
-
-            except Exception as e:
-                print(f"Error importing from {url}: {e}")
-                continue
-
-        self.save_dns_list(new_data)
-        return new_entries_count
+    def get_test_job(self, mode):
+        """The unfinished test job of mode ({"mode", "started", ...}), or None."""
+        try:
+            value = self.store.get_meta("test_job." + mode)
+            return json.loads(value) if value else None
+        except Exception as e:
+            print(f"Error reading test job: {e}")
+            return None
 
-    def get_active_connection(self):
-        """Gets the active network connection name using nmcli."""
+    def set_test_job(self, mode, job):
+        """Stores the running test job of mode; None marks it finished."""
         try:
-            result = subprocess.run(['nmcli', '-t', '-f', 'NAME,DEVICE,STATE', 'con'], capture_output=True, text=True,
-                                    check=True)
+            self.store.set_meta("test_job." + mode, json.dumps(job) if job else None)
+        except Exception as e:
+            print(f"Error saving test job: {e}")
+
+    def history_stats(self, ips, kind="dns", window=24 * 3600):
+        """Rolling p50/p95/loss per IP from the probe history (see ProbeHistory.percentiles)."""
+        return self.history.percentiles(kind=kind, window=window, ips=ips)
+
+    def find_violations(self, data, ping_limit, speed_limit, loss_limit):
+        """Keys of entries that break the auto-clean rules (dead, lossy or over the limits)."""
+        return [k for k, v in data.items() if stats.violates_limits(v, ping_limit, speed_limit, loss_limit)]
+
+    def rank_servers(self, data=None):
+        """Returns the DNS list keys ordered from best to worst by their stored statistics."""
+        return stats.rank(self.data if data is None else data)
+
+    def import_from_urls(self, urls, refresh_interval=0, force=False):
+        """
+        Fetches DNS lists from URLs and updates the internal data.
+        Sources fetched less than refresh_interval seconds ago, or whose content
+        did not change, are skipped (unless force is set).
+        Per-source status, line/valid/added counts and errors are kept in last_import_report.
+        """
+        # Merge into copies of the address lists only, so tests running meanwhile keep their results
+        new_data = {k: {"ipv4": list(v.get("ipv4", [])), "ipv6": list(v.get("ipv6", []))} for k, v in self.model.items()}
+        existing = set(new_data)
+        importer = ListImporter(cache=self.store, refresh_interval=refresh_interval)
+        started = time.monotonic()
+        new_entries_count, self.last_import_report = importer.merge_into(new_data, urls, force=force)
+        elapsed = time.monotonic() - started
+
+        lines = 0
+        for report in self.last_import_report:
+            lines += report["lines"]
+            metrics.IMPORT_VALID.inc(report["valid"])
+            if report["error"]:
+                metrics.IMPORT_ERRORS.inc()
+                print(f"Error importing from {report['url']}: {report['error']}")
+        metrics.IMPORT_LINES.inc(lines)
+        metrics.IMPORT_ADDED.inc(new_entries_count)
+        metrics.IMPORT_DURATION.observe(elapsed)
+        if lines:
+            metrics.IMPORT_RATE.set(round(lines / elapsed, 1) if elapsed > 0 else 0)
+
+        if new_entries_count:
+            for name, entry in new_data.items():
+                current = self.model.get(name)
+                if current is None:
+                    if name not in existing:  # Deleted while the import ran: stays deleted
+                        self.model.set(name, entry)
+                elif current.get("ipv4", []) != entry["ipv4"] or current.get("ipv6", []) != entry["ipv6"]:
+                    self.model.update(name, lambda e, new=entry: e.update(ipv4=new["ipv4"], ipv6=new["ipv6"]))
+        return new_entries_count
 
-            for line in result.stdout.strip().split('\n'):
-                parts = line.split(':')
-                if len(parts) >= 3 and parts[2] == 'activated':
-                    return parts[0]
-            return None
+    def _nmcli(self, *args):
+        """Runs nmcli (self.nmcli, so tests can point it at a fake) and returns its stdout."""
+        return subprocess.run([self.nmcli] + list(args), capture_output=True, text=True, check=True).stdout
+
+    def _active(self, refresh=False):
+        """(connection, device) of the active connection, cached for ACTIVE_TTL seconds."""
+        cached = self._active_cache
+        if not refresh and cached and time.monotonic() - cached[0] < ACTIVE_TTL:
+            return cached[1]
+        active = None
+        for line in self._nmcli('-t', '-f', 'NAME,DEVICE,STATE', 'con', 'show', '--active').strip().split('\n'):
+            # -t escapes colons inside fields as \:
+            parts = [p.replace('\0', ':') for p in line.replace('\\:', '\0').split(':')]
+            if len(parts) >= 3 and parts[2] == 'activated':
+                active = (parts[0], parts[1])
+                break
+        self._active_cache = (time.monotonic(), active)
+        return active
+
+    def get_active_connection(self, refresh=False):
+        """Gets the active network connection name using nmcli (cached for a short while)."""
+        try:
+            active = self._active(refresh)
+            return active[0] if active else None
         except Exception as e:
+            metrics.SUBPROCESS_ERRORS.labels("nmcli", metrics.error_name(e)).inc()
             print(f"Error getting connection info: {e}")
             return None
 
-    def set_dns(self, conn_name, ipv4_list, ipv6_list):
-        """Sets DNS for a specific connection using nmcli."""
-        ipv4_str = ' '.join(ipv4_list)
-        ipv6_str = ' '.join(ipv6_list)
-
+    def _dns_settings(self, conn_name):
+        """The DNS related properties of a connection (see DNS_PROPERTIES), read in one call."""
+        out = self._nmcli('-g', ','.join(DNS_PROPERTIES), 'con', 'show', conn_name)
+        lines = (out.split('\n') + [''] * len(DNS_PROPERTIES))[:len(DNS_PROPERTIES)]
+        settings = dict(zip(DNS_PROPERTIES, (line.strip() for line in lines)))
+        for prop in ('ipv4.dns', 'ipv6.dns'):
+            # -g escapes the colons of IPv6 addresses; lists are separated by commas (spaces in old versions)
+            settings[prop] = [ip for ip in re.split(r'[,\s]+', settings[prop].replace('\\:', ':')) if ip]
+        return settings
+
+    def get_dns(self, conn_name):
+        """Returns the (ipv4, ipv6) DNS server lists configured on a connection."""
         try:
-            # Set method to manual for DNS servers
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv4.method', 'manual'], check=True,
-                           capture_output=True)
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv6.method', 'manual'], check=True,
-                           capture_output=True)
-
-            # Set DNS servers
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv4.dns', ipv4_str], check=True, capture_output=True)
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv6.dns', ipv6_str], check=True, capture_output=True)
-
-            # Reapply connection
-            subprocess.run(['nmcli', 'con', 'up', conn_name], check=True, capture_output=True)
-
-            return True, "DNS updated."
+            settings = self._dns_settings(conn_name)
+            return settings['ipv4.dns'], settings['ipv6.dns']
+        except Exception as e:
+            metrics.SUBPROCESS_ERRORS.labels("nmcli", metrics.error_name(e)).inc()
+            print(f"Error getting DNS info: {e}")
+            return [], []
+
+    def _apply(self, conn_name, wanted, done_msg):
+        """
+        Sets the wanted properties ({property: value}) with one 'con modify' and
+        a 'device reapply' (no down/up, so open connections survive). Nothing is
+        run when the connection already has them.
+        """
+        try:
+            current = self._dns_settings(conn_name)
+            if all(current[prop] == value for prop, value in wanted.items()):
+                return True, "DNS already up to date."
+            args = []
+            for prop, value in wanted.items():
+                args += [prop, ' '.join(value) if isinstance(value, list) else value]
+            self._nmcli('con', 'modify', conn_name, *args)
+
+            active = self._active()
+            device = active[1] if active and active[0] == conn_name else None
+            try:
+                if not device:
+                    raise subprocess.CalledProcessError(1, 'reapply')
+                self._nmcli('device', 'reapply', device)
+            except subprocess.CalledProcessError:
+                # Inactive connection, or a device/NM version that can't reapply: fall back to a full up
+                self._nmcli('con', 'up', conn_name)
+            return True, done_msg
         except subprocess.CalledProcessError as e:
-            return False, f"nmcli Error: {e.stderr.strip()}"
+            self._active_cache = None
+            metrics.SUBPROCESS_ERRORS.labels("nmcli", "exit_status").inc()
+            return False, f"nmcli Error: {(e.stderr or '').strip()}"
         except Exception as e:
+            self._active_cache = None
+            metrics.SUBPROCESS_ERRORS.labels("nmcli", metrics.error_name(e)).inc()
             return False, f"An unknown error occurred: {e}"
 
+    def set_dns(self, conn_name, ipv4_list, ipv6_list):
+        """Sets DNS for a specific connection using nmcli. DHCP keeps the addresses but its DNS is ignored."""
+        return self._apply(conn_name, {'ipv4.dns': list(ipv4_list), 'ipv4.ignore-auto-dns': 'yes',
+                                       'ipv6.dns': list(ipv6_list), 'ipv6.ignore-auto-dns': 'yes'},
+                           "DNS updated.")
+
     def clear_dns(self, conn_name):
         """Resets the DNS settings to automatic (DHCP)."""
-        try:
-            # Clear manually set DNS
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv4.dns', '""'], check=True, capture_output=True)
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv6.dns', '""'], check=True, capture_output=True)
-
-            # Set method back to auto/dhcp
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv4.method', 'auto'], check=True,
-                           capture_output=True)
-            subprocess.run(['nmcli', 'con', 'modify', conn_name, 'ipv6.method', 'auto'], check=True,
-                           capture_output=True)
-
-            # Reapply connection
-            subprocess.run(['nmcli', 'con', 'up', conn_name], check=True, capture_output=True)
-
-            return True, "DNS reset to DHCP."
-        except subprocess.CalledProcessError as e:
-            return False, f"nmcli Error: {e.stderr.strip()}"
-        except Exception as e:
-            return False, f"An unknown error occurred: {e}"
+        # The methods are reset too, for connections switched to manual by older versions
+        return self._apply(conn_name, {'ipv4.dns': [], 'ipv4.ignore-auto-dns': 'no', 'ipv4.method': 'auto',
+                                       'ipv6.dns': [], 'ipv6.ignore-auto-dns': 'no', 'ipv6.method': 'auto'},
+                           "DNS reset to DHCP.")
 
     def measure_ping(self, ip):
         """Measures ping latency (average) in milliseconds."""
@@ -191,7 +308,8 @@ class DNSBackend:
                 return round(float(match.group(1)))
 
             return 9999  # Ping failed (Dead)
-        except Exception:
+        except Exception as e:
+            metrics.SUBPROCESS_ERRORS.labels("ping", metrics.error_name(e)).inc()
             return 9999  # General failure or timeout
 
     def measure_dig_speed(self, dns_server, domain="google.com"):
@@ -207,5 +325,24 @@ class DNSBackend:
                 return int(match.group(1))
 
             return 9999  # Dig failed (Dead)
+        except Exception as e:
+            metrics.SUBPROCESS_ERRORS.labels("dig", metrics.error_name(e)).inc()
+            return 9999  # General failure or timeout
+
+    def measure_native_speed(self, dns_server, domain="google.com"):
+        """Measures DNS resolution time in milliseconds without spawning dig."""
+        # Imported here so the headless CLI doesn't pay for asyncio unless it probes
+        import asyncio
+        from dnsprobe import DNSProber
+
+        async def probe():
+            prober = DNSProber(timeout=2.0, sockets=1)
+            try:
+                return await prober.measure(dns_server, domain)
+            finally:
+                prober.close()
+
+        try:
+            return asyncio.run(probe())
         except Exception:
-            return 9999  # General failure or timeout
\ No newline at end of file
+            return DEAD
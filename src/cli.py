@@ -0,0 +1,439 @@
+"""
+Headless command line / daemon mode for Ubuntu DNS Manager.
+Runs on DNSBackend only and never imports tkinter or the Persian shaping
+libraries, so it starts fast on servers without a display.
+
+    python3 src/cli.py import
+    python3 src/cli.py test --mode all --concurrency 200 --auto-clean
+    python3 src/cli.py test --mode resolve --domains example.com wikipedia.org
+    python3 src/cli.py test --mode transport --transports dot doh udp
+    python3 src/cli.py list --sort rank --limit 20 --format csv
+    python3 src/cli.py history --kind dns --hours 24
+    python3 src/cli.py history --ip 1.1.1.1 --hours 168
+    python3 src/cli.py apply-best
+    python3 src/cli.py daemon --interval 60 --import --clean --apply-best
+    python3 src/cli.py monitor --latency-limit 120 --cooldown 300
+    python3 src/cli.py forward --apply
+    python3 src/cli.py daemon --metrics-port 9153
+    python3 src/cli.py test --mode dig --profile /tmp/test.prof
+    python3 src/cli.py test --all
+"""
+import argparse
+import cProfile
+import csv
+import json
+import signal
+import sys
+import threading
+import time
+
+from backend import DNSBackend, CONFIG_FILE
+from testjob import TestJob
+import config
+import metrics
+import stats
+
+LIST_FIELDS = ("name", "ipv4", "ipv6", "last_ping", "last_speed", "ping_p95", "ping_loss", "speed_p95",
+               "speed_loss", "cached_p50", "uncached_p50", "uncached_p95", "transports", "issues", "dnssec")
+TEST_FIELDS = ("key", "ip", "ping", "speed", "cached", "uncached", "verdict", "evicted")
+HISTORY_FIELDS = ("name", "ip", "count", "loss", "p50", "p95", "min", "max")
+TREND_FIELDS = ("hour", "count", "loss", "p50", "p95", "min", "max")
+
+
+def _row(name, entry):
+    ping = stats.entry_stats(entry, "ping") or {}
+    speed = stats.entry_stats(entry, "speed") or {}
+    verdict = entry.get("verdict") or {}
+    cached = entry.get("cached_stats") or {}
+    uncached = entry.get("uncached_stats") or {}
+    return {"name": name, "ipv4": entry.get("ipv4", []), "ipv6": entry.get("ipv6", []),
+            "last_ping": entry.get("last_ping", '-'), "last_speed": entry.get("last_speed", '-'),
+            "ping_p95": ping.get("p95"), "ping_loss": ping.get("loss"),
+            "speed_p95": speed.get("p95"), "speed_loss": speed.get("loss"),
+            "cached_p50": cached.get("p50"), "uncached_p50": uncached.get("p50"), "uncached_p95": uncached.get("p95"),
+            "transports": {name: {"setup": t["setup"], "p50": t["query_stats"]["p50"], "loss": t["query_stats"]["loss"]}
+                           for name, t in (entry.get("transports") or {}).items()},
+            "issues": verdict.get("issues", []), "dnssec": verdict.get("dnssec")}
+
+
+def _cell(value):
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ' '.join(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def emit(result, fmt, fields=None, out=None):
+    """Writes a command result (a dict or a list of dicts) as JSON or CSV."""
+    out = out or sys.stdout
+    if fmt == "csv":
+        rows = result if isinstance(result, list) else [result]
+        writer = csv.DictWriter(out, fieldnames=fields or (list(rows[0]) if rows else []), extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: _cell(v) for k, v in row.items()})
+    else:
+        json.dump(result, out, indent=2, ensure_ascii=False)
+        out.write('\n')
+
+
+def cmd_import(backend, args):
+    urls = args.urls or config.get_setting("update_urls")
+    added = backend.import_from_urls(urls, refresh_interval=config.get_setting("source_refresh_minutes") * 60,
+                                     force=args.force)
+    return {"added": added, "sources": backend.last_import_report}
+
+
+def cmd_test(backend, args):
+    from engine import BenchmarkEngine  # Only the test commands need asyncio and the probers
+
+    data = backend.model
+    keys = [k for k in data if not args.filter or args.filter.lower() in k.lower()]
+    engine = BenchmarkEngine(backend,
+                             concurrency=args.concurrency or config.get_setting("test_concurrency"),
+                             probe_timeout=args.timeout or config.get_setting("probe_timeout"),
+                             deadline=args.deadline or config.get_setting("test_deadline"),
+                             dns_method=args.dns_method or config.get_setting("dns_probe_method"),
+                             ping_method=args.ping_method or config.get_setting("ping_probe_method"),
+                             samples=args.samples or config.get_setting("probe_samples"),
+                             top_k=args.top_k or config.get_setting("adaptive_top_k"),
+                             reach_timeout=config.get_setting("reach_timeout_ms") / 1000.0,
+                             score=args.score or config.get_setting("entry_score"),
+                             transports=args.transports or config.get_setting("probe_transports"),
+                             doh_url=config.get_setting("doh_url"),
+                             verify_tls=config.get_setting("verify_tls"),
+                             verify_options=None if args.no_verify or not config.get_setting("verify_responses")
+                             else config.get_setting("verify_options"))
+    # The daemon re-ranks everything each cycle; a single test skips servers tested recently
+    stale = args.stale if args.stale is not None else \
+        0 if args.command == "daemon" else config.get_setting("retest_after_minutes")
+    job = TestJob(backend, engine, args.mode, keys, max_age=0 if args.all else stale * 60,
+                  checkpoint_interval=config.get_setting("checkpoint_interval_s"),
+                  all_addresses=not args.first_address and config.get_setting("test_all_addresses"),
+                  resume=not args.all)
+    if job.resumed or job.skipped:
+        print(f"Testing {len(job.keys)} servers, skipping {job.skipped} tested recently"
+              f"{' (resuming an interrupted run)' if job.resumed else ''}", file=sys.stderr)
+
+    ping_limit = config.get_setting("ping_limit")
+    speed_limit = config.get_setting("speed_limit")
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    previous = _cancel_on_signals(job)
+    try:
+        results = job.run(domain=args.domain or config.get_setting("test_domain"),
+                          ping_limit=ping_limit if args.auto_clean else None,
+                          speed_limit=speed_limit if args.auto_clean else None,
+                          loss_limit=config.get_setting("loss_limit"),
+                          cutoff=(ping_limit, speed_limit),
+                          domains=args.domains or config.get_setting("benchmark_domains"))
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)  # Read with: python3 -m pstats FILE
+    if job.cancelled:
+        print("Test stopped, run it again to resume", file=sys.stderr)
+
+    backend.delete_servers([res["key"] for res in results if res["evicted"]])
+    return results
+
+
+def _cancel_on_signals(job):
+    """
+    Cancels job on SIGINT/SIGTERM (it stays resumable), then runs the previous
+    handler (e.g. the daemon's stop). Returns the previous handlers.
+    """
+    previous = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+
+    def handler(sig, frame):
+        job.cancel()
+        chained = previous[sig]
+        if callable(chained) and chained is not signal.default_int_handler:
+            chained(sig, frame)
+
+    for sig in previous:
+        signal.signal(sig, handler)
+    return previous
+
+
+def cmd_clean(backend, args):
+    data = backend.model
+    removed = backend.find_violations(data, config.get_setting("ping_limit"), config.get_setting("speed_limit"),
+                                      config.get_setting("loss_limit"))
+    backend.delete_servers(removed)
+    return {"removed": len(removed), "servers": removed}
+
+
+def cmd_list(backend, args):
+    data = backend.model
+    keys = [k for k in data if not args.filter or args.filter.lower() in k.lower()
+            or any(args.filter in ip for ip in data[k].get("ipv4", []) + data[k].get("ipv6", []))]
+    if args.sort == "rank":
+        keys = stats.rank({k: data[k] for k in keys})
+    elif args.sort in ("ping", "speed"):
+        keys.sort(key=lambda k: stats.sort_key(data[k], args.sort))
+    else:
+        keys.sort(key=str.lower)
+    if args.limit:
+        keys = keys[:args.limit]
+    return [_row(k, data[k]) for k in keys]
+
+
+def cmd_history(backend, args):
+    """Rolling percentiles per server, or the hourly trend of one address with --ip."""
+    if args.ip:
+        return backend.history.trend(args.ip, kind=args.kind, hours=args.hours)
+    data = backend.model
+    targets = backend.test_targets(data, [k for k in data if not args.filter or args.filter.lower() in k.lower()])
+    window = backend.history_stats([ip for _, ip in targets], kind=args.kind, window=args.hours * 3600)
+    rows = [dict(window[ip], name=key, ip=ip) for key, ip in targets if ip in window]
+    rows.sort(key=lambda r: (r["p50"] is None, r["p50"] or 0, r["loss"]))
+    return rows[:args.limit] if args.limit else rows
+
+
+def best_server(backend, data):
+    """Best ranked entry that actually answered, or None."""
+    for key in backend.rank_servers(data):
+        s = stats.entry_stats(data[key], "speed") or stats.entry_stats(data[key], "ping")
+        if s and s["p50"] is not None:
+            return key
+    return None
+
+
+def cmd_apply_best(backend, args):
+    data = backend.model
+    key = best_server(backend, data)
+    if key is None:
+        return {"applied": False, "message": "No tested server available."}
+    conn = args.connection or backend.get_active_connection()
+    if not conn:
+        return {"applied": False, "server": key, "message": "No active connection."}
+    ipv4, ipv6 = backend.ordered_dns(data[key])
+    if args.dry_run:
+        return {"applied": False, "server": key, "connection": conn, "ipv4": ipv4, "ipv6": ipv6, "message": "Dry run."}
+    ok, msg = backend.set_dns(conn, ipv4, ipv6)
+    return {"applied": ok, "server": key, "connection": conn, "ipv4": ipv4, "ipv6": ipv6, "message": msg}
+
+
+def cmd_daemon(backend, args):
+    """Runs import/test/clean/apply-best every --interval minutes until SIGINT/SIGTERM."""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *a: stop.set())
+
+    while not stop.is_set():
+        started = time.time()
+        cycle = {"started": started}
+        try:
+            if args.do_import:
+                cycle["import"] = cmd_import(backend, args)
+            results = cmd_test(backend, args)
+            cycle["tested"] = len(results)
+            cycle["evicted"] = sum(1 for r in results if r["evicted"])
+            if args.clean:
+                cycle["clean"] = cmd_clean(backend, args)["removed"]
+            if args.apply_best:
+                cycle["apply"] = cmd_apply_best(backend, args)
+        except Exception as e:
+            cycle["error"] = str(e)
+        cycle["duration"] = round(time.time() - started, 1)
+        print(json.dumps(cycle, ensure_ascii=False), flush=True)
+        stop.wait(max(0, args.interval * 60 - (time.time() - started)))
+    return None
+
+
+def cmd_monitor(backend, args):
+    """Watches the applied server and fails over to a better one; prints one JSON line per event."""
+    from monitor import FailoverMonitor
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *a: stop.set())
+
+    def setting(value, key):
+        return config.get_setting(key) if value is None else value
+
+    monitor = FailoverMonitor(backend, connection=args.connection,
+                              interval=setting(args.interval, "monitor_interval_s"),
+                              window=setting(args.window, "monitor_window"),
+                              candidates=setting(args.candidates, "monitor_candidates"),
+                              latency_limit=setting(args.latency_limit, "monitor_latency_ms"),
+                              loss_limit=setting(args.loss_limit, "monitor_loss"),
+                              trip_count=config.get_setting("monitor_trip_count"),
+                              cooldown=setting(args.cooldown, "monitor_cooldown_s"),
+                              hysteresis=setting(args.hysteresis, "monitor_hysteresis"),
+                              domain=config.get_setting("test_domain"),
+                              dry_run=args.dry_run,
+                              on_event=lambda e: print(json.dumps(e, ensure_ascii=False), flush=True))
+    monitor.run(stop)
+    return None
+
+
+def cmd_forward(backend, args):
+    """Runs the local caching forwarder until SIGINT/SIGTERM; prints one JSON line per event."""
+    from forwarder import DNSForwarder
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *a: stop.set())
+
+    def setting(value, key):
+        return config.get_setting(key) if value is None else value
+
+    def print_event(event):
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+
+    address = setting(args.address, "forwarder_address")
+    forwarder = DNSForwarder(backend, address=address, port=args.port, upstreams=args.upstreams,
+                             pool=setting(args.pool, "forwarder_pool"),
+                             race=setting(args.race, "forwarder_race"),
+                             timeout=config.get_setting("probe_timeout"),
+                             cache_size=config.get_setting("forwarder_cache_size"),
+                             negative_ttl=config.get_setting("forwarder_negative_ttl"),
+                             feedback_interval=config.get_setting("forwarder_feedback_s"),
+                             on_event=print_event)
+    conn = None
+
+    def on_ready(error):
+        nonlocal conn
+        if error is not None or not args.apply:
+            return
+        if args.port != 53:
+            print_event({"event": "apply_failed", "message": "NetworkManager only supports port 53."})
+            return
+        conn = args.connection or backend.get_active_connection()
+        ok, msg = backend.set_dns(conn, [address], []) if conn else (False, "No active connection.")
+        print_event({"event": "applied" if ok else "apply_failed", "connection": conn, "message": msg})
+        if not ok:
+            conn = None
+
+    try:
+        forwarder.run(stop, on_ready)
+    finally:
+        if conn:
+            # Point the connection back at a real server, the forwarder is going away
+            key = best_server(backend, backend.model)
+            if key is not None:
+                ok, msg = backend.set_dns(conn, *backend.ordered_dns(backend.model[key]))
+                print_event({"event": "restored", "server": key, "connection": conn, "message": msg})
+    return None
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--format", choices=["json", "csv"], default="json", help="output format")
+    common.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    common.add_argument("--metrics-file", help="write Prometheus metrics to this file")
+
+    parser = argparse.ArgumentParser(prog="ubuntu-dns-manager", description="Ubuntu DNS Manager (headless mode)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", parents=[common], help="import servers from the update URLs")
+    p.add_argument("urls", nargs="*", help="URLs to import (default: update_urls from the settings)")
+    p.add_argument("--force", action="store_true", help="download and merge every source again, even unchanged ones")
+
+    def add_test_options(p):
+        p.add_argument("--mode", choices=["all", "ping", "dig", "adaptive", "resolve", "transport"],
+                       default="all")
+        p.add_argument("--top-k", type=int, help="adaptive mode: servers that get the full measurement")
+        p.add_argument("--filter", help="only test servers whose name contains this text")
+        p.add_argument("--concurrency", type=int, help="servers probed at the same time")
+        p.add_argument("--timeout", type=float, help="seconds per probe")
+        p.add_argument("--deadline", type=float, help="seconds for the whole run")
+        p.add_argument("--samples", type=int, help="samples per server")
+        p.add_argument("--domain", help="domain used for DNS queries")
+        p.add_argument("--domains", nargs="+", help="resolve mode: domains for the cache-hit/miss lookups")
+        p.add_argument("--transports", nargs="+", choices=["udp", "tcp", "dot", "doh"],
+                       help="transport mode: transports to measure (the first one is the headline speed)")
+        p.add_argument("--first-address", action="store_true", help="only probe the first address of each server")
+        p.add_argument("--score", choices=["best", "worst", "weighted"], help="how a server's addresses are combined")
+        p.add_argument("--dns-method", choices=["dig", "native"])
+        p.add_argument("--ping-method", choices=["ping", "native"])
+        p.add_argument("--no-verify", action="store_true", help="skip the answer correctness check")
+        p.add_argument("--auto-clean", action="store_true", help="remove servers that break the limits (fail-fast)")
+        p.add_argument("--profile", help="write a cProfile dump of each test run to this file")
+        p.add_argument("--stale", type=float, metavar="MINUTES",
+                       help="skip servers tested in this mode within MINUTES (default: retest_after_minutes)")
+        p.add_argument("--all", action="store_true", help="test every server, don't skip or resume")
+
+    add_test_options(sub.add_parser("test", parents=[common], help="benchmark the servers in the list"))
+    sub.add_parser("clean", parents=[common], help="remove servers that break the auto-clean rules")
+
+    p = sub.add_parser("list", parents=[common], help="print the server list")
+    p.add_argument("--sort", choices=["name", "ping", "speed", "rank"], default="rank")
+    p.add_argument("--filter", help="only servers whose name or address contains this text")
+    p.add_argument("--limit", type=int)
+
+    p = sub.add_parser("history", parents=[common], help="rolling latency percentiles from past test runs")
+    p.add_argument("--kind", choices=["dns", "ping", "cached", "uncached"], default="dns")
+    p.add_argument("--hours", type=float, default=24, help="window to summarize")
+    p.add_argument("--ip", help="hourly trend of one address instead of the per-server summary")
+    p.add_argument("--filter", help="only servers whose name contains this text")
+    p.add_argument("--limit", type=int)
+
+    p = sub.add_parser("apply-best", parents=[common], help="apply the best ranked server to the active connection")
+    p.add_argument("--connection", help="NetworkManager connection (default: the active one)")
+    p.add_argument("--dry-run", action="store_true")
+
+    p = sub.add_parser("monitor", parents=[common], help="fail over to a better server when the applied one degrades")
+    p.add_argument("--connection", help="NetworkManager connection (default: the active one)")
+    p.add_argument("--interval", type=float, help="seconds between probes")
+    p.add_argument("--window", type=int, help="probes per server in the rolling window")
+    p.add_argument("--candidates", type=int, help="top ranked alternatives to probe")
+    p.add_argument("--latency-limit", type=float, help="rolling p50 (ms) above which the server is bad")
+    p.add_argument("--loss-limit", type=float, help="rolling loss above which the server is bad")
+    p.add_argument("--cooldown", type=float, help="minimum seconds between switches")
+    p.add_argument("--hysteresis", type=float, help="how much faster (fraction) a replacement must be")
+    p.add_argument("--dry-run", action="store_true", help="report failovers without applying them")
+
+    p = sub.add_parser("forward", parents=[common], help="run the local caching DNS forwarder")
+    p.add_argument("--address", help="address to listen on (default: forwarder_address from the settings)")
+    p.add_argument("--port", type=int, default=53)
+    p.add_argument("--upstreams", nargs="+", help="fixed upstream addresses instead of the best ranked servers")
+    p.add_argument("--pool", type=int, help="best ranked servers to forward to")
+    p.add_argument("--race", type=int, help="upstreams asked at the same time on a cache miss")
+    p.add_argument("--apply", action="store_true", help="point the connection at the forwarder while it runs")
+    p.add_argument("--connection", help="NetworkManager connection (default: the active one)")
+
+    p = sub.add_parser("daemon", parents=[common], help="re-rank the servers on a schedule")
+    add_test_options(p)
+    p.add_argument("--interval", type=float, default=60, help="minutes between runs")
+    p.add_argument("--import", dest="do_import", action="store_true", help="refresh the update URLs each run")
+    p.add_argument("--clean", action="store_true", help="clean by rules after each run")
+    p.add_argument("--apply-best", action="store_true", help="apply the best server after each run")
+    p.add_argument("--connection")
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--force", action="store_true")
+    p.add_argument("urls", nargs="*", help=argparse.SUPPRESS)
+    return parser
+
+
+COMMANDS = {"import": cmd_import, "test": cmd_test, "clean": cmd_clean, "list": cmd_list,
+            "history": cmd_history, "apply-best": cmd_apply_best, "daemon": cmd_daemon, "monitor": cmd_monitor,
+            "forward": cmd_forward}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics.export(port=config.get_setting("metrics_port") if args.metrics_port is None else args.metrics_port,
+                   address=config.get_setting("metrics_address"),
+                   path=args.metrics_file or config.get_setting("metrics_file"),
+                   interval=config.get_setting("metrics_interval_s"))
+    backend = DNSBackend(save_interval=config.get_setting("save_interval_s"), legacy_json=CONFIG_FILE)
+    try:
+        result = COMMANDS[args.command](backend, args)
+    finally:
+        backend.close()
+    if result is not None:
+        fields = {"list": LIST_FIELDS, "test": TEST_FIELDS,
+                  "history": TREND_FIELDS if getattr(args, "ip", None) else HISTORY_FIELDS}
+        emit(result, args.format, fields.get(args.command))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,9 @@
-﻿import json
+﻿import copy
+import json
 import os
+import threading
+
+from fileutil import atomic_write_json
 
 CONFIG_FILE = os.path.expanduser("~/.ubuntu_dns_manager_config.json")
 
@@ -8,30 +12,157 @@ DEFAULT_CONFIG = {
     "update_urls": [
         "https://raw.githubusercontent.com/blacklanternsecurity/public-dns-servers/refs/heads/master/nameservers.txt"
     ],
+    "source_refresh_minutes": 60,  # Update URLs fetched more recently than this are skipped
     "test_domain": "google.com",
+    # Resolution benchmark ("resolve" test mode): cache-hit and cache-miss lookups under these domains
+    "benchmark_domains": ["google.com", "wikipedia.org", "github.com", "amazon.com", "cloudflare.com"],
+    "dns_probe_method": "dig",  # "dig" or "native" (in-process, no subprocess per server)
+    "ping_probe_method": "ping",  # "ping" or "native" (ICMP socket, TCP/53 fallback)
+    "probe_samples": 3,  # Ping/dig samples per server, summarized into p50/p95/jitter/loss
     "auto_clean_enabled": False, # Disabled by default
     "ping_limit": 400,
-    "speed_limit": 300
+    "speed_limit": 300,
+    "loss_limit": 0.5,  # Max share of lost samples before auto-clean removes a server
+    "test_concurrency": 64,  # Servers probed at the same time
+    "probe_timeout": 4,  # Seconds per single ping/dig probe
+    "test_deadline": 900,  # Seconds for a whole test run
+    "adaptive_top_k": 50,  # Adaptive test: servers that get the full multi-sample measurement
+    "reach_timeout_ms": 800,  # Adaptive test: timeout of the first reachability probe
+    "test_all_addresses": True,  # Probe every address of an entry, not only the first one
+    "entry_score": "best",  # Entry score from its addresses: best, worst or weighted
+    # Transport test: measured transports (the first one is the speed column), DoH URL template, TLS verification
+    "probe_transports": ["udp", "tcp", "dot", "doh"],
+    "doh_url": "https://{ip}/dns-query",
+    "verify_tls": False,
+    # Correctness check during dig/resolve/transport tests: wrong responders are flagged (evicted with auto-clean)
+    "verify_responses": True,
+    "verify_options": {
+        "domain": "dns.google",  # Must resolve to one of the reference answers
+        "static_answers": ["8.8.8.8", "8.8.4.4"],
+        "reference_servers": ["1.1.1.1", "9.9.9.9"],  # Their answers for domain extend the reference set
+        "nx_domain": "example.com",  # Random names under it must be NXDOMAIN
+        "dnssec_domain": "isc.org",  # Signed: the AD bit tells whether the server validates
+        "dnssec_bogus_domain": "dnssec-failed.org",  # Broken signatures: AD must never be set
+        "require_dnssec": False
+    },
+    "ui_refresh_ms": 100,  # How often test results are pushed to the table
+    "save_interval_s": 2,  # Changes to the DNS list are written at most this often
+    # Failover monitor: probe the applied server and the best alternatives, switch when it degrades
+    "monitor_interval_s": 10,
+    "monitor_window": 12,  # Rolling window, in probes per server
+    "monitor_candidates": 5,
+    "monitor_latency_ms": 150,  # Active server is bad above this rolling p50 ...
+    "monitor_loss": 0.25,  # ... or above this loss
+    "monitor_trip_count": 3,  # Bad evaluations in a row before switching
+    "monitor_cooldown_s": 600,  # Minimum time between switches
+    "monitor_hysteresis": 0.3,  # A replacement must be at least this much (fraction) faster
+    # Local caching forwarder: when enabled, applying a server points the connection at it instead
+    "forwarder_enabled": False,
+    "forwarder_address": "127.0.0.153",  # Port 53; NetworkManager can't set another port
+    "forwarder_pool": 8,  # Best ranked servers it forwards to
+    "forwarder_race": 3,  # Upstreams asked at the same time on a cache miss
+    "forwarder_cache_size": 10000,
+    "forwarder_negative_ttl": 300,  # Max seconds NXDOMAIN/empty answers are cached
+    "forwarder_feedback_s": 60,  # How often live latencies are written into the ranking
+    # Prometheus metrics: HTTP endpoint (0 = off) and/or a file rewritten every metrics_interval_s ("" = off)
+    "metrics_port": 0,
+    "metrics_address": "127.0.0.1",
+    "metrics_file": "",
+    "metrics_interval_s": 15,
+    "retest_after_minutes": 60,  # Test runs skip servers tested in the same mode more recently (0 = test all)
+    "checkpoint_interval_s": 30  # How often a running test writes its results so far
 }
 
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        return DEFAULT_CONFIG
+_lock = threading.RLock()
+_cache = {"stamp": None, "data": None}  # Validated settings and the (mtime, size) of the file they came from
+_subscribers = []
+
+
+def _validate(data):
+    """Fills in missing settings and replaces values whose type doesn't match the default."""
+    if not isinstance(data, dict):
+        data = {}
+    for key, default in DEFAULT_CONFIG.items():
+        if key not in data:
+            data[key] = copy.deepcopy(default)
+            continue
+        value = data[key]
+        if isinstance(default, dict) and isinstance(value, dict):
+            data[key] = dict(copy.deepcopy(default), **value)  # Options added in newer versions
+            continue
+        if isinstance(default, bool):
+            ok = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            ok = isinstance(value, type(default))
+        data[key] = value if ok else copy.deepcopy(default)
+    return data
+
+
+def _stamp():
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            data = json.load(f)
-            for key, val in DEFAULT_CONFIG.items():
-                if key not in data:
-                    data[key] = val
-            return data
-    except:
-        return DEFAULT_CONFIG
+        st = os.stat(CONFIG_FILE)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def load_config():
+    """Returns the settings. The file is read again only when its mtime or size changed."""
+    with _lock:
+        stamp = _stamp()
+        if _cache["data"] is None or stamp != _cache["stamp"]:
+            data = {}
+            if stamp is not None:
+                try:
+                    with open(CONFIG_FILE, 'r') as f:
+                        data = json.load(f)
+                except Exception:
+                    data = {}
+            _cache["data"] = _validate(data)
+            _cache["stamp"] = stamp
+        return _cache["data"]
+
+
+def update_settings(changes):
+    """
+    Applies several settings in one atomic write and notifies the subscribers
+    with the ones that actually changed. Returns that dict.
+    """
+    with _lock:
+        current = load_config()
+        new = _validate(dict(current, **changes))
+        changed = {k: new[k] for k in changes if current.get(k) != new.get(k)}
+        if not changed:
+            return changed
+        atomic_write_json(CONFIG_FILE, new, indent=4)
+        _cache["data"] = new
+        _cache["stamp"] = _stamp()
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(changed)
+        except Exception as e:
+            print(f"Error in settings subscriber: {e}")
+    return changed
+
 
 def save_config(key, value):
-    config = load_config()
-    config[key] = value
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    update_settings({key: value})
+
+
+def subscribe(callback):
+    """Calls callback(changed_settings_dict) after every update_settings that changed something."""
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
 
 def get_setting(key):
-    return load_config().get(key, DEFAULT_CONFIG.get(key))
\ No newline at end of file
+    return load_config().get(key, DEFAULT_CONFIG.get(key))
@@ -0,0 +1,233 @@
+import asyncio
+import ipaddress
+import random
+import struct
+import time
+
+import metrics
+
+DEAD = 9999  # Same marker the backend uses for failed probes
+
+QTYPE_A = 1
+QTYPE_AAAA = 28
+QTYPE_OPT = 41  # EDNS pseudo record
+
+FLAG_QR = 0x8000  # Response
+FLAG_TC = 0x0200  # Truncated (retry over TCP)
+FLAG_RD = 0x0100  # Recursion desired
+FLAG_AD = 0x0020  # Authentic data (DNSSEC validated); set in a query to ask for it (RFC 6840)
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_REFUSED = 5
+
+
+def build_query(domain, txid, qtype=QTYPE_A, flags=FLAG_RD):
+    """Builds a standard recursive DNS query packet for domain."""
+    header = struct.pack('!HHHHHH', txid, flags, 1, 0, 0, 0)  # One question
+    qname = b''
+    for label in domain.strip('.').split('.'):
+        if label:
+            encoded = label.encode('idna')
+            qname += bytes([len(encoded)]) + encoded
+    return header + qname + b'\x00' + struct.pack('!HH', qtype, 1)
+
+
+def parse_header(data):
+    """Returns (txid, flags, rcode, ancount) of a DNS message, or None if it is too short."""
+    if len(data) < 12:
+        return None
+    txid, flags, _qd, ancount, _ns, _ar = struct.unpack('!HHHHHH', data[:12])
+    return txid, flags, flags & 0x000F, ancount
+
+
+def _skip_name(data, offset):
+    """Returns the offset just past the (possibly compressed) name at offset."""
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2  # Compression pointer ends the name
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def parse_response(data):
+    """
+    Parses a DNS response into {"txid", "rcode", "ad", "answers"}, where answers
+    are the A/AAAA addresses of the answer section. Returns None for a malformed message.
+    """
+    header = parse_header(data)
+    if header is None:
+        return None
+    txid, flags, rcode, ancount = header
+    qdcount = struct.unpack('!H', data[4:6])[0]
+    answers = []
+    try:
+        offset = 12
+        for _ in range(qdcount):
+            offset = _skip_name(data, offset) + 4
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rtype, _cls, _ttl, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+            offset += 10
+            rdata = data[offset:offset + rdlength]
+            if rtype == QTYPE_A and rdlength == 4:
+                answers.append(str(ipaddress.IPv4Address(rdata)))
+            elif rtype == QTYPE_AAAA and rdlength == 16:
+                answers.append(str(ipaddress.IPv6Address(rdata)))
+            offset += rdlength
+    except (IndexError, struct.error):
+        return None
+    return {"txid": txid, "rcode": rcode, "ad": bool(flags & FLAG_AD), "answers": answers}
+
+
+def parse_question(data):
+    """Returns (name, qtype, qclass, end_offset) of the first question, name lowercased; None if malformed."""
+    header = parse_header(data)
+    if header is None or struct.unpack('!H', data[4:6])[0] < 1:
+        return None
+    labels = []
+    offset = 12
+    try:
+        while True:
+            length = data[offset]
+            if length & 0xC0:
+                return None  # Questions of queries are never compressed
+            offset += 1
+            if length == 0:
+                break
+            labels.append(data[offset:offset + length].decode('latin-1').lower())
+            offset += length
+        qtype, qclass = struct.unpack('!HH', data[offset:offset + 4])
+    except (IndexError, struct.error):
+        return None
+    return '.'.join(labels), qtype, qclass, offset + 4
+
+
+def iter_records(data):
+    """
+    Yields (rtype, rclass, ttl_offset, ttl) for every record of the answer,
+    authority and additional sections. Raises ValueError for a malformed message.
+    """
+    if len(data) < 12:
+        raise ValueError("Message too short")
+    qdcount, ancount, nscount, arcount = struct.unpack('!HHHH', data[4:12])
+    try:
+        offset = 12
+        for _ in range(qdcount):
+            offset = _skip_name(data, offset) + 4
+        for _ in range(ancount + nscount + arcount):
+            offset = _skip_name(data, offset)
+            rtype, rclass, ttl, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+            yield rtype, rclass, offset + 4, ttl
+            offset += 10 + rdlength
+    except (IndexError, struct.error):
+        raise ValueError("Malformed message")
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, prober):
+        self.prober = prober
+
+    def datagram_received(self, data, addr):
+        self.prober._on_response(data, addr)
+
+    def error_received(self, exc):
+        # Unconnected sockets can't tell which server failed; the query just times out
+        pass
+
+
+class DNSProber:
+    """
+    In-process DNS prober. Sends queries to many servers from a handful of
+    UDP sockets and matches the answers by (server, transaction ID).
+    Must be used from inside a running event loop.
+    """
+
+    def __init__(self, timeout=2.0, sockets=4, port=53):
+        self.timeout = float(timeout)
+        self.socket_count = max(1, int(sockets))
+        self.port = port
+        self._transports = {4: [], 6: []}
+        self._next = 0
+        self._pending = {}
+        self._lock = None  # Created in the running loop by _get_transport
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for transports in self._transports.values():
+            for transport in transports:
+                transport.close()
+        self._transports = {4: [], 6: []}
+        for fut, _sent in self._pending.values():
+            if not fut.done():
+                fut.cancel()
+        self._pending.clear()
+
+    async def _get_transport(self, version):
+        transports = self._transports[version]
+        if len(transports) < self.socket_count:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            # Concurrent first queries would all pass the check above while the endpoint is created
+            async with self._lock:
+                transports = self._transports[version]
+                if len(transports) < self.socket_count:
+                    loop = asyncio.get_running_loop()
+                    local = ('0.0.0.0', 0) if version == 4 else ('::', 0)
+                    transport, _ = await loop.create_datagram_endpoint(lambda: _ProbeProtocol(self),
+                                                                       local_addr=local)
+                    transports.append(transport)
+                    return transport
+        self._next = (self._next + 1) % len(transports)
+        return transports[self._next]
+
+    def _on_response(self, data, addr):
+        header = parse_header(data)
+        if header is None:
+            return
+        entry = self._pending.pop((addr[0], header[0]), None)
+        if entry is None:
+            return  # Late, duplicated or spoofed answer
+        fut, sent = entry
+        if not fut.done():
+            fut.set_result((time.monotonic() - sent, data))
+
+    async def query(self, server, domain, qtype=QTYPE_A, flags=FLAG_RD):
+        """Sends one query and returns (elapsed_seconds, raw_response). Raises asyncio.TimeoutError."""
+        return await self.exchange(server, build_query(domain, 0, qtype, flags))
+
+    async def exchange(self, server, message):
+        """Sends a raw DNS message under a fresh transaction ID and returns (elapsed_seconds, raw_response)."""
+        addr = ipaddress.ip_address(server)
+        ip = addr.compressed
+        transport = await self._get_transport(addr.version)
+
+        txid = random.getrandbits(16)
+        while (ip, txid) in self._pending:
+            txid = random.getrandbits(16)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[(ip, txid)] = (fut, time.monotonic())
+        try:
+            transport.sendto(struct.pack('!H', txid) + message[2:], (ip, self.port))
+            return await asyncio.wait_for(fut, self.timeout)
+        finally:
+            self._pending.pop((ip, txid), None)
+
+    async def measure(self, server, domain):
+        """Measures DNS resolution time in milliseconds, like the dig based probe."""
+        try:
+            elapsed, _data = await self.query(server, domain)
+            return int(round(elapsed * 1000))
+        except Exception as e:
+            metrics.SOCKET_ERRORS.labels("udp", metrics.error_name(e)).inc()
+            return DEAD
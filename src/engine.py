@@ -0,0 +1,493 @@
+import asyncio
+import contextlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from dnsprobe import DNSProber, parse_header
+from latency import LatencyProber
+from transports import make_transport, probe_transport
+from verify import ResponseVerifier
+from stats import summarize, headline, violates_limits, combine_addresses
+
+DEAD = 9999  # Same marker the backend uses for failed probes
+
+
+def _observe(kind, samples):
+    """Adds probe samples (ms, 9999 = lost) to the latency histogram and the loss counter."""
+    for ms in samples:
+        if ms == DEAD:
+            metrics.PROBES_LOST.labels(kind).inc()
+        else:
+            metrics.PROBE_LATENCY.labels(kind).observe(ms)
+
+
+def _outcome(result):
+    if result["evicted"]:
+        return "evicted"
+    if (result.get("verdict") or {}).get("ok") is False:
+        return "wrong"
+    if all(result.get(kind) in (None, DEAD) for kind in ("ping", "speed")):
+        return "dead"
+    return "ok"
+
+
+class BenchmarkEngine:
+    """Runs ping/dig probes against many servers at once."""
+
+    def __init__(self, backend, concurrency=64, probe_timeout=4.0, deadline=900, dns_method="dig",
+                 ping_method="ping", samples=3, sample_interval=0.2, top_k=50, reach_timeout=0.8, score="best",
+                 transports=("udp", "tcp", "dot", "doh"), doh_url="https://{ip}/dns-query", verify_tls=False,
+                 verify_options=None):
+        self.backend = backend
+        self.concurrency = max(1, int(concurrency))
+        self.probe_timeout = float(probe_timeout)
+        self.deadline = float(deadline)
+        self.dns_method = dns_method  # "dig" (subprocess) or "native" (in-process UDP)
+        self.ping_method = ping_method  # "ping" (subprocess) or "native" (ICMP socket / TCP fallback)
+        self.samples = max(1, int(samples))  # Probes per server, summarized into p50/p95/jitter/loss
+        self.sample_interval = float(sample_interval)
+        self.top_k = max(0, int(top_k))  # Adaptive mode: servers that get the full measurement
+        self.reach_timeout = float(reach_timeout)  # Adaptive mode: seconds for the stage 1 probe
+        self.score = score  # How the addresses of one entry are combined (see stats.combine_addresses)
+        self.transports = list(transports) or ["udp"]  # Transport mode: the first one is the headline speed
+        self.doh_url = doh_url
+        self.verify_tls = verify_tls
+        self.verify_options = verify_options  # ResponseVerifier arguments; None disables the correctness check
+        self._prober = None
+        self._latency = None
+        self._verifier = None
+        self._domains = []
+        self._limits = (None, None, 0.5)  # (ping_limit, speed_limit, loss_limit) of the running test
+        self._running = threading.Event()  # Cleared while paused
+        self._running.set()
+        self._pause_lock = threading.Lock()
+        self._paused_at = None
+        self._paused_total = 0.0
+        self._cancelled = False
+        self._task = None  # (loop, main task) of the running test, for cancel()
+
+    def run(self, targets, mode="all", domain="google.com", on_result=None, ping_limit=None, speed_limit=None,
+            loss_limit=0.5, cutoff=None, domains=None):
+        """
+        Probes every (key, ip) pair in targets and returns one result per key.
+        All addresses of a key are probed in parallel and combined with
+        stats.combine_addresses once the last one finishes; the per-address
+        results (with their raw ping_samples/speed_samples, ms, 9999 = lost)
+        are kept under "addresses".
+        on_result is called from the engine thread as soon as each key is done.
+        When ping_limit/speed_limit are given, servers that break the auto-clean
+        rules (see stats.violates_limits) are marked as evicted and their
+        remaining probes are skipped (fail-fast).
+        With verify_options, every DNS test also checks the answers of each
+        server (see verify.ResponseVerifier) and stores the verdict in the
+        result; wrong responders count as violations.
+
+        mode "adaptive" runs the tiered scheduler (see _run_adaptive); cutoff is
+        an optional (ping_ms, speed_ms) pair after which its probes are abandoned.
+        mode "resolve" runs the resolution benchmark over domains (see _resolve).
+        mode "transport" measures every transport of self.transports (see _probe_transports).
+
+        pause(), resume() and cancel() control a running test from other threads.
+        After cancel() it returns the keys finished so far; keys with addresses
+        still being probed are dropped, not combined from partial results.
+        """
+        self._domains = list(domains or [domain])
+        self._limits = (ping_limit, speed_limit, loss_limit)
+        expected = {}
+        for key, ip in targets:
+            expected[key] = expected.get(key, 0) + 1
+        partial = {}
+        combined = []
+        started = time.monotonic()
+
+        def finish(key):
+            result = combine_addresses(partial.pop(key).values(), self.score)
+            result["mode"] = mode
+            combined.append(result)
+            metrics.TEST_RESULTS.labels(mode, _outcome(result)).inc()
+            if on_result:
+                on_result(result)
+
+        def collect(result):
+            key = result["key"]
+            partial.setdefault(key, {})[result["ip"]] = result
+            if len(partial[key]) == expected[key]:
+                finish(key)
+
+        try:
+            if mode == "adaptive":
+                asyncio.run(self._run_adaptive(targets, domain, collect, cutoff))
+            else:
+                asyncio.run(self._run(targets, mode, domain, collect))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+        if not self._cancelled:
+            # Keys with addresses cut off by the global deadline are combined from what did finish
+            for key in list(partial):
+                finish(key)
+        metrics.TEST_DURATION.labels(mode).observe(time.monotonic() - started)
+        return combined
+
+    async def _stream(self, coros, end):
+        """
+        Yields results of coros as they finish, until the loop time end (global
+        deadline). Time spent paused moves the deadline.
+        """
+        loop = asyncio.get_running_loop()
+        tasks = [asyncio.ensure_future(c) for c in coros]
+        done = asyncio.Queue()
+        for task in tasks:
+            task.add_done_callback(done.put_nowait)
+        try:
+            for _ in tasks:
+                while True:
+                    left = end + self.paused_for - loop.time()
+                    if left <= 0:
+                        return  # Global deadline reached: drop whatever has not finished yet
+                    try:
+                        fut = await asyncio.wait_for(done.get(), left)
+                        break
+                    except asyncio.TimeoutError:
+                        pass  # Look again, a pause may have moved the deadline
+                yield fut.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _open_probers(self, mode):
+        if mode == "resolve" or (mode == "transport" and "udp" in self.transports) or \
+                (self.dns_method == "native" and mode in ["all", "dig", "adaptive"]):
+            self._prober = DNSProber(timeout=self.probe_timeout)
+        if self.ping_method == "native" and mode in ["all", "ping", "adaptive"]:
+            self._latency = LatencyProber(timeout=min(self.probe_timeout, 1.0))
+        if self.verify_options is not None and mode != "ping":
+            # Own prober, so a dig test isn't switched to native queries by the check
+            self._verifier = ResponseVerifier(DNSProber(timeout=self.probe_timeout), **self.verify_options)
+
+    async def _prepare(self):
+        if self._verifier:
+            await self._verifier.prepare()
+
+    def _close_probers(self, pool):
+        # Running subprocesses have their own timeouts, don't block on them
+        pool.shutdown(wait=False, cancel_futures=True)
+        if self._prober:
+            self._prober.close()
+            self._prober = None
+        if self._latency:
+            self._latency.close()
+            self._latency = None
+        if self._verifier:
+            self._verifier.prober.close()
+            self._verifier = None
+
+    def update_limits(self, ping_limit=None, speed_limit=None, loss_limit=0.5):
+        """
+        Changes the auto-clean limits of a running test (e.g. from a settings
+        subscriber, any thread). Servers judged after the call use the new limits.
+        """
+        self._limits = (ping_limit, speed_limit, loss_limit)
+
+    # --- Job control (any thread) ---
+    def pause(self):
+        """Stops starting new probes; the ones in flight finish. The global deadline waits too."""
+        with self._pause_lock:
+            if self._paused_at is None:
+                self._paused_at = time.monotonic()
+                self._running.clear()
+
+    def resume(self):
+        with self._pause_lock:
+            if self._paused_at is not None:
+                self._paused_total += time.monotonic() - self._paused_at
+                self._paused_at = None
+                self._running.set()
+
+    def cancel(self):
+        """Stops the running (or next) test: run() returns what finished so far. Not undone by resume()."""
+        self._cancelled = True
+        task = self._task
+        if task:
+            loop, main = task
+            try:
+                loop.call_soon_threadsafe(main.cancel)
+            except RuntimeError:
+                pass  # The test ended and closed its loop meanwhile
+
+    @property
+    def paused(self):
+        return self._paused_at is not None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def paused_for(self):
+        """Seconds the engine has been paused in total (monotonic clock, like the loop time)."""
+        with self._pause_lock:
+            if self._paused_at is None:
+                return self._paused_total
+            return self._paused_total + time.monotonic() - self._paused_at
+
+    def _started(self):
+        """Registers the main task of a test for cancel(). Returns False if it was cancelled already."""
+        self._task = (asyncio.get_running_loop(), asyncio.current_task())
+        return not self._cancelled
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, sem):
+        """async with sem, counted in the waiting / in-flight gauges. Waits while the engine is paused."""
+        metrics.PROBES_WAITING.inc()
+        try:
+            await sem.acquire()
+            try:
+                # Paused: hold the slot, so nothing else starts either
+                while not self._running.is_set():
+                    await asyncio.sleep(0.2)
+            except BaseException:
+                sem.release()
+                raise
+        finally:
+            metrics.PROBES_WAITING.dec()
+        metrics.PROBES_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            metrics.PROBES_IN_FLIGHT.dec()
+            sem.release()
+
+    async def _run(self, targets, mode, domain, on_result):
+        if not self._started():
+            return
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._open_probers(mode)
+        try:
+            await self._prepare()
+            probes = [self._probe(loop, pool, sem, key, ip, mode, domain) for key, ip in targets]
+            async for result in self._stream(probes, loop.time() + self.deadline):
+                on_result(result)
+        finally:
+            self._close_probers(pool)
+
+    async def _run_adaptive(self, targets, domain, on_result, cutoff):
+        """
+        Tiered scheduler that spends the test time on servers that could win:
+          1. one in-process reachability probe per server with a short timeout,
+          2. one in-process DNS query, only for servers that answered,
+          3. the full multi-sample ping/dig measurement, only for the top_k
+             fastest servers of stage 2.
+        With a cutoff, probes in stages 1-2 are abandoned (counted as lost)
+        once they take longer than the ping/speed limit.
+        Stages 1-2 take one sample, so they never evict (one lost packet or a
+        server that drops ICMP must not be deleted); with auto-clean, only the
+        multi-sample measurement of stage 3 does.
+        """
+        if not self._started():
+            return
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.deadline
+        sem = asyncio.Semaphore(self.concurrency)
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        ping_cut, speed_cut = cutoff or (None, None)
+        reach = LatencyProber(timeout=min(self.reach_timeout, ping_cut / 1000.0 if ping_cut else self.reach_timeout))
+        query = DNSProber(timeout=min(self.probe_timeout, speed_cut / 1000.0 if speed_cut else self.probe_timeout))
+        self._open_probers("adaptive")
+
+        async def reachable(key, ip):
+            async with self._slot(sem):
+                rtt = await reach.rtt(ip)
+            _observe("reach", [DEAD if rtt is None else rtt * 1000])
+            return key, ip, DEAD if rtt is None else rtt * 1000
+
+        async def answers(key, ip, ping):
+            async with self._slot(sem):
+                speed = await query.measure(ip, domain)
+            _observe("dns", [speed])
+            return key, ip, ping, speed
+
+        try:
+            await self._prepare()
+            # --- Stage 1: reachability ---
+            alive = []
+            async for key, ip, ping in self._stream([reachable(k, ip) for k, ip in targets], end):
+                if ping == DEAD:
+                    summary = summarize([DEAD])
+                    on_result({"key": key, "ip": ip, "ping": DEAD, "ping_stats": summary, "ping_samples": [DEAD],
+                               "speed": None, "evicted": False})
+                else:
+                    alive.append((key, ip, ping))
+
+            # --- Stage 2: one DNS query for the survivors ---
+            finalists = []
+            async for key, ip, ping, speed in self._stream([answers(*a) for a in alive], end):
+                result = {"key": key, "ip": ip, "ping_stats": summarize([ping]), "speed_stats": summarize([speed]),
+                          "ping_samples": [ping], "speed_samples": [speed], "evicted": False}
+                result["ping"] = headline(result["ping_stats"])
+                result["speed"] = headline(result["speed_stats"])
+                ping_limit, speed_limit, loss_limit = self._limits
+                if (ping_limit is not None or speed_limit is not None) and \
+                        violates_limits(result, ping_limit, speed_limit, loss_limit):
+                    on_result(result)  # Out of the running, but one sample is no reason to delete it
+                else:
+                    finalists.append(result)
+
+            # --- Stage 3: full measurement of the top-K only ---
+            finalists.sort(key=lambda r: (r["speed"], r["ping"]))
+            for result in finalists[self.top_k:]:
+                on_result(result)
+            probes = [self._probe(loop, pool, sem, r["key"], r["ip"], "all", domain) for r in finalists[:self.top_k]]
+            async for result in self._stream(probes, end):
+                on_result(result)
+        finally:
+            reach.close()
+            query.close()
+            self._close_probers(pool)
+
+    async def _call(self, loop, pool, command, func, *args):
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(pool, func, *args), self.probe_timeout)
+        except asyncio.TimeoutError:
+            metrics.SUBPROCESS_ERRORS.labels(command, "timeout").inc()
+            return DEAD
+
+    async def _ping_once(self, loop, pool, ip, domain):
+        if self._latency:
+            rtt = await self._latency.rtt(ip)
+            return DEAD if rtt is None else rtt * 1000
+        return await self._call(loop, pool, "ping", self.backend.measure_ping, ip)
+
+    async def _dig_once(self, loop, pool, ip, domain):
+        if self._prober:
+            return await self._prober.measure(ip, domain)
+        return await self._call(loop, pool, "dig", self.backend.measure_dig_speed, ip, domain)
+
+    async def _lookup(self, ip, name):
+        """One query of the resolution benchmark in ms. SERVFAIL/REFUSED answers count as lost."""
+        try:
+            elapsed, data = await self._prober.query(ip, name)
+        except Exception as e:
+            metrics.SOCKET_ERRORS.labels("udp", metrics.error_name(e)).inc()
+            return DEAD
+        header = parse_header(data)
+        if header is None or header[2] not in (0, 3):  # NOERROR or NXDOMAIN
+            return DEAD
+        return int(round(elapsed * 1000))
+
+    async def _resolve(self, ip):
+        """
+        Resolution benchmark of one server over all domains (in parallel):
+          uncached - a random label under the domain, which can't be in the
+                     resolver's cache, so it has to recurse
+          cached   - the domain itself after one warm-up query, answered from cache
+        Returns (cached_samples, uncached_samples).
+        """
+        async def one_domain(domain):
+            cached, uncached = [], []
+            for i in range(self.samples):
+                if i:
+                    await asyncio.sleep(self.sample_interval)
+                uncached.append(await self._lookup(ip, "%08x.%s" % (random.getrandbits(32), domain)))
+                if i == 0:
+                    await self._lookup(ip, domain)
+                cached.append(await self._lookup(ip, domain))
+            return cached, uncached
+
+        per_domain = await asyncio.gather(*(one_domain(d) for d in self._domains))
+        for cached, uncached in per_domain:
+            _observe("cached", cached)
+            _observe("uncached", uncached)
+        return [x for c, _u in per_domain for x in c], [x for _c, u in per_domain for x in u]
+
+    async def _probe_transports(self, ip, domain):
+        """
+        Measures one server over each transport at the same time. Returns
+        {transport: {"setup", "setup_stats", "reconnects", "query_stats", "query_samples"}};
+        UDP has no connection, so its setup is None.
+        """
+        async def udp():
+            samples = []
+            for i in range(self.samples):
+                if i:
+                    await asyncio.sleep(self.sample_interval)
+                samples.append(await self._prober.measure(ip, domain))
+            return {"setup": None, "setup_stats": None, "reconnects": 0, "query_stats": summarize(samples),
+                    "query_samples": samples}
+
+        jobs = {}
+        for name in self.transports:
+            if name == "udp":
+                jobs[name] = udp()
+            else:
+                transport = make_transport(name, ip, timeout=self.probe_timeout, verify=self.verify_tls,
+                                           doh_url=self.doh_url)
+                jobs[name] = probe_transport(transport, domain, self.samples, self.sample_interval)
+        results = dict(zip(jobs, await asyncio.gather(*jobs.values())))
+        for name, res in results.items():
+            _observe(name, res["query_samples"])
+        return results
+
+    async def _sample(self, kind, probe_once, loop, pool, ip, domain):
+        samples = []
+        for i in range(self.samples):
+            if i:
+                await asyncio.sleep(self.sample_interval)
+            samples.append(await probe_once(loop, pool, ip, domain))
+        _observe(kind, samples)
+        return summarize(samples), samples
+
+    async def _probe(self, loop, pool, sem, key, ip, mode, domain):
+        result = {"key": key, "ip": ip, "ping": None, "speed": None, "evicted": False}
+        async with self._slot(sem):
+            ping_limit, speed_limit, loss_limit = self._limits
+            # --- PING TEST ---
+            if mode in ["all", "ping"]:
+                summary, result["ping_samples"] = await self._sample("ping", self._ping_once, loop, pool, ip, domain)
+                result["ping"] = headline(summary)
+                result["ping_stats"] = summary
+                if ping_limit is not None and violates_limits(result, ping_limit, None, loss_limit):
+                    result["evicted"] = True
+                    return result
+
+            # --- CORRECTNESS CHECK (before spending time on the speed test) ---
+            if self._verifier and mode != "ping":
+                result["verdict"] = await self._verifier.check(ip)
+                if (ping_limit is not None or speed_limit is not None) and result["verdict"]["ok"] is False:
+                    result["evicted"] = True
+                    return result
+
+            # --- DIG TEST ---
+            if mode in ["all", "dig"]:
+                summary, result["speed_samples"] = await self._sample("dns", self._dig_once, loop, pool, ip, domain)
+                result["speed"] = headline(summary)
+                result["speed_stats"] = summary
+                if speed_limit is not None and violates_limits(result, None, speed_limit, loss_limit):
+                    result["evicted"] = True
+
+            # --- TRANSPORT TEST (UDP, TCP, DoT, DoH) ---
+            if mode == "transport":
+                result["transports"] = await self._probe_transports(ip, domain)
+                first = result["transports"][self.transports[0]]
+                result["speed_samples"] = first["query_samples"]
+                result["speed_stats"] = first["query_stats"]
+                result["speed"] = headline(first["query_stats"])
+                if speed_limit is not None and violates_limits(result, None, speed_limit, loss_limit):
+                    result["evicted"] = True
+
+            # --- RESOLUTION BENCHMARK (cache hits vs. misses) ---
+            if mode == "resolve":
+                cached, uncached = await self._resolve(ip)
+                for kind, samples in (("cached", cached), ("uncached", uncached), ("speed", cached + uncached)):
+                    result[kind + "_samples"] = samples
+                    result[kind + "_stats"] = summarize(samples)
+                    result[kind] = headline(result[kind + "_stats"])
+                if speed_limit is not None and violates_limits(result, None, speed_limit, loss_limit):
+                    result["evicted"] = True
+        return result
@@ -0,0 +1,45 @@
+import json
+import os
+import tempfile
+
+
+def atomic_write_json(path, data, **dump_kw):
+    """
+    Writes data as JSON to path atomically: a temp file in the same directory
+    is written, fsynced and renamed over path, so readers (and a crash) only
+    ever see the old or the new file, never a truncated one.
+    """
+    _atomic_write(path, lambda f: json.dump(data, f, **dump_kw))
+
+
+def atomic_write_text(path, text):
+    """Writes text to path atomically, like atomic_write_json."""
+    _atomic_write(path, lambda f: f.write(text))
+
+
+def _atomic_write(path, write):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
@@ -0,0 +1,409 @@
+import asyncio
+import collections
+import struct
+import time
+
+import metrics
+import stats
+from dnsprobe import (DEAD, FLAG_QR, FLAG_TC, QTYPE_OPT, RCODE_NOERROR, RCODE_NXDOMAIN, RCODE_SERVFAIL,
+                      DNSProber, iter_records, parse_header, parse_question)
+from stats import summarize
+
+CD_FLAG = 0x0010  # Checking disabled: the answer may differ, so it is part of the cache key
+
+
+def _with_id(message, txid):
+    return struct.pack('!H', txid) + message[2:]
+
+
+def udp_limit(query):
+    """Largest UDP response the client accepts: its EDNS buffer size, or 512 without EDNS."""
+    try:
+        for rtype, rclass, _offset, _ttl in iter_records(query):
+            if rtype == QTYPE_OPT:
+                return max(512, rclass)  # The class field of OPT is the payload size
+    except ValueError:
+        pass
+    return 512
+
+
+def error_response(query, rcode, truncated=False):
+    """A header-and-question reply to query with rcode (SERVFAIL, or an empty truncated answer)."""
+    question = parse_question(query)
+    end = question[3] if question else 12
+    txid, flags = struct.unpack('!HH', query[:4])
+    flags = FLAG_QR | (flags & 0x7910) | 0x0080 | rcode  # Keep opcode/RD/CD, set RA
+    if truncated:
+        flags |= FLAG_TC
+    return struct.pack('!HHHHHH', txid, flags, 1 if question else 0, 0, 0, 0) + query[12:end]
+
+
+class DNSCache:
+    """
+    LRU cache of DNS responses that respects their TTLs. Answers live for the
+    smallest TTL of their records (clamped to min_ttl..max_ttl); NXDOMAIN and
+    empty answers are cached too (negative caching, RFC 2308) for the TTL of
+    their SOA record, at most negative_ttl. The TTLs of a returned response
+    are lowered by the time it spent in the cache.
+    """
+
+    def __init__(self, size=10000, min_ttl=0, max_ttl=86400, negative_ttl=300):
+        self.size = max(1, int(size))
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = collections.OrderedDict()  # key -> (stored, expires, response, [(ttl_offset, ttl)])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """The cached response for key with its ID set to 0, or None."""
+        now = time.monotonic() if now is None else now
+        item = self._entries.get(key)
+        if item is None or item[1] <= now:
+            if item is not None:
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        stored, _expires, response, ttls = item
+        age = int(now - stored)
+        if not age:
+            return response
+        data = bytearray(response)
+        for offset, ttl in ttls:
+            struct.pack_into('!I', data, offset, max(0, ttl - age))
+        return bytes(data)
+
+    def put(self, key, response, now=None):
+        """Caches response if it is cacheable. Returns the TTL it got, or None."""
+        header = parse_header(response)
+        if header is None or header[1] & FLAG_TC or header[2] not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            return None
+        try:
+            ttls = [(offset, ttl) for rtype, _cls, offset, ttl in iter_records(response) if rtype != QTYPE_OPT]
+        except ValueError:
+            return None
+        if header[2] == RCODE_NXDOMAIN or not header[3]:
+            ttl = min([t for _, t in ttls] + [self.negative_ttl])
+        elif ttls:
+            ttl = min(max(min(t for _, t in ttls), self.min_ttl), self.max_ttl)
+        else:
+            return None
+        if ttl <= 0:
+            return None
+        now = time.monotonic() if now is None else now
+        self._entries[key] = (now, now + ttl, _with_id(response, 0), ttls)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return ttl
+
+
+class _UDPServer(asyncio.DatagramProtocol):
+    def __init__(self, forwarder):
+        self.forwarder = forwarder
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        # The loop only keeps weak references to tasks: hold it until the answer is sent
+        task = asyncio.ensure_future(self._answer(data, addr))
+        self.forwarder._tasks.add(task)
+        task.add_done_callback(self.forwarder._reap)
+
+    async def _answer(self, query, addr):
+        response = await self.forwarder.resolve(query)
+        if response is None:
+            return
+        if len(response) > udp_limit(query):
+            response = error_response(query, RCODE_NOERROR, truncated=True)  # The client retries over TCP
+        self.transport.sendto(response, addr)
+
+
+class DNSForwarder:
+    """
+    Local caching DNS forwarder for the system resolver (UDP and TCP on
+    address:port, 127.0.0.153:53 by default).
+
+    Answers come from a DNSCache; a miss is sent to the `race` fastest servers
+    of the upstream pool at the same time and the first valid answer (NOERROR
+    or NXDOMAIN) wins. Identical queries that arrive while one is in flight
+    share its answer. The pool is the `pool` best ranked servers of the list,
+    or the fixed upstreams. Every upstream answer, including the ones that
+    lost the race, is timed: the race order follows these live latencies, and
+    every feedback_interval seconds they are stored as the servers' speed
+    (and in the probe history), so real traffic moves the ranking.
+    """
+
+    def __init__(self, backend, address="127.0.0.153", port=53, upstreams=None, pool=8, race=3, timeout=2.0,
+                 cache_size=10000, max_ttl=86400, negative_ttl=300, feedback_interval=60, window=50,
+                 upstream_port=53, preferred=None, on_event=None):
+        self.backend = backend
+        self.address = address
+        self.port = port
+        self.upstreams = list(upstreams or [])  # Fixed upstream IPs instead of the ranking
+        self.pool_size = max(1, int(pool))
+        self.race = max(1, int(race))
+        self.timeout = float(timeout)
+        self.cache = DNSCache(cache_size, max_ttl=max_ttl, negative_ttl=negative_ttl)
+        self.feedback_interval = float(feedback_interval)
+        self.upstream_port = upstream_port
+        self.preferred = preferred  # Key of an entry that is always raced first
+        self.on_event = on_event
+
+        self.live = collections.defaultdict(lambda: collections.deque(maxlen=window))  # ip -> recent ms
+        self.counters = collections.Counter()  # queries, hits, misses, coalesced, failures, truncated
+        self.pool = []  # (key or None, ip) in rank order
+        self._fresh = collections.defaultdict(list)  # ip -> samples not fed back yet
+        self._inflight = {}
+        self._prober = None
+        self._servers = []
+        self._tasks = set()
+
+    def _emit(self, event, **fields):
+        if self.on_event:
+            self.on_event(dict(fields, event=event, time=round(time.time(), 1)))
+
+    # --- Upstreams ---
+    def select_pool(self):
+        """Picks the upstream pool: the fixed upstreams, or the best ranked servers that answer correctly."""
+        if self.upstreams:
+            self.pool = [(None, ip) for ip in self.upstreams]
+            return self.pool
+        model = self.backend.model
+        keys = self.backend.rank_servers(model)
+        if self.preferred in model:
+            keys = [self.preferred] + [k for k in keys if k != self.preferred]
+        pool = []
+        for key in keys:
+            entry = model.get(key)
+            if not entry or stats.is_wrong(entry):
+                continue
+            s = stats.entry_stats(entry, "speed")
+            if key != self.preferred and (not s or s["p50"] is None):
+                continue
+            ipv4, ipv6 = self.backend.ordered_dns(entry)
+            if ipv4 + ipv6:
+                pool.append((key, (ipv4 + ipv6)[0]))
+            if len(pool) >= self.pool_size:
+                break
+        self.pool = pool
+        return pool
+
+    def race_order(self):
+        """Upstream IPs, fastest first: live p50 once there are a few samples, else the stored ranking."""
+        def key(item):
+            index, (k, ip) = item
+            if k is not None and k == self.preferred:
+                return (0, 0, 0, index)
+            live = self.live.get(ip)
+            if live and len(live) >= 3:
+                s = summarize(list(live))
+                if s["p50"] is not None:
+                    return (1, s["loss"] > 0.5, s["p50"], index)
+                return (3, 0, 0, index)
+            return (2, 0, 0, index)
+        return [ip for _, (_k, ip) in sorted(enumerate(self.pool), key=key)]
+
+    def _sample(self, ip, ms):
+        self.live[ip].append(ms)
+        self._fresh[ip].append(ms)
+
+    async def _ask(self, ip, query):
+        try:
+            elapsed, response = await self._prober.exchange(ip, query)
+        except Exception:
+            self._sample(ip, DEAD)
+            raise
+        self._sample(ip, int(round(elapsed * 1000)))
+        return response
+
+    async def _ask_tcp(self, ip, query):
+        """One query over a new TCP connection, for answers too large for UDP."""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, self.upstream_port), self.timeout)
+        try:
+            writer.write(struct.pack('!H', len(query)) + query)
+            await writer.drain()
+            size, = struct.unpack('!H', await asyncio.wait_for(reader.readexactly(2), self.timeout))
+            return await asyncio.wait_for(reader.readexactly(size), self.timeout)
+        finally:
+            writer.close()
+
+    async def _race(self, query):
+        """Sends query to the first `race` upstreams; returns (ip, response) of the first valid answer."""
+        order = self.race_order()[:self.race]
+        if not order:
+            return None, None
+        tasks = {asyncio.ensure_future(self._ask(ip, query)): ip for ip in order}
+        # Losers keep running until they answer or time out, so their latency is measured too
+        self._tasks.update(tasks)
+        for task in tasks:
+            task.add_done_callback(self._reap)
+        fallback = (None, None)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    continue
+                response = task.result()
+                header = parse_header(response)
+                if header and header[2] in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    return tasks[task], response
+                fallback = (tasks[task], response)  # SERVFAIL/REFUSED: only if nobody does better
+        return fallback
+
+    def _reap(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # Retrieved, so asyncio doesn't log it
+
+    async def _fetch(self, key, query, tcp):
+        ip, response = await self._race(query)
+        if response is None:
+            self.counters["failures"] += 1
+            return None
+        header = parse_header(response)
+        if header[1] & FLAG_TC and tcp:
+            try:
+                response = await self._ask_tcp(ip, query)
+            except Exception:
+                self.counters["failures"] += 1
+                return None
+        elif header[1] & FLAG_TC:
+            self.counters["truncated"] += 1
+            return response
+        self.cache.put(key, response)
+        return response
+
+    async def resolve(self, query, tcp=False):
+        """Answers one raw client query. Returns the response, or None for garbage that gets no reply."""
+        question = parse_question(query)
+        header = parse_header(query)
+        if question is None or header[1] & FLAG_QR:
+            return None
+        self.counters["queries"] += 1
+        txid = header[0]
+        key = (question[0], question[1], question[2], bool(header[1] & CD_FLAG))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.counters["hits"] += 1
+            metrics.FORWARDER_QUERIES.labels("hit").inc()
+            return _with_id(cached, txid)
+        self.counters["misses"] += 1
+
+        inflight = self._inflight.get((key, tcp))
+        if inflight is not None:
+            self.counters["coalesced"] += 1
+            metrics.FORWARDER_QUERIES.labels("coalesced").inc()
+            response = await asyncio.shield(inflight)
+        else:
+            future = asyncio.ensure_future(self._fetch(key, query, tcp))
+            self._inflight[(key, tcp)] = future
+            try:
+                response = await asyncio.shield(future)
+            finally:
+                self._inflight.pop((key, tcp), None)
+        if response is None:
+            metrics.FORWARDER_QUERIES.labels("failure").inc()
+            return error_response(query, RCODE_SERVFAIL)
+        if inflight is None:
+            metrics.FORWARDER_QUERIES.labels("miss").inc()
+        return _with_id(response, txid)
+
+    # --- Feedback ---
+    def feedback(self):
+        """Stores the live latencies as the speed of their servers and re-selects the pool."""
+        fresh, self._fresh = self._fresh, collections.defaultdict(list)
+        owners = dict((ip, key) for key, ip in self.pool)
+        for ip, samples in fresh.items():
+            for ms in samples:
+                self.backend.history.add(ip, "dns", ms)
+            key = owners.get(ip)
+            if key is None:
+                continue
+            s = summarize(list(self.live[ip]))
+            address = {"ip": ip, "speed": stats.headline(s), "speed_stats": s}
+            self.backend.record(key, {"key": key, "speed": address["speed"], "speed_stats": s,
+                                      "addresses": {ip: address}})
+        self.backend.flush_history()
+        self.select_pool()
+        self._emit("stats", pool=[ip for _, ip in self.pool], cached=len(self.cache), **self.counters)
+
+    async def _feedback_loop(self):
+        while True:
+            await asyncio.sleep(self.feedback_interval)
+            try:
+                self.feedback()
+            except Exception as e:
+                print(f"Error feeding back live latencies: {e}")
+
+    # --- Serving ---
+    async def _serve_tcp(self, reader, writer):
+        try:
+            while True:
+                size, = struct.unpack('!H', await reader.readexactly(2))
+                query = await reader.readexactly(size)
+                response = await self.resolve(query, tcp=True)
+                if response is None:
+                    break
+                writer.write(struct.pack('!H', len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Binds the UDP and TCP listeners (raises OSError when the address is taken)."""
+        self.select_pool()
+        self._prober = DNSProber(timeout=self.timeout, port=self.upstream_port)
+        loop = asyncio.get_running_loop()
+        try:
+            udp, _ = await loop.create_datagram_endpoint(lambda: _UDPServer(self),
+                                                         local_addr=(self.address, self.port))
+            self._servers.append(udp)
+            self._servers.append(await asyncio.start_server(self._serve_tcp, self.address, self.port))
+        except BaseException:
+            self.close()
+            raise
+        feedback = asyncio.ensure_future(self._feedback_loop())
+        self._tasks.add(feedback)
+        self._emit("started", address=self.address, port=self.port, pool=[ip for _, ip in self.pool])
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+        if self._prober is not None:
+            self._prober.close()
+            self._prober = None
+
+    async def run_async(self, stop, ready=None):
+        """Serves until the threading.Event stop is set. ready(error or None) is called once bound."""
+        try:
+            await self.start()
+        except Exception as e:
+            if ready:
+                ready(e)
+            raise
+        if ready:
+            ready(None)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        finally:
+            self.close()
+            try:
+                self.feedback()  # Don't lose the samples of the last interval
+            except Exception as e:
+                print(f"Error feeding back live latencies: {e}")
+
+    def run(self, stop, ready=None):
+        asyncio.run(self.run_async(stop, ready))
@@ -1,8 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, font
-from backend import DNSBackend
+from backend import DNSBackend, CONFIG_FILE
+from engine import BenchmarkEngine
+from listview import VirtualTreeview
+from testjob import TestJob
+from uichannel import UIUpdateChannel
 import config
 import lang
+import metrics
+import stats
 import threading
 import os
 
@@ -95,6 +101,18 @@ class ConfigDialog(tk.Toplevel):
         self.ent_speed.pack(side=tk.LEFT, padx=5)
         self.ent_speed.insert(0, config.get_setting("speed_limit"))
 
+        f_engine = tk.Frame(main_frame)
+        f_engine.pack(fill=tk.X, pady=5)
+
+        tk.Label(f_engine, text=t("lbl_concurrency"), font=self.main_font).pack(side=tk.LEFT)
+        self.ent_concurrency = ttk.Entry(f_engine, width=8)
+        self.ent_concurrency.pack(side=tk.LEFT, padx=5)
+        self.ent_concurrency.insert(0, config.get_setting("test_concurrency"))
+
+        self.var_forwarder = tk.BooleanVar(value=config.get_setting("forwarder_enabled"))
+        tk.Checkbutton(main_frame, text=t("chk_forwarder"), variable=self.var_forwarder,
+                       font=self.main_font).pack(anchor=tk.W, padx=5, pady=(10, 0))
+
         ttk.Button(main_frame, text=self.parent_app.fix_text("Save & Restart"), command=self.save_settings).pack(
             pady=20)
 
@@ -130,16 +148,21 @@ class ConfigDialog(tk.Toplevel):
             s_limit = int(self.ent_speed.get().strip())
         except:
             s_limit = 300
-
-        config.save_config("update_urls", new_urls)
-        config.save_config("test_domain", self.ent_domain.get().strip())
-        config.save_config("ping_limit", p_limit)
-        config.save_config("speed_limit", s_limit)
-        config.save_config("auto_clean_enabled", self.var_auto_clean.get())
+        try:
+            concurrency = max(1, int(self.ent_concurrency.get().strip()))
+        except:
+            concurrency = 64
 
         new_lang = self.lang_var.get()
-        if new_lang != config.get_setting("language"):
-            config.save_config("language", new_lang)
+        changed = config.update_settings({"update_urls": new_urls,
+                                          "test_domain": self.ent_domain.get().strip(),
+                                          "ping_limit": p_limit,
+                                          "speed_limit": s_limit,
+                                          "auto_clean_enabled": self.var_auto_clean.get(),
+                                          "test_concurrency": concurrency,
+                                          "forwarder_enabled": self.var_forwarder.get(),
+                                          "language": new_lang})
+        if "language" in changed:
             messagebox.showinfo("Restart", "Please restart application.")
 
         self.destroy()
@@ -149,8 +172,15 @@ class DNSApp:
     def __init__(self, root):
         self.root = root
         self.root.master_app = self
-        self.backend = DNSBackend()
+        self.backend = DNSBackend(save_interval=config.get_setting("save_interval_s"), legacy_json=CONFIG_FILE)
+        self.forwarder = None  # (DNSForwarder, stop event, thread) while the local forwarder runs
+        self.test_job = None  # (TestJob, worker thread) while a test runs
+        self.test_progress = (0, 0)
+        self._history_key = None  # Server whose history the status bar shows
+        metrics.export(port=config.get_setting("metrics_port"), address=config.get_setting("metrics_address"),
+                       path=config.get_setting("metrics_file"), interval=config.get_setting("metrics_interval_s"))
         self.root.geometry("950x750")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.current_lang = config.get_setting("language") or "EN"
 
@@ -175,6 +205,74 @@ class DNSApp:
         self.setup_ui()
         self.refresh_dns_list()
 
+    def on_close(self):
+        """Writes pending list changes before the window goes away."""
+        try:
+            self._stop_forwarder(reapply=True)
+            if self.test_job:
+                # Stop the test; what finished is saved and the next Run Test resumes the rest
+                job, thread = self.test_job
+                job.cancel()
+                job.resume()
+                thread.join(10)
+            self.backend.close()
+        finally:
+            self.root.destroy()
+
+    def _start_forwarder(self, preferred):
+        """Starts the local forwarder in a thread (once). Returns None, or the error that stopped it."""
+        if self.forwarder is not None:
+            self.forwarder[0].preferred = preferred
+            self.forwarder[0].select_pool()
+            return None
+        from forwarder import DNSForwarder
+
+        forwarder = DNSForwarder(self.backend, address=config.get_setting("forwarder_address"),
+                                 pool=config.get_setting("forwarder_pool"),
+                                 race=config.get_setting("forwarder_race"),
+                                 timeout=config.get_setting("probe_timeout"),
+                                 cache_size=config.get_setting("forwarder_cache_size"),
+                                 negative_ttl=config.get_setting("forwarder_negative_ttl"),
+                                 feedback_interval=config.get_setting("forwarder_feedback_s"),
+                                 preferred=preferred)
+        stop, ready, result = threading.Event(), threading.Event(), {}
+
+        def on_ready(error):
+            result["error"] = error
+            ready.set()
+
+        def worker():
+            try:
+                forwarder.run(stop, on_ready)
+            except Exception as e:
+                print(f"Forwarder stopped: {e}")
+            finally:
+                ready.set()
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        ready.wait(10)
+        if result.get("error") is not None or not thread.is_alive():
+            return result.get("error") or "not started"
+        self.forwarder = (forwarder, stop, thread)
+        return None
+
+    def _stop_forwarder(self, reapply=False):
+        """Stops the local forwarder; with reapply the connection gets its preferred server directly."""
+        if self.forwarder is None:
+            return
+        forwarder, stop, thread = self.forwarder
+        self.forwarder = None
+        conn = self.backend.get_active_connection() if reapply else None
+        if conn:
+            # Don't leave the system pointing at an address nobody answers on
+            key = forwarder.preferred if forwarder.preferred in self.dns_data else \
+                next(iter(self.backend.rank_servers(self.dns_data)), None)
+            if key is not None:
+                self.backend.set_dns(conn, *self.backend.ordered_dns(self.dns_data[key]))
+        stop.set()
+        thread.join(5)
+
     def t(self, key):
         """Translate and reshape."""
         text = lang.get_text(self.current_lang, key)
@@ -228,7 +326,7 @@ class DNSApp:
         tree_frame.pack(fill=tk.BOTH, expand=True)
 
         cols = ('name', 'ipv4', 'ping', 'speed')
-        self.tree = ttk.Treeview(tree_frame, columns=cols, show='headings', selectmode='extended')
+        self.tree = VirtualTreeview(tree_frame, columns=cols, display=self._display_row)
 
         self.tree.heading('name', text=self.t("col_name"), command=lambda: self.sort_tree('name', False))
         self.tree.heading('ipv4', text=self.t("col_ipv4"), command=lambda: self.sort_tree('ipv4', False))
@@ -240,10 +338,8 @@ class DNSApp:
         self.tree.column('ping', width=80, anchor=tk.CENTER)
         self.tree.column('speed', width=80, anchor=tk.CENTER)
 
-        sb = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=sb.set)
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        sb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.tree.tree.bind('<<TreeviewSelect>>', self._show_history, add='+')
 
         # Controls
         ctrl_frame = tk.LabelFrame(self.root, text=self.t("menu_settings"), padx=10, pady=10)
@@ -256,9 +352,15 @@ class DNSApp:
 
         tk.Label(r1, text=self.t("test_mode")).pack(side=tk.LEFT, padx=(20, 5))
         self.test_var = tk.StringVar(value="all")
-        ttk.OptionMenu(r1, self.test_var, "all", "all", "ping", "dig").pack(side=tk.LEFT)
-
-        ttk.Button(r1, text=self.t("btn_test"), command=self.run_test).pack(side=tk.LEFT, padx=5)
+        ttk.OptionMenu(r1, self.test_var, "all", "all", "ping", "dig", "adaptive", "resolve",
+                       "transport").pack(side=tk.LEFT)
+
+        self.btn_test = ttk.Button(r1, text=self.t("btn_test"), command=self.run_test)
+        self.btn_test.pack(side=tk.LEFT, padx=5)
+        self.btn_pause = ttk.Button(r1, text=self.t("btn_pause"), command=self.toggle_pause, state=tk.DISABLED)
+        self.btn_pause.pack(side=tk.LEFT, padx=5)
+        self.btn_stop = ttk.Button(r1, text=self.t("btn_stop"), command=self.stop_test, state=tk.DISABLED)
+        self.btn_stop.pack(side=tk.LEFT, padx=5)
         ttk.Button(r1, text=self.t("btn_update"), command=self.update_list).pack(side=tk.RIGHT, padx=5)
 
         # Row 2
@@ -281,21 +383,28 @@ class DNSApp:
         self.update_conn_info()  # Initial call
 
     def refresh_dns_list(self):
-        self.tree.delete(*self.tree.get_children())
+        """Rebuilds the row model. Only the visible rows are drawn (see VirtualTreeview)."""
+        self.tree.clear()
 
         def_name = "Default (System/DHCP)"
-        if self.current_lang == "FA": def_name = self.fix_text("پیش‌فرض (سیستم)")
-        self.tree.insert('', tk.END, values=(def_name, "Automatic", '-', '-'), tags=('default',))
+        if self.current_lang == "FA": def_name = "پیش‌فرض (سیستم)"
+        self.default_iid = self.tree.insert(values=(def_name, "Automatic", '-', '-'), tags=('default',))
 
-        self.dns_data = self.backend.load_dns_list()
+        self.dns_data = self.backend.model  # Live, thread-safe list shared with the test worker
         for name, d in self.dns_data.items():
             all_ips = d.get("ipv4", []) + d.get("ipv6", [])
             ipv_display = ", ".join(all_ips)
-
-            dn = self.fix_text(name) if self.current_lang == "FA" else name
-            self.tree.insert('', tk.END, values=(dn, ipv_display, d.get('last_ping', '-'), d.get('last_speed', '-')))
+            self.tree.insert(values=(name, ipv_display, d.get('last_ping', '-'), d.get('last_speed', '-')),
+                             tags=('wrong',) if stats.is_wrong(d) else (), key=name)
 
         self.tree.tag_configure('default', background='#dff9fb')
+        self.tree.tag_configure('wrong', foreground='#c0392b')
+
+    def _display_row(self, values):
+        """Rows keep the raw name; Persian shaping is applied only to rows being drawn."""
+        if self.current_lang != "FA":
+            return values
+        return (self.fix_text(values[0]),) + tuple(values[1:])
 
     def apply_dns(self):
         sel = self.tree.selection()
@@ -303,23 +412,25 @@ class DNSApp:
         conn = self.update_conn_info()
         if not conn: return
 
-        vals = self.tree.item(sel[0])['values']
-        name_display = vals[0]
-
-        if "Default" in str(name_display) or "پیش‌فرض" in str(name_display):
+        if sel[0] == self.default_iid:
+            self._stop_forwarder()
             self.backend.clear_dns(conn)
             messagebox.showinfo(self.t("app_title"), self.fix_text("تنظیمات به DHCP بازنشانی شد."))
             return
 
-        target_key = None
-        for k in self.dns_data.keys():
-            if self.fix_text(k) == name_display or k == name_display:
-                target_key = k
-                break
-
-        if target_key:
+        target_key = self.tree.key_of(sel[0])
+        if target_key in self.dns_data:
             d = self.dns_data[target_key]
-            ok, msg = self.backend.set_dns(conn, d.get("ipv4", []), d.get("ipv6", []))
+            if config.get_setting("forwarder_enabled"):
+                # The selected server is raced first; the best ranked ones back it up
+                error = self._start_forwarder(target_key)
+                if error is not None:
+                    messagebox.showerror(self.t("app_title"), self.t("err_forwarder").format(error))
+                    return
+                ok, msg = self.backend.set_dns(conn, [config.get_setting("forwarder_address")], [])
+            else:
+                self._stop_forwarder()
+                ok, msg = self.backend.set_dns(conn, *self.backend.ordered_dns(d))
             if ok:
                 messagebox.showinfo(self.t("app_title"), self.t("msg_apply"))
             else:
@@ -329,19 +440,9 @@ class DNSApp:
         sel = self.tree.selection()
         if not sel: return
         if messagebox.askyesno(self.t("app_title"), self.t("confirm_del")):
-            count = 0
-            for item_id in sel:
-                vals = self.tree.item(item_id)['values']
-                name = vals[0]
-                if "Default" in name or "پیش‌فرض" in name: continue
-
-                for k in list(self.dns_data.keys()):
-                    if self.fix_text(k) == name or k == name:
-                        del self.dns_data[k]
-                        count += 1
-                        break
-            self.backend.save_dns_list(self.dns_data)
-            self.refresh_dns_list()
+            removed = [item_id for item_id in sel if self.tree.key_of(item_id) in self.dns_data]
+            count = self.backend.delete_servers([self.tree.key_of(item_id) for item_id in removed])
+            self.tree.delete(*removed)
             self.status_var.set(self.t("msg_del").format(count))
 
     def clean_dead(self):
@@ -353,26 +454,13 @@ class DNSApp:
     def perform_batch_cleaning(self):
         p_limit = config.get_setting("ping_limit")
         s_limit = config.get_setting("speed_limit")
+        loss_limit = config.get_setting("loss_limit")
 
-        to_del = []
-        for k, v in self.dns_data.items():
-            p = str(v.get('last_ping', '-'))
-            s = str(v.get('last_speed', '-'))
-
-            should_del = False
-            # Rule 1: Dead (9999)
-            if p == '9999' or s == '9999': should_del = True
-            # Rule 2: Limits
-            if p.isdigit() and int(p) > p_limit: should_del = True
-            if s.isdigit() and int(s) > s_limit: should_del = True
-
-            if should_del: to_del.append(k)
-
-        for k in to_del:
-            if k in self.dns_data: del self.dns_data[k]
+        # Dead, lossy or over the limits (judged on the median of all samples)
+        to_del = self.backend.find_violations(self.dns_data, p_limit, s_limit, loss_limit)
 
-        self.backend.save_dns_list(self.dns_data)
-        self.refresh_dns_list()
+        self.backend.delete_servers(to_del)
+        self.tree.delete(*[self.tree.iid_of(k) for k in to_del])
         return len(to_del)
 
     def update_list(self):
@@ -387,7 +475,8 @@ class DNSApp:
 
         def import_worker():
             try:
-                c = self.backend.import_from_urls(urls)
+                c = self.backend.import_from_urls(urls,
+                                                  refresh_interval=config.get_setting("source_refresh_minutes") * 60)
                 self.root.after(0, lambda count=c: self._after_update_list(count))
             except Exception as e:
                 self.root.after(0,
@@ -402,122 +491,198 @@ class DNSApp:
         self.status_var.set(self.t("status_ready"))
 
     def run_test(self):
+        if self.test_job:
+            return
+        self.status_var.set(self.t("msg_wait"))
+        keys = [k for k in (self.tree.key_of(item) for item in self.tree.get_children()) if k is not None]
+        job = TestJob(self.backend, self._make_engine(), self.test_var.get(), keys,
+                      max_age=config.get_setting("retest_after_minutes") * 60,
+                      checkpoint_interval=config.get_setting("checkpoint_interval_s"),
+                      all_addresses=config.get_setting("test_all_addresses"))
+        self.test_progress = (0, len(job.keys))
+        self.test_channel = UIUpdateChannel(self.root, self._apply_test_batch,
+                                            interval_ms=config.get_setting("ui_refresh_ms"),
+                                            on_close=lambda: self._after_test(job))
+        self.test_channel.start()
+        thread = threading.Thread(target=self._test_worker, args=(job, self.test_channel), daemon=True)
+        self.test_job = (job, thread)
+        self.btn_test.config(state=tk.DISABLED)
+        self.btn_pause.config(state=tk.NORMAL, text=self.t("btn_pause"))
+        self.btn_stop.config(state=tk.NORMAL)
+        thread.start()
+
+    def toggle_pause(self):
+        if not self.test_job:
+            return
+        job = self.test_job[0]
+        if job.paused:
+            job.resume()
+            self.btn_pause.config(text=self.t("btn_pause"))
+            self.status_var.set(self.t("status_testing").format(*self.test_progress))
+        else:
+            job.pause()
+            self.btn_pause.config(text=self.t("btn_resume"))
+            self.status_var.set(self.t("status_paused").format(*self.test_progress))
+
+    def stop_test(self):
+        if not self.test_job:
+            return
+        job = self.test_job[0]
+        job.cancel()
+        job.resume()  # Let paused probes see the cancel
+        self.btn_pause.config(state=tk.DISABLED)
+        self.btn_stop.config(state=tk.DISABLED)
         self.status_var.set(self.t("msg_wait"))
-        threading.Thread(target=self._test_worker, daemon=True).start()
-
-    def _test_worker(self):
-        items = list(self.tree.get_children())
-        mode = self.test_var.get()
-        domain = config.get_setting("test_domain")
 
+    def _after_test(self, job):
+        self.test_job = None
+        self.btn_test.config(state=tk.NORMAL)
+        self.btn_pause.config(state=tk.DISABLED, text=self.t("btn_pause"))
+        self.btn_stop.config(state=tk.DISABLED)
+        if job.cancelled:
+            self.status_var.set(self.t("status_stopped").format(*self.test_progress))
+        elif job.skipped:
+            self.status_var.set(self.t("status_ready") + " " + self.t("status_skipped").format(job.skipped))
+        else:
+            self.status_var.set(self.t("status_ready"))
+
+    def _make_engine(self):
+        return BenchmarkEngine(self.backend,
+                               concurrency=config.get_setting("test_concurrency"),
+                               probe_timeout=config.get_setting("probe_timeout"),
+                               deadline=config.get_setting("test_deadline"),
+                               dns_method=config.get_setting("dns_probe_method"),
+                               ping_method=config.get_setting("ping_probe_method"),
+                               samples=config.get_setting("probe_samples"),
+                               top_k=config.get_setting("adaptive_top_k"),
+                               reach_timeout=config.get_setting("reach_timeout_ms") / 1000.0,
+                               score=config.get_setting("entry_score"),
+                               transports=config.get_setting("probe_transports"),
+                               doh_url=config.get_setting("doh_url"),
+                               verify_tls=config.get_setting("verify_tls"),
+                               verify_options=config.get_setting("verify_options")
+                               if config.get_setting("verify_responses") else None)
+
+    def _test_worker(self, job, channel):
+        engine = job.engine
         auto_clean = config.get_setting("auto_clean_enabled")
         ping_limit = config.get_setting("ping_limit")
         speed_limit = config.get_setting("speed_limit")
+        loss_limit = config.get_setting("loss_limit")
 
-        total_items = len(items)
-        items_processed = 0
-
-        for item in items:
-            if item not in self.tree.get_children(): continue
-
-            items_processed += 1
-            self.root.after(0, lambda idx=items_processed: self.status_var.set(
-                self.t("status_testing").format(idx, total_items)))
-
-            try:
-                vals = self.tree.item(item)['values']
-            except:
-                continue
-
-            name_display = vals[0]
-            if "Default" in name_display or "پیش‌فرض" in name_display: continue
-
-            key = None
-            for k in list(self.dns_data.keys()):
-                if self.fix_text(k) == name_display or k == name_display:
-                    key = k
-                    break
+        total_items = len(job.keys)
+        progress = {"done": 0}
 
-            if not key or key not in self.dns_data: continue
+        def on_result(res):
+            # Runs after the job recorded the result
+            key = res["key"]
 
-            target_ip_list = self.dns_data[key].get('ipv4', []) + self.dns_data[key].get('ipv6', [])
-            if not target_ip_list: continue
-            target_ip = target_ip_list[0]
+            progress["done"] += 1
+            channel.put_progress((progress["done"], total_items))
 
-            ping, speed = vals[2], vals[3]
+            if key not in self.dns_data: return
+            if res["evicted"]:
+                channel.put_delete(key)
+                return
 
-            # --- PING TEST ---
-            if mode in ["all", "ping"]:
-                new_ping = self.backend.measure_ping(target_ip)
+            entry = self.dns_data.get(key, {})
+            channel.put_update(key, (entry.get('last_ping', '-'), entry.get('last_speed', '-'), stats.is_wrong(entry)))
 
-                if auto_clean:
-                    is_dead = new_ping == 9999
-                    is_slow = new_ping != 9999 and new_ping > ping_limit
-                    if is_dead or is_slow:
-                        self.root.after(0, self._delete_row_safe, item, key)
-                        continue
+        def on_settings(changed):
+            # Limits edited in the settings dialog apply to the servers not judged yet
+            if {"auto_clean_enabled", "ping_limit", "speed_limit", "loss_limit"} & set(changed):
+                on = config.get_setting("auto_clean_enabled")
+                engine.update_limits(config.get_setting("ping_limit") if on else None,
+                                     config.get_setting("speed_limit") if on else None,
+                                     config.get_setting("loss_limit"))
 
-                ping = new_ping
-                self.dns_data[key]['last_ping'] = ping
-
-            # --- DIG TEST ---
-            if mode in ["all", "dig"]:
-                new_speed = self.backend.measure_dig_speed(target_ip, domain)
-
-                if auto_clean:
-                    is_dead = new_speed == 9999
-                    is_slow = new_speed != 9999 and new_speed > speed_limit
-                    if is_dead or is_slow:
-                        self.root.after(0, self._delete_row_safe, item, key)
-                        continue
-
-                speed = new_speed
-                self.dns_data[key]['last_speed'] = speed
-
-            self.root.after(0, self._update_row, item, ping, speed)
-
-        self.backend.save_dns_list(self.dns_data)
-        self.root.after(0, lambda: self.status_var.set(self.t("status_ready")))
-
-    def _delete_row_safe(self, item, key):
-        """Thread-safe deletion for fail-fast logic"""
+        config.subscribe(on_settings)
         try:
-            if item in self.tree.get_children():
-                self.tree.delete(item)
-            if key in self.dns_data:
-                del self.dns_data[key]
-            self.backend.save_dns_list(self.dns_data)
-        except:
-            pass
+            job.run(on_result=on_result, domain=config.get_setting("test_domain"),
+                    ping_limit=ping_limit if auto_clean else None,
+                    speed_limit=speed_limit if auto_clean else None,
+                    loss_limit=loss_limit,
+                    cutoff=(ping_limit, speed_limit),
+                    domains=config.get_setting("benchmark_domains"))
+        except Exception as e:
+            print(f"Test failed: {e}")
+        finally:
+            config.unsubscribe(on_settings)
+            channel.close()
+
+    def _apply_test_batch(self, updates, deletes, progress):
+        """Applies one coalesced batch of test results (runs in the Tk main loop)."""
+        if progress is not None:
+            self.test_progress = progress
+            if self.test_job and not self.test_job[0].paused and not self.test_job[0].cancelled:
+                self.status_var.set(self.t("status_testing").format(*progress))
+
+        if deletes:
+            # Fail-fast deletions: one model pass and one store transaction per batch
+            self.tree.delete(*[self.tree.iid_of(k) for k in deletes])
+            self.backend.delete_servers(deletes)
+
+        for key, (ping, speed, wrong) in updates.items():
+            item = self.tree.iid_of(key)
+            if item is None: continue
+            vals = self.tree.item(item)['values']
+            self.tree.item(item, values=(vals[0], vals[1], ping, speed), tags=('wrong',) if wrong else ())
 
-    def _update_row(self, item, ping, speed):
+    def _show_history(self, event=None):
+        """Shows the 24h rolling percentiles (and cached/uncached lookup times) of the selected server."""
+        sel = self.tree.selection()
+        key = self.tree.key_of(sel[0]) if len(sel) == 1 else None
+        # Every redraw re-selects the rows (queued <<TreeviewSelect>>); only a new selection is worth the queries
+        if key == self._history_key: return
+        self._history_key = key
+        entry = self.dns_data.get(key) if key is not None else None
+        ips = (entry.get("ipv4", []) + entry.get("ipv6", [])) if entry else []
+        if not ips: return
+        fmt = lambda v: '-' if v is None else v
+        parts = []
         try:
-            vals = self.tree.item(item)['values']
-            self.tree.item(item, values=(vals[0], vals[1], ping, speed))
-        except:
-            pass
+            ping = self.backend.history_stats(ips[:1], "ping").get(ips[0])
+            dig = self.backend.history_stats(ips[:1], "dns").get(ips[0])
+        except Exception:
+            ping = dig = None
+        if ping or dig:
+            ping, dig = ping or {}, dig or {}
+            loss = (dig or ping).get("loss")
+            parts.append(self.t("status_history").format(
+                ips[0], fmt(ping.get("p50")), fmt(ping.get("p95")), fmt(dig.get("p50")), fmt(dig.get("p95")),
+                '-' if loss is None else round(loss * 100)))
+        cached, uncached = entry.get("cached_stats"), entry.get("uncached_stats")
+        if cached or uncached:
+            cached, uncached = cached or {}, uncached or {}
+            parts.append(self.t("status_resolve").format(fmt(cached.get("p50")), fmt(uncached.get("p50")),
+                                                         fmt(uncached.get("p95"))))
+        if stats.is_wrong(entry):
+            parts.insert(0, self.t("status_wrong").format(", ".join(entry["verdict"]["issues"])))
+        for name, t in (entry.get("transports") or {}).items():
+            parts.append(self.t("status_transport").format(name.upper(), fmt(t["query_stats"]["p50"]),
+                                                           fmt(t["setup"])))
+        if parts:
+            self.status_var.set(" | ".join(parts))
 
     def sort_tree(self, col, reverse):
         l = []
-        for k in self.tree.get_children(''):
+        for k in self.tree.get_children():
             value = self.tree.set(k, col)
             l.append((value, k))
 
         if col in ('ping', 'speed'):
-            # Numerical sort: Treat non-digits (like '-', '9999') as a very high number (99999)
+            # Numerical sort on the stored statistics (p50, then loss and p95); untested rows go last
             def sort_key(t):
-                v = str(t[0]).strip()
-                try:
-                    return float(v)
-                except ValueError:
-                    return 99999.0
+                entry = self.dns_data.get(self.tree.key_of(t[1]))
+                if entry is None:
+                    return (3, 0, 0, 0)
+                return stats.sort_key(entry, col)
         else:  # 'name', 'ipv4' (string sort)
             def sort_key(t):
                 return str(t[0]).lower()
 
         l.sort(key=sort_key, reverse=reverse)
 
-        for index, (val, k) in enumerate(l):
-            self.tree.move(k, '', index)
+        self.tree.reorder([k for val, k in l])
 
         self.tree.heading(col, command=lambda: self.sort_tree(col, not reverse))
\ No newline at end of file
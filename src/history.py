@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from stats import DEAD, percentile
+
+HISTORY_FILE = os.path.expanduser("~/.ubuntu_dns_manager_history.db")
+
+KINDS = {"ping": 0, "dns": 1, "cached": 2, "uncached": 3}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ip TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS samples_ip_ts ON samples(ip, ts);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples(ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    ip TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    p50 REAL,
+    p95 REAL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (ip, kind, hour)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_hour ON rollups(hour);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+def _rollup(count, ok, p50, p95, mn, mx):
+    """A rollup row as a summary dict."""
+    return {"count": count, "ok": ok, "loss": round(1 - ok / count, 3) if count else None,
+            "p50": p50, "p95": p95, "min": mn, "max": mx}
+
+
+def _merge(a, b):
+    """
+    Two summaries of the same series combined: count/ok/min/max exactly, p50/p95
+    as the average weighted by answered samples (like merged rollups, see _merged).
+    """
+    count, ok = a["count"] + b["count"], a["ok"] + b["ok"]
+    merged = {"count": count, "ok": ok, "loss": round(1 - ok / count, 3) if count else None}
+    for k in ("p50", "p95"):
+        if not b["ok"]:
+            merged[k] = a[k]
+        elif not a["ok"]:
+            merged[k] = b[k]
+        else:
+            merged[k] = round((a[k] * a["ok"] + b[k] * b["ok"]) / ok, 1)
+    for k, pick in (("min", min), ("max", max)):
+        values = [x[k] for x in (a, b) if x[k] is not None]
+        merged[k] = pick(values) if values else None
+    return merged
+
+
+def _merged(column):
+    """SQL for a percentile of two merged rollup buckets: the average weighted by their answered samples."""
+    return ("CASE WHEN excluded.ok = 0 THEN rollups.{0} WHEN rollups.ok = 0 THEN excluded.{0} "
+            "ELSE round((rollups.{0} * rollups.ok + excluded.{0} * excluded.ok) / (rollups.ok + excluded.ok), 1) "
+            "END").format(column)
+
+
+def _summary(latencies, count):
+    ok = [x for x in latencies if x is not None]
+    summary = {"count": count, "ok": len(ok), "loss": round(1 - len(ok) / count, 3) if count else None,
+               "p50": None, "p95": None, "min": None, "max": None}
+    if ok:
+        summary.update(p50=round(percentile(ok, 50), 1), p95=round(percentile(ok, 95), 1),
+                       min=round(min(ok), 1), max=round(max(ok), 1))
+    return summary
+
+
+class ProbeHistory:
+    """
+    Append-only time series of probe results, keyed by server IP.
+    Raw samples (timestamp, kind, latency; NULL latency = failed) are kept for
+    raw_retention seconds, then downsampled into hourly rollups
+    (count/ok/p50/p95/min/max) that are kept for rollup_retention seconds.
+    Writes are buffered and committed in batches.
+    """
+
+    def __init__(self, path=HISTORY_FILE, raw_retention=24 * 3600, rollup_retention=30 * 24 * 3600,
+                 flush_size=1000):
+        self.raw_retention = raw_retention
+        self.rollup_retention = rollup_retention
+        self.flush_size = flush_size
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # --- Writing ---
+    def add(self, ip, kind, latency, ts=None):
+        """Buffers one sample. latency is in ms; None or 9999 means the probe failed."""
+        if latency == DEAD:
+            latency = None
+        with self.lock:
+            self._buffer.append((ip, int(ts or time.time()), KINDS[kind], latency))
+            if len(self._buffer) >= self.flush_size:
+                self.flush()
+
+    def add_result(self, result, ts=None):
+        """Buffers every raw sample of a benchmark engine result."""
+        ts = ts or time.time()
+        fields = [("ping", "ping_samples")]
+        if "cached_samples" in result:
+            # Resolution benchmark: its speed is just cached + uncached pooled
+            fields += [("cached", "cached_samples"), ("uncached", "uncached_samples")]
+        else:
+            fields.append(("dns", "speed_samples"))
+        for kind, field in fields:
+            for latency in result.get(field) or ():
+                self.add(result["ip"], kind, latency, ts)
+
+    def flush(self):
+        with self.lock:
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            started = time.monotonic()
+            with self._transaction():
+                self.conn.executemany("INSERT INTO samples (ip, ts, kind, latency) VALUES (?, ?, ?, ?)", rows)
+            metrics.FLUSH_DURATION.labels("history").observe(time.monotonic() - started)
+            metrics.FLUSH_ROWS.labels("history").inc(len(rows))
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'compacted'").fetchone()
+        if not row or time.time() - row[0] > 3600:
+            self.compact()
+
+    def compact(self, now=None):
+        """Rolls raw samples older than raw_retention into hourly rollups and drops expired rollups."""
+        now = int(now or time.time())
+        # Only whole hours are rolled up, so a bucket is never split between raw and rollup data
+        cutoff = (now - self.raw_retention) // 3600 * 3600
+        with self.lock:
+            groups = {}
+            for ip, ts, kind, latency in self.conn.execute(
+                    "SELECT ip, ts, kind, latency FROM samples WHERE ts < ?", (cutoff,)):
+                groups.setdefault((ip, kind, ts // 3600 * 3600), []).append(latency)
+
+            rows = []
+            for (ip, kind, hour), latencies in groups.items():
+                s = _summary(latencies, len(latencies))
+                rows.append((ip, hour, kind, s["count"], s["ok"], s["p50"], s["p95"], s["min"], s["max"]))
+
+            with self._transaction():
+                # A late flush may add to an hour that was already rolled up: merge the two buckets.
+                # count/ok/min/max stay exact; the raw samples of the old bucket are gone, so its
+                # percentiles are combined as the average weighted by answered samples.
+                self.conn.executemany(
+                    "INSERT INTO rollups (ip, hour, kind, count, ok, p50, p95, min, max) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(ip, kind, hour) DO UPDATE SET "
+                    "count = rollups.count + excluded.count, ok = rollups.ok + excluded.ok, "
+                    "p50 = " + _merged("p50") + ", p95 = " + _merged("p95") + ", "
+                    "min = min(coalesce(rollups.min, excluded.min), coalesce(excluded.min, rollups.min)), "
+                    "max = max(coalesce(rollups.max, excluded.max), coalesce(excluded.max, rollups.max))", rows)
+                self.conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+                self.conn.execute("DELETE FROM rollups WHERE hour < ?", (now - self.rollup_retention,))
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('compacted', ?)", (now,))
+
+    # --- Queries ---
+    def percentiles(self, kind="dns", window=3600, ips=None, now=None):
+        """
+        Rolling p50/p95/loss per IP over the last window seconds. Raw samples
+        cover raw_retention; older (whole) hours of a longer window come from
+        the hourly rollups and are merged in (see _merge).
+        Returns {ip: {"count", "ok", "loss", "p50", "p95", "min", "max"}}.
+        """
+        self.flush()
+        since = int(now or time.time()) - window
+        where, params = "kind = ?", [KINDS[kind]]
+        if ips is not None:
+            ips = list(ips)
+            if len(ips) <= 500:
+                where += " AND ip IN (%s)" % ','.join('?' * len(ips))
+                params += ips
+        wanted = set(ips) if ips is not None else None
+
+        groups = {}
+        rollups = []
+        with self.lock:
+            for ip, latency in self.conn.execute(
+                    "SELECT ip, latency FROM samples WHERE %s AND ts >= ?" % where, params + [since]):
+                if wanted is None or ip in wanted:
+                    groups.setdefault(ip, []).append(latency)
+            for row in self.conn.execute(
+                    "SELECT ip, count, ok, p50, p95, min, max FROM rollups WHERE %s AND hour >= ?" % where,
+                    params + [since]):
+                if wanted is None or row[0] in wanted:
+                    rollups.append(row)
+        result = {ip: _summary(latencies, len(latencies)) for ip, latencies in groups.items()}
+        for ip, *row in rollups:
+            result[ip] = _merge(result[ip], _rollup(*row)) if ip in result else _rollup(*row)
+        return result
+
+    def trend(self, ip, kind="dns", hours=24, now=None):
+        """Hourly buckets (oldest first) for one IP, from rollups and raw samples."""
+        self.flush()
+        now = int(now or time.time())
+        since = (now - hours * 3600) // 3600 * 3600
+        buckets = {}
+        with self.lock:
+            for hour, count, ok, p50, p95, mn, mx in self.conn.execute(
+                    "SELECT hour, count, ok, p50, p95, min, max FROM rollups "
+                    "WHERE ip = ? AND kind = ? AND hour >= ?", (ip, KINDS[kind], since)):
+                buckets[hour] = dict(_rollup(count, ok, p50, p95, mn, mx), hour=hour)
+            raw = {}
+            for ts, latency in self.conn.execute(
+                    "SELECT ts, latency FROM samples WHERE ip = ? AND kind = ? AND ts >= ?", (ip, KINDS[kind], since)):
+                raw.setdefault(ts // 3600 * 3600, []).append(latency)
+        for hour, latencies in raw.items():
+            summary = _summary(latencies, len(latencies))
+            if hour in buckets:
+                # Late samples of an hour that was already rolled up (merged into it on the next compact)
+                summary = _merge(buckets[hour], summary)
+            buckets[hour] = dict(summary, hour=hour)
+        return [buckets[h] for h in sorted(buckets)]
@@ -0,0 +1,190 @@
+import hashlib
+import io
+import queue
+import socket
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+_DONE = object()  # Queue marker: a source finished (successfully or not)
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 4 * 1024 * 1024  # Bodies larger than this are buffered on disk while hashing
+
+
+def ip_version(token):
+    """Returns 4 or 6 for a valid address, None otherwise. Much cheaper than ipaddress.ip_address."""
+    family, version = (socket.AF_INET6, 6) if ':' in token else (socket.AF_INET, 4)
+    try:
+        socket.inet_pton(family, token)
+        return version
+    except (OSError, ValueError):
+        return None
+
+
+def parse_line(line):
+    """
+    Parses one list line into (name, ip_str, version), or None for comments,
+    blanks and lines without a valid address. Accepted formats are "IP",
+    "IP comment" and "name IP". Every token is validated at most once.
+    """
+    line = line.strip()
+    if not line or line.startswith(('#', '//')):
+        return None
+
+    parts = line.split(None, 1)
+    if len(parts) > 1:
+        candidate = parts[1].strip()
+        version = ip_version(candidate)
+        if version:
+            # Format is: name IP
+            return parts[0], candidate, version
+
+    version = ip_version(parts[0])
+    if version:
+        # IP is the first part, use IP as name
+        return parts[0], parts[0], version
+    return None  # Not a valid IP line
+
+
+def iter_lines(stream, encoding='utf-8'):
+    """Yields decoded lines from a binary stream without reading it all into memory."""
+    yield from io.TextIOWrapper(stream, encoding=encoding, errors='replace')
+
+
+class ListImporter:
+    """
+    Downloads DNS lists concurrently and merges them into a DNS list dict.
+    Sources are parsed as line streams and handed to the merging thread
+    through a bounded queue, so memory does not grow with the size of a list.
+
+    With a cache (any object with get_source(url)/put_source(url, record), e.g.
+    DNSStore) sources fetched less than refresh_interval seconds ago are skipped,
+    HTTP requests are conditional (ETag/Last-Modified), and a body whose hash
+    did not change is neither parsed nor merged again.
+    """
+
+    def __init__(self, workers=8, timeout=10, batch_size=1000, queue_size=64, cache=None, refresh_interval=0):
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+
+    def _open(self, url, cached):
+        request = urllib.request.Request(url)
+        if cached and url.startswith(('http://', 'https://')):
+            if cached.get("etag"):
+                request.add_header('If-None-Match', cached["etag"])
+            if cached.get("last_modified"):
+                request.add_header('If-Modified-Since', cached["last_modified"])
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _fetch(self, url, report, out, force):
+        """Worker: streams one source and puts batches of parsed entries on out."""
+        try:
+            cached = self.cache.get_source(url) if self.cache else None
+            now = time.time()
+            if cached and not force and now - cached.get("fetched_at", 0) < self.refresh_interval:
+                report["status"] = "fresh"
+                return
+
+            try:
+                # Forced: a full download, so servers removed from the list come back from an unchanged source
+                response = self._open(url, None if force else cached)
+            except urllib.error.HTTPError as e:
+                if e.code != 304:
+                    raise
+                report["status"] = "not_modified"
+                report["cache"] = dict(cached, fetched_at=now)
+                return
+
+            with response, tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    body.write(chunk)
+                record = {"etag": response.headers.get('ETag'),
+                          "last_modified": response.headers.get('Last-Modified'),
+                          "sha256": digest.hexdigest(), "fetched_at": now}
+
+                if cached and not force and cached.get("sha256") == record["sha256"]:
+                    report["status"] = "unchanged"
+                    report["cache"] = dict(cached, **record)
+                    return
+
+                body.seek(0)
+                batch = []
+                for line in iter_lines(body):
+                    report["lines"] += 1
+                    parsed = parse_line(line)
+                    if parsed is None:
+                        continue
+                    batch.append(parsed)
+                    if len(batch) >= self.batch_size:
+                        out.put((report, batch))
+                        batch = []
+                if batch:
+                    out.put((report, batch))
+
+            # Unchanged sources are never merged again, so the parse summary is all that is kept
+            record["lines"] = report["lines"]
+            report["status"] = "updated"
+            report["cache"] = record
+        except Exception as e:
+            report["status"] = "error"
+            report["error"] = str(e)
+        finally:
+            out.put((report, _DONE))
+
+    def merge_into(self, data, urls, force=False):
+        """
+        Fetches all urls and adds their servers to data in place.
+        Returns (new_ip_count, per-source reports in the order of urls).
+        force ignores the refresh interval, the conditional requests and the
+        unchanged-hash shortcut: every source is downloaded and merged again.
+        """
+        urls = list(urls)
+        out = queue.Queue(maxsize=self.queue_size)
+        known = {}  # name -> {4: set, 6: set}, built lazily from data
+        added = 0
+        pending = len(urls)
+
+        reports = [{"url": url, "status": None, "lines": 0, "valid": 0, "added": 0, "error": None} for url in urls]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(urls)))) as pool:
+            for url, report in zip(urls, reports):
+                pool.submit(self._fetch, url, report, out, force)
+
+            while pending:
+                metrics.IMPORT_QUEUE_DEPTH.set(out.qsize())
+                report, batch = out.get()
+                if batch is _DONE:
+                    pending -= 1
+                    continue
+                for name, ip_str, version in batch:
+                    report["valid"] += 1
+                    entry = data.get(name)
+                    if entry is None:
+                        entry = data[name] = {"ipv4": [], "ipv6": [], "last_ping": '-', "last_speed": '-'}
+                    sets = known.get(name)
+                    if sets is None:
+                        sets = known[name] = {4: set(entry.get("ipv4", [])), 6: set(entry.get("ipv6", []))}
+                    if ip_str in sets[version]:
+                        continue
+                    sets[version].add(ip_str)
+                    entry.setdefault("ipv4" if version == 4 else "ipv6", []).append(ip_str)
+                    report["added"] += 1
+                    added += 1
+
+        for report in reports:
+            record = report.pop("cache", None)
+            if record and self.cache:
+                if report["status"] == "updated":
+                    record["valid"] = report["valid"]
+                self.cache.put_source(report["url"], record)
+        return added, reports
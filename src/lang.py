@@ -17,6 +17,9 @@
         "opt_clean_settings": "Clean by Rules Now",
         "btn_update": "Update List",
         "btn_test": "Run Test",
+        "btn_pause": "Pause",
+        "btn_resume": "Resume",
+        "btn_stop": "Stop",
         "menu_settings": "Settings & Language",
         "msg_apply": "DNS Applied Successfully!",
         "msg_del": "Deleted {} entries.",
@@ -24,6 +27,13 @@
         "msg_wait": "Processing...",
         "status_ready": "Ready.",
         "status_testing": "Testing {}/{}...",
+        "status_paused": "Paused at {}/{}.",
+        "status_stopped": "Stopped at {}/{}. Run Test again to test the rest.",
+        "status_skipped": "{} servers tested recently were skipped.",
+        "status_history": "{} (24h): ping p50 {} / p95 {} ms, dig p50 {} / p95 {} ms, loss {}%",
+        "status_resolve": "cached p50 {} ms, uncached p50 {} / p95 {} ms",
+        "status_transport": "{} {} ms (setup {} ms)",
+        "status_wrong": "Wrong answers: {}",
         "err_perm": "Run as Root (sudo)!",
         "settings_title": "Settings",
         "lbl_urls": "Update URLs:",
@@ -32,6 +42,9 @@
         "lbl_max_ping": "Max Ping (ms):",
         "lbl_max_speed": "Max Dig (ms):",
         "chk_auto_clean": "Enable Auto-Clean during test",
+        "chk_forwarder": "Apply through the local caching forwarder",
+        "err_forwarder": "Could not start the local forwarder: {}",
+        "lbl_concurrency": "Parallel Tests:",
         "test_mode": "Test:",
         "confirm_del": "Delete selected items?"
     },
@@ -53,6 +66,9 @@
         "opt_clean_settings": "حذف طبق قوانین (الان)",
         "btn_update": "دریافت آپدیت",
         "btn_test": "شروع تست",
+        "btn_pause": "توقف موقت",
+        "btn_resume": "ادامه",
+        "btn_stop": "توقف",
         "menu_settings": "تنظیمات و زبان",
         "msg_apply": "DNS با موفقیت اعمال شد!",
         "msg_del": "تعداد {} مورد حذف شد.",
@@ -60,6 +76,13 @@
         "msg_wait": "لطفا صبر کنید...",
         "status_ready": "آماده.",
         "status_testing": "در حال تست {}/{}...",
+        "status_paused": "متوقف موقت در {}/{}.",
+        "status_stopped": "تست در {}/{} متوقف شد. برای تست بقیه دوباره «شروع تست» را بزنید.",
+        "status_skipped": "{} سرور که اخیراً تست شده بودند رد شدند.",
+        "status_history": "{} (۲۴ ساعت): پینگ p50 {} / p95 {} ms، dig p50 {} / p95 {} ms، افت {}%",
+        "status_resolve": "کش‌شده p50 {} ms، بدون کش p50 {} / p95 {} ms",
+        "status_transport": "{} {} ms (اتصال {} ms)",
+        "status_wrong": "پاسخ نادرست: {}",
         "err_perm": "لطفا با دسترسی روت (sudo) اجرا کنید!",
         "settings_title": "تنظیمات",
         "lbl_urls": "لینک‌های آپدیت:",
@@ -68,6 +91,9 @@
         "lbl_max_ping": "حداکثر پینگ:",
         "lbl_max_speed": "حداکثر زمان Dig:",
         "chk_auto_clean": "فعالسازی حذف خودکار هنگام تست",
+        "chk_forwarder": "اعمال از طریق فورواردر محلی با کش",
+        "err_forwarder": "راه‌اندازی فورواردر محلی ممکن نشد: {}",
+        "lbl_concurrency": "تست‌های همزمان:",
         "test_mode": "نوع تست:",
         "confirm_del": "آیا مطمئن هستید؟"
     },
@@ -89,6 +115,9 @@
         "opt_clean_settings": "按规则清理",
         "btn_update": "更新列表",
         "btn_test": "运行测试",
+        "btn_pause": "暂停",
+        "btn_resume": "继续",
+        "btn_stop": "停止",
         "menu_settings": "设置",
         "msg_apply": "DNS 已应用！",
         "msg_del": "已删除 {} 项。",
@@ -96,6 +125,13 @@
         "msg_wait": "处理中...",
         "status_ready": "就绪。",
         "status_testing": "测试中 {}/{}...",
+        "status_paused": "已暂停于 {}/{}。",
+        "status_stopped": "已停止于 {}/{}。再次运行测试以测试其余服务器。",
+        "status_skipped": "已跳过 {} 个最近测试过的服务器。",
+        "status_history": "{} (24小时): ping p50 {} / p95 {} ms, dig p50 {} / p95 {} ms, 丢包 {}%",
+        "status_resolve": "缓存命中 p50 {} ms, 未命中 p50 {} / p95 {} ms",
+        "status_transport": "{} {} ms (建立连接 {} ms)",
+        "status_wrong": "错误应答: {}",
         "err_perm": "请以 Root (sudo) 运行！",
         "settings_title": "配置",
         "lbl_urls": "更新 URL:",
@@ -104,6 +140,9 @@
         "lbl_max_ping": "最大延迟:",
         "lbl_max_speed": "最大查询:",
         "chk_auto_clean": "测试时启用自动清理",
+        "chk_forwarder": "通过本地缓存转发器应用",
+        "err_forwarder": "无法启动本地转发器：{}",
+        "lbl_concurrency": "并发测试数:",
         "test_mode": "测试模式:",
         "confirm_del": "删除所选项？"
     },
@@ -125,6 +164,9 @@
         "opt_clean_settings": "Очистить по правилам",
         "btn_update": "Обновить",
         "btn_test": "Тест",
+        "btn_pause": "Пауза",
+        "btn_resume": "Продолжить",
+        "btn_stop": "Стоп",
         "menu_settings": "Настройки",
         "msg_apply": "Применено!",
         "msg_del": "Удалено {}.",
@@ -132,6 +174,13 @@
         "msg_wait": "Обработка...",
         "status_ready": "Готов.",
         "status_testing": "Тест {}/{}...",
+        "status_paused": "Пауза на {}/{}.",
+        "status_stopped": "Остановлено на {}/{}. Запустите тест снова, чтобы проверить остальные.",
+        "status_skipped": "Пропущено недавно проверенных серверов: {}.",
+        "status_history": "{} (24ч): ping p50 {} / p95 {} мс, dig p50 {} / p95 {} мс, потери {}%",
+        "status_resolve": "из кэша p50 {} мс, без кэша p50 {} / p95 {} мс",
+        "status_transport": "{} {} мс (соединение {} мс)",
+        "status_wrong": "Неверные ответы: {}",
         "err_perm": "Запустите через sudo!",
         "settings_title": "Настройки",
         "lbl_urls": "URL обновлений:",
@@ -140,6 +189,9 @@
         "lbl_max_ping": "Макс. Пинг:",
         "lbl_max_speed": "Макс. Dig:",
         "chk_auto_clean": "Вкл. авто-очистку при тесте",
+        "chk_forwarder": "Применять через локальный кэширующий форвардер",
+        "err_forwarder": "Не удалось запустить локальный форвардер: {}",
+        "lbl_concurrency": "Параллельных тестов:",
         "test_mode": "Режим:",
         "confirm_del": "Удалить?"
     }
@@ -0,0 +1,155 @@
+import asyncio
+import ipaddress
+import socket
+import struct
+import time
+
+import metrics
+from dnsprobe import DNSProber
+
+ICMP_ECHO_REQUEST = {4: 8, 6: 128}
+ICMP_ECHO_REPLY = {4: 0, 6: 129}
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo(version, seq, payload=b'ubuntu-dns-manager'):
+    """Builds an ICMP/ICMPv6 echo request. The kernel fills in the identifier."""
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST[version], 0, 0, 0, seq)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST[version], 0, _checksum(header + payload), 0, seq) + payload
+
+
+class _EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self, prober, version):
+        self.prober = prober
+        self.version = version
+
+    def datagram_received(self, data, addr):
+        self.prober._on_echo_reply(self.version, data, addr)
+
+    def error_received(self, exc):
+        pass
+
+
+class LatencyProber:
+    """
+    Measures round-trip latency to many targets from one process.
+    Uses unprivileged ICMP datagram sockets (net.ipv4.ping_group_range) when the
+    kernel allows them, otherwise falls back to a TCP/53 connect or a UDP/53 DNS
+    round trip. Must be used from inside a running event loop; the caller
+    takes the samples (see BenchmarkEngine._sample).
+    """
+
+    def __init__(self, timeout=1.0, fallback="tcp", port=53):
+        self.timeout = float(timeout)
+        self.fallback = fallback  # "tcp" or "udp"
+        self.port = port
+        self._icmp = {}  # version -> transport, or None when not permitted
+        self._seq = 0
+        self._pending = {}
+        self._dns = None
+        self._lock = None  # Created in the running loop by _get_icmp
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for transport in self._icmp.values():
+            if transport:
+                transport.close()
+        self._icmp = {}
+        if self._dns:
+            self._dns.close()
+            self._dns = None
+        for fut, _sent in self._pending.values():
+            if not fut.done():
+                fut.cancel()
+        self._pending.clear()
+
+    async def _get_icmp(self, version):
+        if version in self._icmp:
+            return self._icmp[version]
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # One socket per version: concurrent first probes wait for the one being opened
+        async with self._lock:
+            if version not in self._icmp:
+                try:
+                    family, proto = (socket.AF_INET, socket.IPPROTO_ICMP) if version == 4 else \
+                        (socket.AF_INET6, socket.IPPROTO_ICMPV6)
+                    sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+                    sock.setblocking(False)
+                    loop = asyncio.get_running_loop()
+                    transport, _ = await loop.create_datagram_endpoint(lambda: _EchoProtocol(self, version),
+                                                                       sock=sock)
+                    self._icmp[version] = transport
+                except OSError:
+                    # Not in ping_group_range (or no IPv6): use the fallback from now on
+                    self._icmp[version] = None
+        return self._icmp[version]
+
+    def _on_echo_reply(self, version, data, addr):
+        if len(data) < 8:
+            return
+        icmp_type, _code, _csum, _ident, seq = struct.unpack('!BBHHH', data[:8])
+        if icmp_type != ICMP_ECHO_REPLY[version]:
+            return
+        entry = self._pending.pop((addr[0], seq), None)
+        if entry is None:
+            return
+        fut, sent = entry
+        if not fut.done():
+            fut.set_result(time.monotonic() - sent)
+
+    async def _icmp_rtt(self, transport, version, ip):
+        self._seq = (self._seq + 1) % 0x10000
+        seq = self._seq
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[(ip, seq)] = (fut, time.monotonic())
+        try:
+            transport.sendto(build_echo(version, seq), (ip, 0))
+            return await asyncio.wait_for(fut, self.timeout)
+        finally:
+            self._pending.pop((ip, seq), None)
+
+    async def _tcp_rtt(self, ip):
+        start = time.monotonic()
+        try:
+            _reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, self.port), self.timeout)
+        except ConnectionRefusedError:
+            # A RST still is a full round trip from a live host
+            return time.monotonic() - start
+        elapsed = time.monotonic() - start
+        writer.close()
+        return elapsed
+
+    async def _udp_rtt(self, ip):
+        if self._dns is None:
+            self._dns = DNSProber(timeout=self.timeout, sockets=2, port=self.port)
+        elapsed, _data = await self._dns.query(ip, '.')
+        return elapsed
+
+    async def rtt(self, ip):
+        """Returns one round-trip time in seconds, or None when the target did not answer."""
+        addr = ipaddress.ip_address(ip)
+        try:
+            transport = await self._get_icmp(addr.version)
+            if transport:
+                return await self._icmp_rtt(transport, addr.version, addr.compressed)
+            if self.fallback == "udp":
+                return await self._udp_rtt(addr.compressed)
+            return await self._tcp_rtt(addr.compressed)
+        except (OSError, asyncio.TimeoutError) as e:
+            metrics.SOCKET_ERRORS.labels("icmp" if self._icmp.get(addr.version) else self.fallback,
+                                         metrics.error_name(e)).inc()
+            return None
@@ -0,0 +1,205 @@
+import itertools
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualTreeview(ttk.Frame):
+    """
+    A Treeview that keeps all rows in an in-memory model and only materializes
+    the rows that are currently visible. Inserts, updates and removals touch
+    the model and redraw at most one screen of items, so the widget stays
+    responsive with 100k+ rows.
+
+    The API mirrors the parts of ttk.Treeview the app uses (insert, item, set,
+    delete, exists, get_children, selection, heading, column, tag_configure).
+    display(values) may be passed to format a row just before it is shown.
+    Rows can carry a backend key; key_of/iid_of map between the two in O(1).
+    """
+
+    def __init__(self, master, columns, row_height=25, display=None, **kw):
+        super().__init__(master, **kw)
+        self.row_height = row_height
+        self.display = display
+        self.columns = tuple(columns)
+
+        self.tree = ttk.Treeview(self, columns=self.columns, show='headings', selectmode='extended')
+        self.scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self._ids = itertools.count(1)
+        self._order = []  # iids in display order
+        self._rows = {}  # iid -> [values, tags]
+        self._keys = {}  # iid -> backend key
+        self._iids = {}  # backend key -> iid
+        self._selected = set()
+        self._top = 0
+        self._visible = 20
+        self._shown = []  # iids currently materialized in the Treeview
+        self._pending_render = False
+
+        self.tree.bind('<Configure>', self._on_configure)
+        self.tree.bind('<<TreeviewSelect>>', self._on_select)
+        self.tree.bind('<MouseWheel>', lambda e: self._scroll_units(-1 if e.delta > 0 else 1, 3))
+        self.tree.bind('<Button-4>', lambda e: self._scroll_units(-1, 3))
+        self.tree.bind('<Button-5>', lambda e: self._scroll_units(1, 3))
+        self.tree.bind('<Up>', lambda e: self._on_arrow(-1))
+        self.tree.bind('<Down>', lambda e: self._on_arrow(1))
+        self.tree.bind('<Prior>', lambda e: self._scroll_units(-1, self._visible))
+        self.tree.bind('<Next>', lambda e: self._scroll_units(1, self._visible))
+
+    # --- Treeview-like API ---
+    def heading(self, column, **kw):
+        return self.tree.heading(column, **kw)
+
+    def column(self, column, **kw):
+        return self.tree.column(column, **kw)
+
+    def tag_configure(self, tag, **kw):
+        return self.tree.tag_configure(tag, **kw)
+
+    def insert(self, values, tags=(), key=None):
+        """Appends a row to the model and returns its iid. key links the row to a backend entry."""
+        iid = 'r%d' % next(self._ids)
+        self._rows[iid] = [tuple(values), tuple(tags)]
+        if key is not None:
+            self._keys[iid] = key
+            self._iids[key] = iid
+        self._order.append(iid)
+        self._schedule_render()
+        return iid
+
+    def item(self, iid, values=None, tags=None):
+        """Returns {'values': [...], 'tags': [...]} for iid, or replaces its values and/or tags."""
+        row = self._rows[iid]
+        if values is None and tags is None:
+            return {'values': list(row[0]), 'tags': list(row[1])}
+        if values is not None:
+            row[0] = tuple(values)
+        if tags is not None:
+            row[1] = tuple(tags)
+        if iid in self._shown:
+            self._schedule_render()
+
+    def set(self, iid, column):
+        return self._rows[iid][0][self.columns.index(column)]
+
+    def exists(self, iid):
+        return iid in self._rows
+
+    def delete(self, *iids):
+        dead = {iid for iid in iids if iid in self._rows}
+        if not dead:
+            return
+        for iid in dead:
+            del self._rows[iid]
+            key = self._keys.pop(iid, None)
+            if key is not None:
+                self._iids.pop(key, None)
+        self._selected -= dead
+        self._order = [iid for iid in self._order if iid not in dead]
+        self._schedule_render()
+
+    def clear(self):
+        self._order = []
+        self._rows = {}
+        self._keys = {}
+        self._iids = {}
+        self._selected = set()
+        self._top = 0
+        self._schedule_render()
+
+    def key_of(self, iid):
+        """Backend key of a row, or None for rows without one."""
+        return self._keys.get(iid)
+
+    def iid_of(self, key):
+        """Row of a backend key, or None when it is not in the list."""
+        return self._iids.get(key)
+
+    def get_children(self):
+        return tuple(self._order)
+
+    def selection(self):
+        """Selected iids in display order, including rows scrolled out of view."""
+        if not self._selected:
+            return ()
+        return tuple(iid for iid in self._order if iid in self._selected)
+
+    def reorder(self, iids):
+        """Replaces the display order (used for sorting)."""
+        self._order = [iid for iid in iids if iid in self._rows]
+        self._schedule_render()
+
+    # --- Rendering ---
+    def _schedule_render(self):
+        if not self._pending_render:
+            self._pending_render = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        self._pending_render = False
+        total = len(self._order)
+        self._top = max(0, min(self._top, total - self._visible))
+        window = self._order[self._top:self._top + self._visible + 1]
+
+        self.tree.delete(*self.tree.get_children())
+        for iid in window:
+            values, tags = self._rows[iid]
+            if self.display:
+                values = self.display(values)
+            self.tree.insert('', tk.END, iid=iid, values=values, tags=tags)
+        self._shown = window
+        self.tree.selection_set([iid for iid in window if iid in self._selected])
+
+        if total:
+            self.scroll.set(self._top / total, min(1.0, (self._top + self._visible) / total))
+        else:
+            self.scroll.set(0.0, 1.0)
+
+    def _on_configure(self, event):
+        visible = max(1, event.height // self.row_height - 1)  # One row is taken by the headings
+        if visible != self._visible:
+            self._visible = visible
+            self._schedule_render()
+
+    def _on_select(self, event):
+        current = set(self.tree.selection())
+        self._selected.difference_update(self._shown)
+        self._selected.update(current)
+
+    def _scroll_to(self, top):
+        top = max(0, min(int(top), len(self._order) - self._visible))
+        if top != self._top:
+            self._top = top
+            self._schedule_render()
+
+    def _scroll_units(self, direction, amount):
+        self._scroll_to(self._top + direction * amount)
+        return 'break'
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self._scroll_to(float(args[1]) * len(self._order))
+        elif args[0] == 'scroll':
+            amount = self._visible if args[2] == 'pages' else 1
+            self._scroll_units(int(args[1]), amount)
+
+    def _on_arrow(self, direction):
+        """Moves the keyboard selection past the edge of the visible window."""
+        focus = self.tree.focus()
+        if not focus or focus not in self._rows:
+            return None
+        pos = self._top + self._shown.index(focus) if focus in self._shown else None
+        if pos is None:
+            return None
+        new = pos + direction
+        if new < 0 or new >= len(self._order):
+            return 'break'
+        if self._top <= new < self._top + self._visible:
+            return None  # Still on screen, the default binding handles it
+        self._scroll_to(self._top + direction)
+        target = self._order[new]
+        self._selected = {target}
+        self.after_idle(lambda: self.tree.exists(target) and self.tree.focus(target))
+        return 'break'
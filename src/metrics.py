@@ -0,0 +1,303 @@
+import atexit
+import bisect
+import math
+import threading
+
+from fileutil import atomic_write_text
+
+# Buckets of the latency histograms (ms) and of the duration histograms (seconds)
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for (k, _), v in zip(pairs, escaped))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base of the metric types: one value per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self._children = {}
+        self._function = None
+
+    def labels(self, *values, **kw):
+        """The child for one combination of label values (by position or by name)."""
+        if kw:
+            values = tuple(kw[name] for name in self.label_names)
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self.lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        if self.label_names:
+            raise ValueError("%s needs label values" % self.name)
+        return self.labels()
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(self.label_names, label_values, extra),
+                                        _format_value(value)))
+        return '\n'.join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """A value that only goes up (events, errors, items processed)."""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '_total' if not self.name.endswith('_total') else '', values, (), child.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down (in-flight probes, queue depths). set_function reads it at export time."""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                yield '', (), (), self._function()
+            except Exception:
+                pass
+            return
+        for values, child in list(self._children.items()):
+            yield '', values, (), child.value
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies, durations) in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            running = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                running += count
+                yield '_bucket', values, (('le', _format_value(bound)),), running
+            yield '_sum', values, (), total
+            yield '_count', values, (), running
+
+
+class Registry:
+    """The metrics of the process, by name. Registering a name again returns the existing metric."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=()):
+    return REGISTRY.register(Gauge(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def error_name(exc):
+    """Label value for an exception: "timeout" for timeouts, else its class name."""
+    # By name, so importing metrics doesn't load asyncio/subprocess (asyncio.TimeoutError, subprocess.TimeoutExpired)
+    name = exc.__class__.__name__
+    if isinstance(exc, TimeoutError) or name in ("TimeoutError", "TimeoutExpired"):
+        return "timeout"
+    return name
+
+
+# --- Export ---
+def write(path, registry=REGISTRY):
+    """Writes the metrics to path atomically (for node_exporter's textfile collector, or just cat)."""
+    atomic_write_text(path, registry.render())
+
+
+def serve(port, address="127.0.0.1", registry=REGISTRY):
+    """Serves /metrics over HTTP from a daemon thread. Returns the server (port 0 picks a free one)."""
+    import http.server  # Only when the endpoint is enabled: it is slow to import
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def export(port=0, address="127.0.0.1", path="", interval=15):
+    """
+    Starts the configured exporters: the HTTP endpoint when port is set, and
+    a thread that rewrites path every interval seconds (and once at exit)
+    when path is set. Errors are printed, metrics never stop the program.
+    """
+    if port:
+        try:
+            serve(port, address)
+        except OSError as e:
+            print(f"Error starting the metrics endpoint: {e}")
+    if path:
+        stop = threading.Event()
+
+        def writer():
+            while not stop.wait(interval):
+                try:
+                    write(path)
+                except OSError as e:
+                    print(f"Error writing metrics: {e}")
+
+        def last_write():
+            stop.set()
+            try:
+                write(path)
+            except OSError as e:
+                print(f"Error writing metrics: {e}")
+
+        threading.Thread(target=writer, name="metrics-file", daemon=True).start()
+        atexit.register(last_write)
+
+
+# --- Metrics of the program ---
+PROBE_LATENCY = histogram("dns_probe_latency_ms", "Latency of answered probes.", ("kind",))
+PROBES_LOST = counter("dns_probes_lost_total", "Probes without a (valid) answer.", ("kind",))
+PROBES_IN_FLIGHT = gauge("dns_probes_in_flight", "Servers being probed right now.")
+PROBES_WAITING = gauge("dns_probes_waiting", "Servers waiting for a probe slot (test_concurrency).")
+TEST_DURATION = histogram("dns_test_duration_seconds", "Wall time of test runs.", ("mode",), SECONDS_BUCKETS)
+TEST_RESULTS = counter("dns_test_results_total", "Tested servers by outcome.", ("mode", "outcome"))
+SOCKET_ERRORS = counter("dns_socket_errors_total", "Failed in-process queries and connections.",
+                        ("transport", "error"))
+SUBPROCESS_ERRORS = counter("dns_subprocess_errors_total", "Failed or timed out ping/dig/nmcli runs.",
+                            ("command", "error"))
+UI_QUEUE_DEPTH = gauge("dns_ui_queue_depth", "Updates waiting for the next UI tick.")
+IMPORT_QUEUE_DEPTH = gauge("dns_import_queue_depth", "Parsed batches waiting to be merged.")
+IMPORT_LINES = counter("dns_import_lines_total", "Lines read from the update URLs.")
+IMPORT_VALID = counter("dns_import_valid_total", "Lines with a valid address.")
+IMPORT_ADDED = counter("dns_import_added_total", "Addresses added to the list.")
+IMPORT_ERRORS = counter("dns_import_errors_total", "Update URLs that failed.")
+IMPORT_DURATION = histogram("dns_import_duration_seconds", "Wall time of imports.", (), SECONDS_BUCKETS)
+IMPORT_RATE = gauge("dns_import_lines_per_second", "Parse rate of the last import.")
+FLUSH_DURATION = histogram("dns_flush_duration_seconds", "Time to persist pending changes.", ("store",),
+                           SECONDS_BUCKETS)
+FLUSH_ROWS = counter("dns_flush_rows_total", "Rows written or deleted by flushes.", ("store",))
+MODEL_PENDING = gauge("dns_model_pending", "List changes not written yet.")
+FORWARDER_QUERIES = counter("dns_forwarder_queries_total", "Queries answered by the local forwarder.", ("result",))
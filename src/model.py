@@ -0,0 +1,168 @@
+import atexit
+import copy
+import threading
+import time
+
+import metrics
+
+
+class DNSModel:
+    """
+    Thread-safe in-memory DNS list, shared by the GUI and the test engine.
+    Mutations only change the model and mark keys as pending; a single writer
+    thread persists the pending changes to the store (one transaction) once
+    interval seconds have passed since the first of them, and close() - also
+    run at exit - flushes whatever is left. Many changes to the same entry
+    cost one row write.
+
+    Entries are plain dicts. Change them in place only through update() (or
+    after a set()), so the model knows they must be written.
+    """
+
+    def __init__(self, store, interval=2.0):
+        self.store = store
+        self.interval = float(interval)
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # Only one flush at a time: the single writer
+        self._data = store.load()
+        self._dirty = set()
+        self._deleted = set()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._writer = None
+        metrics.MODEL_PENDING.set_function(lambda: self.pending)
+        atexit.register(self.close)
+
+    # --- Reading ---
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self._data))
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        with self.lock:
+            return list(self._data)
+
+    def items(self):
+        """A snapshot list of (key, entry) pairs; the entries are the live dicts."""
+        with self.lock:
+            return list(self._data.items())
+
+    def snapshot(self):
+        """A deep copy of the whole list, safe to change without affecting the model."""
+        with self.lock:
+            return copy.deepcopy(self._data)
+
+    @property
+    def pending(self):
+        return len(self._dirty) + len(self._deleted)
+
+    # --- Changing ---
+    def __setitem__(self, key, entry):
+        self.set(key, entry)
+
+    def __delitem__(self, key):
+        if not self.remove([key]):
+            raise KeyError(key)
+
+    def set(self, key, entry):
+        with self.lock:
+            self._data[key] = entry
+            self._mark(key)
+
+    def update(self, key, change):
+        """Calls change(entry) under the model lock. Returns False if key is no longer in the list."""
+        with self.lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            change(entry)
+            self._mark(key)
+            return True
+
+    def remove(self, keys):
+        """Removes keys from the list and returns how many were there."""
+        count = 0
+        with self.lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._dirty.discard(key)
+                    self._deleted.add(key)
+                    count += 1
+            if count:
+                self._schedule()
+        return count
+
+    def replace(self, data):
+        """Makes the model equal to data; only entries that differ become pending."""
+        with self.lock:
+            self.remove([key for key in self._data if key not in data])
+            for key, entry in data.items():
+                if self._data.get(key) != entry:
+                    self.set(key, entry)
+
+    def _mark(self, key):
+        self._deleted.discard(key)
+        self._dirty.add(key)
+        self._schedule()
+
+    # --- Writing ---
+    def _schedule(self):
+        if self._writer is None and not self._closed.is_set():
+            self._writer = threading.Thread(target=self._write_loop, name="dns-model-writer", daemon=True)
+            self._writer.start()
+        self._wake.set()
+
+    def _write_loop(self):
+        while not self._closed.is_set():
+            self._wake.wait()
+            # Debounce: collect everything that changes during the interval into one write
+            self._closed.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error saving DNS list: {e}")
+
+    def flush(self):
+        """Writes all pending changes now (in one store transaction per kind). Returns the number of changes."""
+        with self._flush_lock:
+            with self.lock:
+                dirty = {key: copy.deepcopy(self._data[key]) for key in self._dirty if key in self._data}
+                deleted = list(self._deleted)
+                self._dirty.clear()
+                self._deleted.clear()
+            if not dirty and not deleted:
+                return 0
+            started = time.monotonic()
+            try:
+                self.store.delete(deleted)
+                self.store.upsert(dirty)
+            except BaseException:
+                with self.lock:
+                    # Keep them pending unless they changed again meanwhile
+                    self._deleted.update(k for k in deleted if k not in self._data)
+                    self._dirty.update(k for k in dirty if k in self._data)
+                raise
+            metrics.FLUSH_DURATION.labels("list").observe(time.monotonic() - started)
+            metrics.FLUSH_ROWS.labels("list").inc(len(dirty) + len(deleted))
+            return len(dirty) + len(deleted)
+
+    def close(self):
+        """Stops the writer and flushes the pending changes. Safe to call more than once."""
+        self._closed.set()
+        self._wake.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
+        self.flush()
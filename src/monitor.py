@@ -0,0 +1,186 @@
+import asyncio
+import collections
+import time
+
+from dnsprobe import DNSProber
+import stats
+from stats import summarize
+
+
+class FailoverMonitor:
+    """
+    Keeps watching the DNS servers applied to a connection and fails over to
+    a better one when they degrade. Every interval seconds it sends one
+    in-process DNS query to the active server and to the top `candidates`
+    ranked alternatives, and keeps a rolling window of the last `window`
+    results per address.
+
+    The active server is considered bad when its rolling p50 is over
+    latency_limit or its loss is over loss_limit. Switching needs:
+      - the active server to be bad for trip_count evaluations in a row,
+      - cooldown seconds since the last switch,
+      - a candidate with a full window, loss under loss_limit and a p50
+        at least `hysteresis` (a fraction) below the active one and under
+        latency_limit.
+    So a single slow answer never triggers a change, and two servers of
+    similar speed never flap. nmcli is only called when a switch happens.
+    """
+
+    def __init__(self, backend, connection=None, interval=10, window=12, candidates=5, latency_limit=150,
+                 loss_limit=0.25, trip_count=3, cooldown=600, hysteresis=0.3, domain="google.com", timeout=2.0,
+                 dry_run=False, on_event=None):
+        self.backend = backend
+        self.connection = connection
+        self.interval = float(interval)
+        self.window = max(2, int(window))
+        self.candidates = max(1, int(candidates))
+        self.latency_limit = latency_limit
+        self.loss_limit = loss_limit
+        self.trip_count = max(1, int(trip_count))
+        self.cooldown = float(cooldown)
+        self.hysteresis = float(hysteresis)
+        self.domain = domain
+        self.timeout = float(timeout)
+        self.dry_run = dry_run
+        self.on_event = on_event
+
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.active = None  # (key or None, [ipv4...], [ipv6...]) currently applied
+        self.bad_streak = 0
+        self._reported = False  # "degraded" was reported for the current bad streak
+        self.last_switch = float('-inf')  # time.monotonic() of the last switch
+        self._candidates = []  # Keys of the alternatives being probed
+
+    def _emit(self, event, **fields):
+        if self.on_event:
+            self.on_event(dict(fields, event=event, time=round(time.time(), 1)))
+
+    def _read_active(self):
+        """Reads the DNS servers currently set on the connection."""
+        conn = self.connection or self.backend.get_active_connection()
+        if not conn:
+            return None
+        self.connection = conn
+        ipv4, ipv6 = self.backend.get_dns(conn)
+        if not ipv4 and not ipv6:
+            return None  # Automatic (DHCP) DNS: nothing to watch
+        names = self.backend.store.find_by_ip((ipv4 + ipv6)[0])
+        if self.active and self.active[0] in names:
+            return self.active[0], ipv4, ipv6  # The address is in several entries: keep the one we know
+        return names[0] if names else None, ipv4, ipv6
+
+    def _pick_candidates(self):
+        active_key = self.active[0] if self.active else None
+        picked = []
+        for key in self.backend.rank_servers(self.backend.model):
+            entry = self.backend.model.get(key)
+            if key == active_key or not entry or stats.is_wrong(entry):
+                continue
+            s = stats.entry_stats(entry, "speed")
+            if not s or s["p50"] is None or not (entry.get("ipv4") or entry.get("ipv6")):
+                continue
+            picked.append(key)
+            if len(picked) >= self.candidates:
+                break
+        self._candidates = picked
+
+    def _address(self, key):
+        """The address of a candidate the system would query first."""
+        entry = self.backend.model.get(key) or {}
+        ipv4, ipv6 = self.backend.ordered_dns(entry)
+        ips = ipv4 + ipv6
+        return ips[0] if ips else None
+
+    def rolling(self, ip):
+        """summarize() of the rolling window of ip, or None while the window isn't full."""
+        window = self.samples.get(ip)
+        if not window or len(window) < self.window:
+            return None
+        return summarize(list(window))
+
+    def _is_bad(self, s):
+        return s["p50"] is None or s["loss"] > self.loss_limit or s["p50"] > self.latency_limit
+
+    async def _probe_all(self, prober, ips):
+        results = await asyncio.gather(*(prober.measure(ip, self.domain) for ip in ips))
+        for ip, ms in zip(ips, results):
+            self.samples[ip].append(ms)
+
+    def _evaluate(self, now):
+        """Decides whether to switch; returns the key to switch to or None."""
+        active_ip = (self.active[1] + self.active[2])[0]
+        current = self.rolling(active_ip)
+        if current is None:
+            return None
+        self.bad_streak = self.bad_streak + 1 if self._is_bad(current) else 0
+        if not self.bad_streak:
+            self._reported = False
+        if self.bad_streak < self.trip_count or now - self.last_switch < self.cooldown:
+            return None
+
+        limit = self.latency_limit if current["p50"] is None else \
+            min(self.latency_limit, current["p50"] * (1 - self.hysteresis))
+        best = None
+        for key in self._candidates:
+            s = self.rolling(self._address(key))
+            if s is None or s["p50"] is None or s["loss"] > self.loss_limit or s["p50"] >= limit:
+                continue
+            if best is None or (s["p50"], s["loss"]) < (best[1]["p50"], best[1]["loss"]):
+                best = (key, s)
+        if best is None:
+            if not self._reported:
+                self._emit("degraded", server=self.active[0], ip=active_ip, stats=current)
+                self._reported = True
+            return None
+        self._emit("failover", server=self.active[0], ip=active_ip, stats=current, to=best[0], to_stats=best[1])
+        return best[0]
+
+    def _switch(self, key, now):
+        entry = self.backend.model.get(key) or {}
+        ipv4, ipv6 = self.backend.ordered_dns(entry)
+        if self.dry_run:
+            ok, msg = True, "Dry run."
+        else:
+            ok, msg = self.backend.set_dns(self.connection, ipv4, ipv6)
+        self._emit("applied" if ok else "apply_failed", server=key, connection=self.connection, message=msg)
+        # A failed apply also waits for the cooldown, so a broken nmcli isn't retried every interval
+        self.last_switch = now
+        self.bad_streak = 0
+        if ok:
+            self.active = (key, ipv4, ipv6)
+            self._pick_candidates()
+
+    async def run_async(self, stop):
+        """Runs until the threading.Event stop is set."""
+        prober = DNSProber(timeout=min(self.timeout, self.interval))
+        ticks = 0
+        try:
+            while not stop.is_set():
+                started = time.monotonic()
+                if ticks % self.window == 0 or self.active is None:
+                    # Re-read the connection now and then, someone may have changed it by hand
+                    active = self._read_active()
+                    if active != self.active:
+                        self.active = active
+                        self.bad_streak = 0
+                        if active:
+                            self._emit("watching", server=active[0], ipv4=active[1], ipv6=active[2],
+                                       connection=self.connection)
+                    self._pick_candidates()
+                ticks += 1
+
+                if self.active:
+                    ips = [(self.active[1] + self.active[2])[0]] + \
+                          [ip for ip in map(self._address, self._candidates) if ip]
+                    await self._probe_all(prober, list(dict.fromkeys(ips)))
+                    target = self._evaluate(time.monotonic())
+                    if target is not None:
+                        self._switch(target, time.monotonic())
+
+                delay = max(0.0, self.interval - (time.monotonic() - started))
+                await asyncio.get_running_loop().run_in_executor(None, stop.wait, delay)
+        finally:
+            prober.close()
+
+    def run(self, stop):
+        asyncio.run(self.run_async(stop))
@@ -0,0 +1,168 @@
+DEAD = 9999  # Same marker the backend uses for failed probes
+# Measurements of a result/entry; each has <kind>, <kind>_stats and <kind>_samples (results) or last_<kind>
+KINDS = ("ping", "speed", "cached", "uncached")
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    pos = (len(ordered) - 1) * pct / 100.0
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(samples):
+    """
+    Summarizes probe samples in milliseconds (None or 9999 = lost) into
+    p50/p95/jitter/loss/samples. Latency fields are None when every sample was lost.
+    """
+    ok = [s for s in samples if s is not None and s != DEAD]
+    count = len(samples)
+    summary = {"p50": None, "p95": None, "jitter": None,
+               "loss": round(1 - len(ok) / count, 3) if count else 1.0, "samples": count}
+    if ok:
+        summary["p50"] = round(percentile(ok, 50), 1)
+        summary["p95"] = round(percentile(ok, 95), 1)
+        # Mean difference between consecutive samples (RFC 3550 style)
+        diffs = [abs(b - a) for a, b in zip(ok, ok[1:])]
+        summary["jitter"] = round(sum(diffs) / len(diffs), 1) if diffs else 0.0
+    return summary
+
+
+def headline(summary):
+    """The single number shown in last_ping/last_speed for a summary."""
+    return DEAD if summary["p50"] is None else round(summary["p50"])
+
+
+def entry_stats(entry, kind):
+    """
+    Returns the stored summary for kind ("ping" or "speed") of a DNS entry.
+    Entries tested before statistics existed are treated as one sample.
+    """
+    stored = entry.get(kind + "_stats")
+    if stored:
+        return stored
+    value = str(entry.get("last_" + kind, '-'))
+    try:
+        return summarize([float(value)])
+    except ValueError:
+        return None  # Never tested
+
+
+def is_wrong(entry):
+    """True when the correctness check found wrong answers (see verify.ResponseVerifier)."""
+    verdict = entry.get("verdict")
+    return bool(verdict) and verdict["ok"] is False
+
+
+def sort_key(entry, kind):
+    """Sort key for one column: untested last, then by p50, loss and p95. Wrong responders come last."""
+    if is_wrong(entry):
+        return (3, 0, 0, 0)  # Wrong answers: below every server that answers correctly, even dead ones
+    s = entry_stats(entry, kind)
+    if not s:
+        return (2, 0, 0, 0)
+    if s["p50"] is None:
+        return (1, 0, 0, 0)
+    return (0, s["p50"], s["loss"], s["p95"])
+
+
+def rank_key(entry):
+    """Overall ranking of a server: DNS speed first, then latency."""
+    return sort_key(entry, "speed") + sort_key(entry, "ping")
+
+
+def rank(data):
+    """Returns the keys of data ordered from best to worst."""
+    return sorted(data, key=lambda k: rank_key(data[k]))
+
+
+def violates_limits(entry, ping_limit, speed_limit, loss_limit):
+    """
+    Auto-clean rule. A server is removed when it gave wrong answers, lost every
+    sample, lost more than loss_limit of them, or its median is over the limit.
+    Untested values never count.
+    """
+    if is_wrong(entry):
+        return True
+    for kind, limit in (("ping", ping_limit), ("speed", speed_limit)):
+        s = entry_stats(entry, kind)
+        if not s:
+            continue
+        if s["p50"] is None or s["loss"] > loss_limit:
+            return True
+        if limit is not None and s["p50"] > limit:
+            return True
+    return False
+
+
+SCORES = ("best", "worst", "weighted")
+
+
+def _address_key(result, kind):
+    s = result.get(kind + "_stats")
+    if not s or s["p50"] is None:
+        return (1, 0, 0)
+    return (0, s["p50"], s["loss"])
+
+
+def combine_addresses(results, score="best"):
+    """
+    Combines the per-address engine results of one entry into an entry-level result.
+      best     - the stats of the fastest address (the entry is as good as its best IP)
+      worst    - the stats of the slowest address
+      weighted - the samples of all addresses pooled, so each address counts in
+                 proportion to how often it answered
+    The combined result keeps every per-address result under "addresses". It is
+    evicted when all of its addresses were (any of them for "worst").
+    """
+    results = list(results)
+    combined = {"key": results[0]["key"], "ping": None, "speed": None,
+                "addresses": {r["ip"]: r for r in results}}
+    evicted = [r["evicted"] for r in results]
+    combined["evicted"] = any(evicted) if score == "worst" else all(evicted)
+
+    for kind in KINDS:
+        measured = [r for r in results if r.get(kind) is not None]
+        if not measured:
+            continue
+        if score == "weighted":
+            summary = summarize([x for r in measured for x in r.get(kind + "_samples") or [r[kind]]])
+        else:
+            pick = max if score == "worst" else min
+            summary = pick(measured, key=lambda r: _address_key(r, kind))[kind + "_stats"]
+        combined[kind] = headline(summary)
+        combined[kind + "_stats"] = summary
+
+    # The address shown for the entry: the fastest one that answered
+    combined["ip"] = min(results, key=lambda r: _address_key(r, "speed") + _address_key(r, "ping"))["ip"]
+    combined["verdict"] = merge_verdicts(r.get("verdict") for r in results)
+    if "transports" in combined["addresses"][combined["ip"]]:
+        combined["transports"] = combined["addresses"][combined["ip"]]["transports"]
+    return combined
+
+
+def merge_verdicts(verdicts):
+    """Entry-level verdict of several addresses: wrong if any address is wrong, None if none was checked."""
+    verdicts = [v for v in verdicts if v and v["ok"] is not None]
+    if not verdicts:
+        return None
+    issues = sorted({i for v in verdicts for i in v["issues"]})
+    dnssec = [v["dnssec"] for v in verdicts if v["dnssec"] is not None]
+    return {"ok": not issues, "issues": issues, "dnssec": all(dnssec) if dnssec else None}
+
+
+def address_order(entry, ips):
+    """Orders ips of an entry by their measured DNS speed (then ping); untested addresses keep their place last."""
+    measured = entry.get("addresses") or {}
+
+    def key(ip):
+        m = measured.get(ip)
+        if not m:
+            return (2, 0, 0, 0, 0, 0)
+        return sort_key(m, "speed") + sort_key(m, "ping")[:2]
+
+    return sorted(ips, key=key)
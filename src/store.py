@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_FILE = os.path.expanduser("~/.ubuntu_dns_manager_data.db")
+
+# Entry fields that get their own column; everything else (stats, ...) goes to "extra"
+COLUMNS = ("ipv4", "ipv6", "last_ping", "last_speed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    name TEXT PRIMARY KEY,
+    ipv4 TEXT NOT NULL DEFAULT '[]',
+    ipv6 TEXT NOT NULL DEFAULT '[]',
+    last_ping,
+    last_speed,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS server_ips (
+    ip TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES servers(name) ON DELETE CASCADE,
+    PRIMARY KEY (ip, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS server_ips_name ON server_ips(name);
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _row(name, entry):
+    """Serializes an entry into the column tuple stored in the servers table."""
+    extra = {k: v for k, v in entry.items() if k not in COLUMNS}
+    return (name,
+            json.dumps(entry.get("ipv4", []), separators=(',', ':')),
+            json.dumps(entry.get("ipv6", []), separators=(',', ':')),
+            entry.get("last_ping", '-'),
+            entry.get("last_speed", '-'),
+            json.dumps(extra, separators=(',', ':')) if extra else None)
+
+
+def _entry(row):
+    name, ipv4, ipv6, last_ping, last_speed, extra = row
+    entry = {"ipv4": json.loads(ipv4), "ipv6": json.loads(ipv6), "last_ping": last_ping, "last_speed": last_speed}
+    if extra:
+        entry.update(json.loads(extra))
+    return name, entry
+
+
+class DNSStore:
+    """
+    SQLite (WAL) storage for the DNS list. Only rows that actually changed are
+    written, each batch in a single transaction, and servers are indexed by
+    name and by IP address.
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self._rows = {}  # name -> last row written/read, used to skip unchanged entries
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_source(self, url):
+        """Returns the cached fetch record (ETag, Last-Modified, hash, ...) of an update URL."""
+        with self.lock:
+            row = self.conn.execute("SELECT record FROM sources WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_source(self, url, record):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO sources (url, record) VALUES (?, ?)", (url, json.dumps(record)))
+
+    def migrate_json(self, json_path):
+        """One-time import of the old whole-file JSON list. The JSON file is left in place."""
+        if self.get_meta("migrated_json") or not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        data = {k: v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+        with self.lock:
+            self.upsert(data)
+            self.set_meta("migrated_json", json_path)
+        return len(data)
+
+    def load(self):
+        """Returns the whole list as an insertion-ordered dict of name -> entry."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, ipv4, ipv6, last_ping, last_speed, extra FROM servers ORDER BY rowid").fetchall()
+            self._rows = {row[0]: row for row in rows}
+        return dict(_entry(row) for row in rows)
+
+    def find_by_ip(self, ip):
+        """Returns the names of all entries that contain ip."""
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT name FROM server_ips WHERE ip = ?", (ip,))]
+
+    def upsert(self, entries):
+        """Writes the given name -> entry mapping in one transaction, skipping unchanged rows."""
+        with self.lock:
+            rows = [_row(name, entry) for name, entry in entries.items()]
+            rows = [row for row in rows if self._rows.get(row[0]) != row]
+            if not rows:
+                return 0
+            with self._transaction():
+                for row in rows:
+                    old = self._rows.get(row[0])
+                    self.conn.execute(
+                        "INSERT INTO servers (name, ipv4, ipv6, last_ping, last_speed, extra) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                        "ipv4 = excluded.ipv4, ipv6 = excluded.ipv6, last_ping = excluded.last_ping, "
+                        "last_speed = excluded.last_speed, extra = excluded.extra", row)
+                    if old is None or old[1:3] != row[1:3]:
+                        self.conn.execute("DELETE FROM server_ips WHERE name = ?", (row[0],))
+                        ips = json.loads(row[1]) + json.loads(row[2])
+                        self.conn.executemany("INSERT OR IGNORE INTO server_ips (ip, name) VALUES (?, ?)",
+                                              [(ip, row[0]) for ip in ips])
+            for row in rows:
+                self._rows[row[0]] = row
+            return len(rows)
+
+    def delete(self, names):
+        """Deletes the given entries in one transaction."""
+        names = list(names)
+        if not names:
+            return
+        with self.lock:
+            with self._transaction():
+                self.conn.executemany("DELETE FROM servers WHERE name = ?", [(n,) for n in names])
+            for n in names:
+                self._rows.pop(n, None)
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
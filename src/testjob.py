@@ -0,0 +1,102 @@
+import time
+
+
+def stale_keys(data, keys, mode, since):
+    """The keys whose entry was never tested in mode, or last before the epoch time since (None = all)."""
+    if since is None:
+        return list(keys)
+    stale = []
+    for key in keys:
+        entry = data.get(key)
+        if entry is not None and (entry.get('tested') or {}).get(mode, 0) < since:
+            stale.append(key)
+    return stale
+
+
+class TestJob:
+    """
+    One benchmark run as a job that can be paused, resumed and cancelled from
+    any thread, and that survives being interrupted.
+
+    Results are recorded into the list as they come in, and the list and the
+    probe history are checkpointed every checkpoint_interval seconds. The job
+    stays in the store until the run ends without being cancelled, so after a
+    stop, a crash or closing the app, the next job of the same mode resumes
+    it: entries tested since the interrupted job started are skipped. With
+    max_age, entries tested in mode within the last max_age seconds are
+    skipped as well. resume=False ignores an interrupted job and starts over.
+    Results are recorded, but evicted servers are not deleted: the caller
+    does that (the GUI from its main loop, the CLI at the end).
+    """
+
+    def __init__(self, backend, engine, mode, keys=None, max_age=0, checkpoint_interval=30, all_addresses=True,
+                 resume=True):
+        self.backend = backend
+        self.engine = engine
+        self.mode = mode
+        self.checkpoint_interval = float(checkpoint_interval)
+        data = backend.model
+        keys = list(data) if keys is None else list(keys)
+
+        now = time.time()
+        since = now - max_age if max_age else None
+        interrupted = backend.get_test_job(mode) if resume else None
+        self.resumed = interrupted is not None
+        if self.resumed:
+            since = interrupted["started"] if since is None else min(since, interrupted["started"])
+        self.started = interrupted["started"] if self.resumed else now
+        self.keys = stale_keys(data, keys, mode, since)
+        self.skipped = len(keys) - len(self.keys)
+        self.targets = backend.test_targets(data, self.keys, all_addresses=all_addresses)
+        self._last_checkpoint = time.monotonic()
+
+    def pause(self):
+        self.engine.pause()
+
+    def resume(self):
+        self.engine.resume()
+
+    def cancel(self):
+        self.engine.cancel()
+
+    @property
+    def paused(self):
+        return self.engine.paused
+
+    @property
+    def cancelled(self):
+        return self.engine.cancelled
+
+    def checkpoint(self):
+        """Writes the results recorded so far (list and probe history)."""
+        try:
+            self.backend.model.flush()
+        except Exception as e:
+            print(f"Error saving DNS list: {e}")
+        self.backend.flush_history()
+        self._last_checkpoint = time.monotonic()
+
+    def run(self, on_result=None, **run_kw):
+        """
+        Runs the engine over the selected targets (run_kw as for
+        BenchmarkEngine.run). on_result(result) is called after each result
+        is recorded. Returns the results of this run.
+        """
+        self.backend.set_test_job(self.mode, {"mode": self.mode, "started": self.started})
+
+        def record(res):
+            self.backend.record_history(res)
+            if not res["evicted"]:
+                self.backend.record(res["key"], res)
+            if on_result:
+                on_result(res)
+            if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+
+        try:
+            results = self.engine.run(self.targets, mode=self.mode, on_result=record, **run_kw)
+            if not self.engine.cancelled:
+                self.backend.set_test_job(self.mode, None)
+        finally:
+            self.checkpoint()
+        return results
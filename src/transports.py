@@ -0,0 +1,208 @@
+import asyncio
+import random
+import ssl
+import struct
+import time
+import urllib.parse
+
+import metrics
+from dnsprobe import DEAD, QTYPE_A, build_query, parse_header
+from stats import summarize
+
+
+class StreamTransport:
+    """
+    Connection-oriented DNS transport (base class). One connection is opened
+    and reused for every query until it breaks; connection setup and query
+    time are measured separately. Must be used from inside a running event loop.
+    """
+
+    name = None
+    default_port = None
+
+    def __init__(self, server, port=None, timeout=2.0, verify=False, server_name=None):
+        self.server = server
+        self.port = port or self.default_port
+        self.timeout = float(timeout)
+        self.verify = verify  # Verify the TLS certificate (public resolvers addressed by IP often fail this)
+        self.server_name = server_name  # SNI / certificate name, defaults to the address
+        self.reader = None
+        self.writer = None
+        self.setups = []  # Seconds of every connection setup, reconnects included
+
+    def _ssl_context(self):
+        ctx = ssl.create_default_context()
+        if not self.verify:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        return ctx
+
+    def _open_args(self):
+        return {}
+
+    def _txid(self):
+        return random.getrandbits(16)
+
+    async def _exchange(self, message):
+        raise NotImplementedError
+
+    async def connect(self):
+        """Opens the connection and returns the setup time in seconds (TCP connect, plus TLS handshake)."""
+        self.close()
+        start = time.monotonic()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port, **self._open_args()), self.timeout)
+        elapsed = time.monotonic() - start
+        self.setups.append(elapsed)
+        return elapsed
+
+    async def query(self, domain, qtype=QTYPE_A):
+        """
+        Sends one query over the open connection (connecting first if needed,
+        which is not counted) and returns (elapsed_seconds, raw_response).
+        """
+        if self.writer is None or self.writer.is_closing():
+            await self.connect()
+        txid = self._txid()
+        start = time.monotonic()
+        try:
+            data = await asyncio.wait_for(self._exchange(build_query(domain, txid, qtype)), self.timeout)
+        except BaseException:
+            self.close()  # The stream is in an unknown state
+            raise
+        elapsed = time.monotonic() - start
+        header = parse_header(data)
+        if header is None or header[0] != txid:
+            self.close()
+            raise ValueError("Response does not match the query")
+        return elapsed, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class TCPTransport(StreamTransport):
+    """DNS over TCP (RFC 7766): two byte length prefix per message."""
+
+    name = "tcp"
+    default_port = 53
+
+    async def _exchange(self, message):
+        self.writer.write(struct.pack('!H', len(message)) + message)
+        await self.writer.drain()
+        size, = struct.unpack('!H', await self.reader.readexactly(2))
+        return await self.reader.readexactly(size)
+
+
+class TLSTransport(TCPTransport):
+    """DNS over TLS (RFC 7858): the TCP framing inside a TLS session on port 853."""
+
+    name = "dot"
+    default_port = 853
+
+    def _open_args(self):
+        return {"ssl": self._ssl_context(), "server_hostname": self.server_name or self.server}
+
+
+class HTTPSTransport(StreamTransport):
+    """
+    DNS over HTTPS (RFC 8484): POST application/dns-message over one
+    HTTP/1.1 keep-alive connection. url is a template with {ip}; http:// URLs
+    are accepted for local testing.
+    """
+
+    name = "doh"
+
+    def __init__(self, server, url="https://{ip}/dns-query", **kw):
+        host = '[%s]' % server if ':' in server else server
+        self.url = urllib.parse.urlsplit(url.format(ip=host))
+        self.tls = self.url.scheme == "https"
+        super().__init__(server, port=self.url.port or (443 if self.tls else 80), **kw)
+
+    def _open_args(self):
+        if not self.tls:
+            return {}
+        return {"ssl": self._ssl_context(), "server_hostname": self.server_name or self.url.hostname}
+
+    def _txid(self):
+        return 0  # RFC 8484: the ID should be 0 so responses are cache friendly
+
+    async def _exchange(self, message):
+        request = ("POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/dns-message\r\n"
+                   "Accept: application/dns-message\r\nContent-Length: %d\r\n\r\n"
+                   % (self.url.path or '/', self.url.netloc, len(message)))
+        self.writer.write(request.encode('ascii') + message)
+        await self.writer.drain()
+
+        status = (await self.reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(status) < 2 or status[1] != "200":
+            raise ValueError("HTTP status %s" % (status[1] if len(status) > 1 else "missing"))
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = await self._read_chunked()
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return body
+
+    async def _read_chunked(self):
+        """Reads a Transfer-Encoding: chunked body (RFC 9112 section 7.1), trailers included."""
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0].strip(), 16)
+            if not size:
+                break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)  # CRLF after the chunk data
+        while (await self.reader.readline()).strip():
+            pass  # Trailer fields, up to the empty line
+        return b''.join(chunks)
+
+
+TRANSPORTS = {"tcp": TCPTransport, "dot": TLSTransport, "doh": HTTPSTransport}
+
+
+def make_transport(name, server, timeout=2.0, verify=False, doh_url="https://{ip}/dns-query"):
+    if name == "doh":
+        return HTTPSTransport(server, url=doh_url, timeout=timeout, verify=verify)
+    return TRANSPORTS[name](server, timeout=timeout, verify=verify)
+
+
+async def probe_transport(transport, domain, samples=3, interval=0.2):
+    """
+    Measures one transport of one server: a connection setup, then samples
+    queries over that same connection. Returns
+    {"setup": ms or None, "setup_stats", "reconnects", "query_stats", "query_samples"};
+    latencies are in ms, 9999 = lost.
+    """
+    queries = []
+    try:
+        try:
+            await transport.connect()
+        except Exception as e:
+            metrics.SOCKET_ERRORS.labels(transport.name, metrics.error_name(e)).inc()
+            return {"setup": None, "setup_stats": summarize([DEAD]), "reconnects": 0,
+                    "query_stats": summarize([DEAD] * samples), "query_samples": [DEAD] * samples}
+        for i in range(samples):
+            if i:
+                await asyncio.sleep(interval)
+            try:
+                elapsed, _data = await transport.query(domain)
+                queries.append(int(round(elapsed * 1000)))
+            except Exception as e:
+                metrics.SOCKET_ERRORS.labels(transport.name, metrics.error_name(e)).inc()
+                queries.append(DEAD)
+    finally:
+        transport.close()
+    setups = [int(round(s * 1000)) for s in transport.setups]
+    return {"setup": setups[0], "setup_stats": summarize(setups), "reconnects": len(setups) - 1,
+            "query_stats": summarize(queries), "query_samples": queries}
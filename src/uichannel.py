@@ -0,0 +1,75 @@
+import queue
+
+import metrics
+
+_UPDATE, _DELETE, _PROGRESS, _CLOSE = range(4)
+
+
+class UIUpdateChannel:
+    """
+    Thread-safe channel from worker threads to the Tk main loop.
+    Workers put row updates, deletions and progress from any thread; the main
+    loop drains the queue every interval_ms and hands one coalesced batch to
+    apply_batch(updates, deletes, progress):
+      updates  - dict key -> latest payload (keys that were deleted are dropped)
+      deletes  - list of keys, in arrival order
+      progress - latest progress value, or None if none arrived
+    """
+
+    def __init__(self, root, apply_batch, interval_ms=100, on_close=None):
+        self.root = root
+        self.apply_batch = apply_batch
+        self.interval_ms = max(10, int(interval_ms))
+        self.on_close = on_close
+        self._queue = queue.SimpleQueue()
+        self._job = None
+
+    def start(self):
+        if self._job is None:
+            self._job = self.root.after(self.interval_ms, self._tick)
+
+    def put_update(self, key, payload):
+        self._queue.put((_UPDATE, key, payload))
+
+    def put_delete(self, key):
+        self._queue.put((_DELETE, key, None))
+
+    def put_progress(self, progress):
+        self._queue.put((_PROGRESS, None, progress))
+
+    def close(self):
+        """Called by the producer when it is done; the last batch is flushed on the next tick."""
+        self._queue.put((_CLOSE, None, None))
+
+    def _drain(self):
+        updates, deletes, progress, closed = {}, {}, None, False
+        while True:
+            try:
+                kind, key, payload = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == _UPDATE:
+                if key not in deletes:
+                    updates[key] = payload
+            elif kind == _DELETE:
+                updates.pop(key, None)
+                deletes[key] = None
+            elif kind == _PROGRESS:
+                progress = payload
+            else:
+                closed = True
+        return updates, list(deletes), progress, closed
+
+    def _tick(self):
+        metrics.UI_QUEUE_DEPTH.set(self._queue.qsize())
+        updates, deletes, progress, closed = self._drain()
+        try:
+            if updates or deletes or progress is not None:
+                self.apply_batch(updates, deletes, progress)
+        finally:
+            if closed:
+                self._job = None
+                if self.on_close:
+                    self.on_close()
+            else:
+                self._job = self.root.after(self.interval_ms, self._tick)
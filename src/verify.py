@@ -0,0 +1,85 @@
+import asyncio
+import random
+
+from dnsprobe import (FLAG_AD, FLAG_RD, RCODE_NOERROR, RCODE_NXDOMAIN, RCODE_REFUSED, RCODE_SERVFAIL,
+                      parse_response)
+
+# Issues that make a server's answers untrustworthy
+ISSUES = ("refused", "servfail", "empty_answer", "wrong_answer", "nxdomain_hijack", "bogus_ad", "no_dnssec")
+
+
+class ResponseVerifier:
+    """
+    Checks that a resolver gives correct answers, using the UDP queries of a DNSProber:
+      - domain must resolve (NOERROR) to an address of the reference set,
+      - a random name under nx_domain must give NXDOMAIN without answers,
+      - dnssec_domain (signed) tells whether the resolver validates (AD bit),
+      - dnssec_bogus_domain (broken signatures) must never come back with AD set.
+    The reference set is the static answers plus whatever the reference
+    servers return for domain (see prepare).
+    """
+
+    def __init__(self, prober, domain="dns.google", reference_servers=(), static_answers=(), nx_domain="example.com",
+                 dnssec_domain="isc.org", dnssec_bogus_domain="dnssec-failed.org", require_dnssec=False):
+        self.prober = prober
+        self.domain = domain
+        self.reference_servers = list(reference_servers)
+        self.reference = set(static_answers)
+        self.nx_domain = nx_domain
+        self.dnssec_domain = dnssec_domain
+        self.dnssec_bogus_domain = dnssec_bogus_domain
+        self.require_dnssec = require_dnssec
+
+    async def _ask(self, ip, name, flags=FLAG_RD):
+        """Parsed response of one query, or None when the server didn't answer."""
+        try:
+            _elapsed, data = await self.prober.query(ip, name, flags=flags)
+        except Exception:
+            return None
+        return parse_response(data)
+
+    async def prepare(self):
+        """Adds the answers of the reference servers for domain to the reference set."""
+        for response in await asyncio.gather(*(self._ask(ip, self.domain) for ip in self.reference_servers)):
+            if response and response["rcode"] == RCODE_NOERROR:
+                self.reference.update(response["answers"])
+        return self.reference
+
+    async def check(self, ip):
+        """
+        Returns {"ok": bool or None, "issues": [...], "dnssec": bool or None}.
+        ok is None when the server didn't answer the main query at all; that is
+        loss, which the speed test already judges.
+        """
+        known, nx, signed, bogus = await asyncio.gather(
+            self._ask(ip, self.domain),
+            self._ask(ip, "%08x.%s" % (random.getrandbits(32), self.nx_domain)),
+            self._ask(ip, self.dnssec_domain, FLAG_RD | FLAG_AD),
+            self._ask(ip, self.dnssec_bogus_domain, FLAG_RD | FLAG_AD))
+        verdict = {"ok": None, "issues": [], "dnssec": None}
+        if known is None:
+            return verdict
+        issues = verdict["issues"]
+
+        if known["rcode"] == RCODE_REFUSED:
+            issues.append("refused")
+        elif known["rcode"] == RCODE_SERVFAIL:
+            issues.append("servfail")
+        elif known["rcode"] != RCODE_NOERROR or not known["answers"]:
+            issues.append("empty_answer")
+        elif self.reference and not self.reference.intersection(known["answers"]):
+            issues.append("wrong_answer")
+
+        if nx is not None and nx["rcode"] != RCODE_NXDOMAIN and nx["answers"]:
+            issues.append("nxdomain_hijack")
+
+        if signed is not None and signed["rcode"] == RCODE_NOERROR:
+            verdict["dnssec"] = signed["ad"]
+        if bogus is not None and bogus["ad"]:
+            issues.append("bogus_ad")  # Claims to have validated a broken signature
+        if self.require_dnssec and verdict["dnssec"] is False:
+            issues.append("no_dnssec")
+
+        verdict["ok"] = not issues
+        return verdict
+